@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Measure how many dependency objects a feed with many versions needs.
+
+The feed has a few groups, each with the same <requires> (with a version
+range and an <environment> binding) and its own binding, and many versions
+in each group. Implementations that add nothing to their group should share
+its dependencies, and identical <requires> in different groups should share
+a single object, so the counts below should not grow with the number of
+versions.
+
+Usage: python feedmem.py [MAX_VERSIONS]
+"""
+
+import os
+import sys
+import random
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from zeroinstall.injector import qdom
+from zeroinstall.injector import model
+from zeroinstall.injector import feedloader
+
+
+_FEED = """<?xml version="1.0"?>
+<interface xmlns="http://zero-install.sourceforge.net/2004/injector/interface"
+           uri="http://example.com/many.xml">
+  <name>many</name>
+  <summary>many versions</summary>
+  %(groups)s
+</interface>
+"""
+
+_GROUP = """<group arch="*-*">
+  <requires interface="http://example.com/lib.xml">
+    <version not-before="1.0" before="2.0"/>
+    <environment name="LIB_PATH" insert="lib"/>
+  </requires>
+  <environment name="PATH" insert="bin%(group)d"/>
+  %(impls)s
+</group>"""
+
+_IMPL = """<implementation id="sha1new=%(digest)040x" version="%(version)s"
+    stability="stable"><archive href="http://example.com/%(version)s.tgz"
+    size="100"/></implementation>"""
+
+_GROUPS = 4
+
+
+def make_feed(n_versions):
+    rand = random.Random(n_versions)
+    groups = []
+    for group in range(_GROUPS):
+        impls = []
+        for i in range(n_versions // _GROUPS):
+            impls.append(_IMPL % {
+                'digest': rand.getrandbits(160),
+                'version': '%d.%d' % (group, i),
+                })
+        groups.append(_GROUP % {'group': group, 'impls': '\n  '.join(impls)})
+    return _FEED % {'groups': '\n  '.join(groups)}
+
+
+def measure(feed):
+    """Count (and size) the distinct dependency-related objects in feed."""
+    seen = {}
+
+    def add(kind, obj):
+        if id(obj) not in seen:
+            seen[id(obj)] = (kind, sys.getsizeof(obj))
+
+    for impl in feed.implementations.values():
+        add('requires lists', impl.requires)
+        add('bindings lists', impl.bindings)
+        for binding in impl.bindings:
+            add('bindings', binding)
+        for dep in impl.requires:
+            add('dependencies', dep)
+            for restriction in dep.restrictions:
+                add('restrictions', restriction)
+            for binding in dep.bindings:
+                add('bindings', binding)
+
+    counts = {}
+    size = 0
+    for kind, obj_size in seen.values():
+        counts[kind] = counts.get(kind, 0) + 1
+        size += obj_size
+    return counts, size
+
+
+def main():
+    max_versions = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    kinds = ['requires lists', 'bindings lists', 'dependencies',
+             'restrictions', 'bindings']
+
+    for name, parse in [
+            ('qdom', lambda data: model.ZeroInstallFeed(qdom.parse(StringIO(data)))),
+            ('feedloader', lambda data: feedloader.load_feed(StringIO(data)))]:
+        print name
+        print '%10s' % 'versions' + ''.join(['%16s' % k for k in kinds]) + '%12s' % 'bytes'
+        n_versions = 20
+        while n_versions <= max_versions:
+            counts, size = measure(parse(make_feed(n_versions)))
+            print '%10d' % n_versions + ''.join(['%16d' % counts.get(k, 0) for k in kinds]) + '%12d' % size
+            n_versions *= 10
+        print
+
+
+if __name__ == '__main__':
+    main()
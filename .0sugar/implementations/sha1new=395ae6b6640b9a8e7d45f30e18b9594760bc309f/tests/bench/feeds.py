@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Compare the feed parsers on synthetic feeds of increasing size.
+
+Each feed has groups of implementations with dependencies, bindings,
+archives and long descriptions. It is parsed both by building a qdom tree
+and passing it to ZeroInstallFeed (the old way) and by feedloader.load_feed,
+and the results are checked to be the same.
+
+Usage: python feeds.py [MAX_IMPLEMENTATIONS]
+"""
+
+import os
+import sys
+import time
+import random
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from zeroinstall.injector import qdom
+from zeroinstall.injector import model
+from zeroinstall.injector import feedloader
+
+
+_FEED = """<?xml version="1.0"?>
+<interface xmlns="http://zero-install.sourceforge.net/2004/injector/interface"
+           xmlns:compile="http://zero-install.sourceforge.net/2006/namespaces/0compile"
+           uri="http://example.com/bench.xml">
+  <name>bench</name>
+  <summary>benchmark feed</summary>
+  <description>%(description)s</description>
+  <homepage>http://example.com</homepage>
+  %(groups)s
+</interface>
+"""
+
+_GROUP = """<group license="GPL" main="bin/bench" arch="*-*">
+  <requires interface="http://example.com/lib%(group)d.xml">
+    <version not-before="1.%(group)d" before="2"/>
+    <environment name="LD_LIBRARY_PATH" insert="lib"/>
+  </requires>
+  <environment name="PATH" insert="bin"/>
+  %(impls)s
+</group>"""
+
+_IMPL = """<implementation id="sha1new=%(digest)040x" version="1.%(group)d.%(impl)d"
+      stability="%(stability)s" released="2010-01-01">
+    <compile:implementation command="make"><compile:note>%(description)s</compile:note></compile:implementation>
+    <archive href="http://example.com/bench-1.%(group)d.%(impl)d.tgz" size="%(size)d"/>
+  </implementation>"""
+
+
+def make_feed(n_impls, impls_per_group=20):
+    rand = random.Random(n_impls)
+    description = ' '.join(['Text'] * 200)
+    groups = []
+    for group in range(max(1, n_impls // impls_per_group)):
+        impls = []
+        for impl in range(impls_per_group):
+            impls.append(_IMPL % {
+                'digest': rand.getrandbits(160),
+                'group': group,
+                'impl': impl,
+                'stability': rand.choice(['stable', 'testing', 'buggy']),
+                'size': rand.randint(1, 100000),
+                'description': description,
+                })
+        groups.append(_GROUP % {'group': group, 'impls': '\n  '.join(impls)})
+    return _FEED % {'description': description, 'groups': '\n  '.join(groups)}
+
+
+def dump(feed):
+    impls = []
+    for impl in sorted(feed.implementations.values(), key=lambda i: i.id):
+        impls.append((impl.id, impl.version, impl.upstream_stability,
+            sorted(impl.metadata.items()),
+            [(s.url, s.size) for s in impl.download_sources],
+            [(b.name, b.insert) for b in impl.bindings],
+            [(d.interface, map(str, d.restrictions)) for d in impl.requires]))
+    return feed.name, feed.summary, feed.description, impls
+
+
+def time_parse(parse, data, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        feed = parse(data)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, feed
+
+
+def main():
+    max_impls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    def with_qdom(data):
+        return model.ZeroInstallFeed(qdom.parse(StringIO(data)))
+
+    def with_feedloader(data):
+        return feedloader.load_feed(StringIO(data))
+
+    print '%8s %10s %12s %12s %8s' % ('impls', 'size (KB)', 'qdom (MB/s)',
+            'loader (MB/s)', 'speedup')
+    n_impls = 20
+    while n_impls <= max_impls:
+        data = make_feed(n_impls)
+        repeat = max(1, 2000 // n_impls)
+        old_time, old_feed = time_parse(with_qdom, data, repeat)
+        new_time, new_feed = time_parse(with_feedloader, data, repeat)
+        assert dump(old_feed) == dump(new_feed)
+
+        mb = len(data) / float(1 << 20)
+        print '%8d %10d %12.2f %12.2f %7.2fx' % (n_impls, len(data) // 1024,
+                mb / old_time, mb / new_time, old_time / new_time)
+        n_impls *= 5
+
+
+if __name__ == '__main__':
+    main()
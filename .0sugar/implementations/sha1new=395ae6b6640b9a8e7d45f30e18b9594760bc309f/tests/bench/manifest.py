@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Compare manifest generation with different numbers of worker processes.
+
+A synthetic implementation is created with a mix of large files (like
+libraries and data files) and many small ones (like scripts and icons), in
+nested directories. Its manifest is generated with 1, 2 and one-per-CPU
+worker processes, and the results are checked to be identical.
+
+Usage: python manifest.py [SIZE_MB]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from zeroinstall.zerostore import manifest
+
+
+def make_tree(root, size_mb):
+    rand = random.Random(size_mb)
+    chunk = ''.join([chr(rand.randrange(256)) for i in range(1 << 16)])
+    n_big = max(2, size_mb // 8)
+    for i in range(n_big):
+        path = os.path.join(root, 'lib%d' % (i % 4))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        stream = file(os.path.join(path, 'big%d.so' % i), 'w')
+        for block in range(size_mb * 16 // n_big):
+            stream.write(chunk[block % 16:] + chunk[:block % 16])
+        stream.write(str(i))
+        stream.close()
+    for i in range(2000):
+        path = os.path.join(root, 'share', 'dir%d' % (i % 50))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        stream = file(os.path.join(path, 'small%d.png' % i), 'w')
+        stream.write(chunk[i:i + rand.randrange(100, 4000)])
+        stream.close()
+
+
+def time_manifest(alg, root, workers):
+    start = time.time()
+    digest = alg.new_digest()
+    lines = []
+    for line in manifest.generate_manifest_parallel(alg, root, workers):
+        digest.update(line + '\n')
+        lines.append(line)
+    return time.time() - start, alg.getID(digest), lines
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    try:
+        cpus = manifest.multiprocessing.cpu_count()
+    except (AttributeError, NotImplementedError):
+        cpus = 1
+
+    root = tempfile.mkdtemp(prefix='0install-bench-')
+    try:
+        make_tree(root, size_mb)
+        alg = manifest.get_algorithm('sha1new')
+        # Warm the page cache, so the first run isn't penalised
+        time_manifest(alg, root, 1)
+
+        print '%8s %10s %10s %8s' % ('workers', 'time (s)', 'MB/s', 'speedup')
+        base = expected = None
+        for workers in sorted(set([1, 2, cpus])):
+            elapsed, digest, lines = time_manifest(alg, root, workers)
+            if expected is None:
+                base, expected = elapsed, (digest, lines)
+            assert (digest, lines) == expected
+            print '%8d %10.2f %10.1f %7.2fx' % (workers, elapsed,
+                    size_mb / elapsed, base / elapsed)
+        print expected[0]
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Compare the solvers on synthetic feed graphs with conflicting dependencies.
+
+Each graph is a chain X1 -> X2 -> ... -> Xn, every interface having versions
+1 and 2. X1-2 needs L >= 2 (before X2), but Xn needs L < 2, so the only
+solution is X1-1 with everything else at version 2. The default solver only
+finds that after trying every combination of X2..Xn versions (2^n), while the
+SAT solver learns the conflict once.
+
+Usage: python solver.py [MAX_CHAIN_LENGTH]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from zeroinstall.support import basedir
+from zeroinstall.injector import iface_cache
+from zeroinstall.injector import arch
+from zeroinstall.injector import model
+from zeroinstall.injector.solver import DefaultSolver, SATSolver
+
+
+_FEED = """<?xml version="1.0"?>
+<interface xmlns="http://zero-install.sourceforge.net/2004/injector/interface">
+  <name>%(name)s</name>
+  <summary>%(name)s</summary>
+  <description>%(name)s</description>
+  %(impls)s
+</interface>
+"""
+
+_IMPL = """<implementation id="%(id)s" version="%(version)s" stability="stable">
+    %(requires)s
+    <archive href="http://localhost/%(id)s.tgz" size="10"/>
+  </implementation>"""
+
+_REQUIRES = """<requires interface="%(uri)s">%(version)s</requires>"""
+
+
+def write_feed(root, name, impls):
+    uri = os.path.join(root, name + '.xml')
+    text = []
+    for version, requires in impls:
+        deps = []
+        for dep_name, restriction in requires:
+            deps.append(_REQUIRES % {
+                'uri': os.path.join(root, dep_name + '.xml'),
+                'version': restriction and '<version %s/>' % restriction or '',
+                })
+        text.append(_IMPL % {
+            'id': 'sha1new=%040x' % abs(hash((name, version))),
+            'version': version,
+            'requires': '\n    '.join(deps),
+            })
+    f = file(uri, 'w')
+    f.write(_FEED % {'name': name, 'impls': '\n  '.join(text)})
+    f.close()
+    return uri
+
+
+def create_chain(root, length):
+    write_feed(root, 'L', [('1', []), ('2', [])])
+    for i in range(1, length + 1):
+        impls = []
+        for version in ('1', '2'):
+            requires = []
+            if i == 1 and version == '2':
+                requires.append(('L', 'not-before="2"'))
+            if i < length:
+                requires.append(('X%d' % (i + 1), None))
+            else:
+                requires.append(('L', 'before="2"'))
+            impls.append((version, requires))
+        uri = write_feed(root, 'X%d' % i, impls)
+        if i == 1:
+            root_uri = uri
+    return root_uri
+
+
+def solve(solver_class, root_uri):
+    iface_cache.iface_cache.__init__()
+    solver = solver_class(model.network_full, iface_cache.iface_cache,
+            iface_cache.iface_cache.stores)
+    start = time.time()
+    solver.solve(root_uri, arch.get_host_architecture())
+    elapsed = time.time() - start
+    assert solver.ready
+    selections = sorted((iface.uri, impl.get_version())
+            for iface, impl in solver.selections.items())
+    return elapsed, selections
+
+
+def main():
+    max_length = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+
+    tmp = tempfile.mkdtemp(prefix='0sugar-bench-')
+    try:
+        for name in ('XDG_CONFIG_HOME', 'XDG_CACHE_HOME', 'XDG_DATA_HOME'):
+            os.environ[name] = os.path.join(tmp, name)
+            os.makedirs(os.environ[name])
+        for name in ('XDG_CONFIG_DIRS', 'XDG_CACHE_DIRS', 'XDG_DATA_DIRS'):
+            os.environ[name] = ''
+        reload(basedir)
+
+        print '%8s %12s %12s %8s' % ('length', 'default (s)', 'sat (s)', 'speedup')
+        for length in range(2, max_length + 1, 2):
+            feeds = os.path.join(tmp, 'feeds-%d' % length)
+            os.makedirs(feeds)
+            root_uri = create_chain(feeds, length)
+
+            default_time, default_selections = solve(DefaultSolver, root_uri)
+            sat_time, sat_selections = solve(SATSolver, root_uri)
+            assert default_selections == sat_selections, \
+                    (default_selections, sat_selections)
+
+            print '%8d %12.4f %12.4f %7.1fx' % (length, default_time,
+                    sat_time, default_time / max(sat_time, 1e-6))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
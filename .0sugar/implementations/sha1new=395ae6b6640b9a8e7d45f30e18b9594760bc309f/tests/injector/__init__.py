@@ -0,0 +1,57 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+_XDG = ['xdg_cache_home', 'xdg_cache_dirs', 'xdg_config_home',
+        'xdg_config_dirs', 'xdg_data_home', 'xdg_data_dirs']
+
+NS = 'http://zero-install.sourceforge.net/2004/injector/interface'
+
+
+class TestInjector(unittest.TestCase):
+    """Runs each test with empty XDG directories and a fresh interface cache."""
+
+    def setUp(self):
+        from zeroinstall.support import basedir
+        from zeroinstall.injector.iface_cache import iface_cache
+
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.saved_xdg = [getattr(basedir, name) for name in _XDG]
+        for kind in ['cache', 'config', 'data']:
+            home = os.path.join(self.tmp, kind)
+            os.mkdir(home)
+            setattr(basedir, 'xdg_%s_home' % kind, home)
+            setattr(basedir, 'xdg_%s_dirs' % kind, [home])
+        basedir.invalidate()
+        iface_cache.__init__()
+
+    def tearDown(self):
+        from zeroinstall.support import basedir
+        from zeroinstall.injector.iface_cache import iface_cache
+
+        iface_cache.flush_user_overrides()
+        iface_cache.__init__()
+        for name, value in zip(_XDG, self.saved_xdg):
+            setattr(basedir, name, value)
+        basedir.invalidate()
+        shutil.rmtree(self.tmp)
+
+    def write_feed(self, uri, body, mtime=None):
+        """Put a feed in the cache, as if it had been downloaded."""
+        from zeroinstall.support import basedir
+        from zeroinstall.injector.model import escape
+
+        path = os.path.join(basedir.save_cache_path('0install.net', 'interfaces'),
+                escape(uri))
+        stream = file(path, 'w')
+        stream.write('<?xml version="1.0" ?>\n<interface xmlns="%s" uri="%s">\n'
+                '<name>%s</name><summary>test</summary>\n%s</interface>\n' %
+                (NS, uri, os.path.basename(uri), body))
+        stream.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
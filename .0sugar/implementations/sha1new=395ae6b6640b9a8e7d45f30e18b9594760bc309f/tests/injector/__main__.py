@@ -0,0 +1,20 @@
+import unittest
+
+import os
+import sys
+sys.path[0] = os.path.abspath(os.curdir)
+
+from rootattr import *
+from basedirs import *
+from useroverrides import *
+from backgrounds import *
+from snapshots import *
+from solvers import *
+from readers import *
+from models import *
+from feedindexes import *
+from ifacecaches import *
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from __init__ import *
+from zeroinstall.injector import background, overrides
+from zeroinstall.injector.iface_cache import iface_cache
+from zeroinstall.injector.policy import Policy
+
+PROG = 'http://example.com/prog.xml'
+
+
+class TestBackground(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        self.write_feed(PROG, '<implementation id="sha1=1" version="1"/>')
+        self.check_for_updates = background._check_for_updates
+
+    def tearDown(self):
+        background._check_for_updates = self.check_for_updates
+        TestInjector.tearDown(self)
+
+    def test_settings_saved(self):
+        def check_for_updates(policy, verbose):
+            element = overrides.make_element(PROG)
+            element.attrs['last-checked'] = '123'
+            iface_cache.get_user_overrides().set(PROG, element)
+        background._check_for_updates = check_for_updates
+
+        policy = Policy(PROG)
+        policy.solver.solve(policy.root, policy.target_arch)
+        background.spawn_background_update(policy, False)
+
+        # The detached process exits with os._exit, so atexit handlers don't save them
+        path = iface_cache.get_user_overrides().path
+        deadline = time.time() + 10
+        while True:
+            element = overrides.OverridesStore(path).get(PROG)
+            if element is not None or time.time() > deadline:
+                break
+            time.sleep(0.05)
+        self.assert_(element is not None)
+        self.assertEquals('123', element.getAttribute('last-checked'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+
+
+class TestListings(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        self.dir = os.path.join(self.tmp, 'dir')
+        os.mkdir(self.dir)
+        self.set_mtime(int(time.time()))
+
+    def set_mtime(self, mtime):
+        self.mtime = mtime
+        os.utime(self.dir, (mtime, mtime))
+
+    def add_file(self, name):
+        # Create a file without changing the directory's mtime, as on a
+        # filesystem with coarse timestamps
+        file(os.path.join(self.dir, name), 'w').close()
+        os.utime(self.dir, (self.mtime, self.mtime))
+
+    def expire(self):
+        for listing in basedir._listings.values():
+            listing.checked = 0
+
+    def test_cached(self):
+        self.set_mtime(int(time.time()) - 10)
+        self.assertEquals(False, basedir._exists(self.dir, 'a'))
+        self.add_file('a')
+        self.expire()
+        # (the mtime is unchanged and old enough to trust)
+        self.assertEquals(False, basedir._exists(self.dir, 'a'))
+        basedir.invalidate()
+        self.assertEquals(True, basedir._exists(self.dir, 'a'))
+
+    def test_same_second(self):
+        self.assertEquals(False, basedir._exists(self.dir, 'a'))
+        self.add_file('a')
+        self.expire()
+        self.assertEquals(True, basedir._exists(self.dir, 'a'))
+
+    def test_changing(self):
+        path = basedir.save_cache_path('test')
+        old = time.time() - 10
+        os.utime(path, (old, old))
+        self.assertEquals(None, basedir.load_first_cache('test', 'a'))
+
+        # The caller checks for an existing file before writing it
+        path = basedir.save_cache_path('test')
+        self.assertEquals(None, basedir.load_first_cache('test', 'a'))
+        file(os.path.join(path, 'a'), 'w').close()
+        self.assertEquals(os.path.join(path, 'a'), basedir.load_first_cache('test', 'a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
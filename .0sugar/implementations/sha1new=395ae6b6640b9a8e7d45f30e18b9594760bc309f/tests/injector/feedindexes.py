@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.injector import feedindex, feedloader, overrides, reader
+from zeroinstall.injector.iface_cache import iface_cache
+from zeroinstall.injector.model import escape
+
+PROG = 'http://example.com/prog.xml'
+EXTRA = 'http://example.com/extra.xml'
+
+_LEGACY = """<?xml version="1.0" ?>
+<interface-preferences xmlns="%s" uri="%%s" last-checked="123"/>
+""" % NS
+
+
+class TestFeedIndex(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        self.write_feed(PROG, '<implementation id="sha1=1" version="1.0"/>'
+                              '<implementation id="sha1=2" version="2.0"/>')
+        self.write_feed(EXTRA, '<feed-for interface="%s"/>'
+                               '<implementation id="sha1=2" version="2.0"/>' % PROG)
+        self.dir = basedir.save_cache_path('0install.net', 'interfaces')
+        self.index = feedindex.FeedIndex(os.path.join(self.tmp, 'index.sqlite'))
+
+    def tearDown(self):
+        self.index.close()
+        TestInjector.tearDown(self)
+
+    def touch_dir(self, path):
+        # (the files may change within the directory's mtime resolution)
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+
+    def test_rebuild(self):
+        self.assertEquals(2, self.index.rebuild())
+        self.assertEquals([EXTRA, PROG], sorted(self.index.list_uris()))
+
+        info = self.index.get_feed(PROG)
+        self.assertEquals('prog.xml', info.name)
+        self.assertEquals('test', info.summary)
+        self.assertEquals(os.path.join(self.dir, escape(PROG)), info.path)
+        self.assertEquals(os.path.getsize(info.path), info.size)
+        self.assertEquals(None, info.error)
+        self.assertEquals(None, info.overrides_path)
+        self.assertEquals(None, self.index.get_feed('http://example.com/missing.xml'))
+        self.assertEquals([EXTRA, PROG], sorted([i.uri for i in self.index.list_feeds()]))
+
+        impls = sorted(self.index.get_implementations(PROG))
+        self.assertEquals(['2.0', '1.0'], [impl.get_version() for impl in impls])
+        self.assertEquals(['sha1=2', 'sha1=1'], [impl.id for impl in impls])
+
+        self.assertEquals([PROG], self.index.find_implementation('sha1=1'))
+        self.assertEquals([EXTRA, PROG], sorted(self.index.find_implementation('sha1=2')))
+        self.assertEquals([], self.index.find_implementation('sha1=3'))
+        self.assertEquals([EXTRA], self.index.find_feeds_for(PROG))
+        self.assertEquals([], self.index.find_feeds_for(EXTRA))
+
+    def test_refresh(self):
+        self.assertEquals([EXTRA, PROG], sorted(self.index.list_uris()))
+
+        new = 'http://example.com/new.xml'
+        self.write_feed(new, '<implementation id="sha1=3" version="3.0"/>')
+        self.touch_dir(self.dir)
+        self.assertEquals([new], self.index.find_implementation('sha1=3'))
+
+        self.write_feed(PROG, '<implementation id="sha1=4" version="4.0"/>')
+        self.touch_dir(self.dir)
+        self.assertEquals(['sha1=4'], [impl.id for impl in self.index.get_implementations(PROG)])
+        self.assertEquals([], self.index.find_implementation('sha1=1'))
+
+        os.unlink(os.path.join(self.dir, escape(EXTRA)))
+        self.touch_dir(self.dir)
+        self.assertEquals([new, PROG], sorted(self.index.list_uris()))
+        self.assertEquals([], self.index.find_feeds_for(PROG))
+
+    def test_same_second(self):
+        mtime = int(time.time())
+        os.utime(self.dir, (mtime, mtime))
+        self.assertEquals([EXTRA, PROG], sorted(self.index.list_uris()))
+
+        # A feed added without changing the directory's (coarse) mtime
+        new = 'http://example.com/new.xml'
+        self.write_feed(new, '<implementation id="sha1=3" version="3.0"/>')
+        os.utime(self.dir, (mtime, mtime))
+        self.assertEquals([EXTRA, new, PROG], sorted(self.index.list_uris()))
+
+    def test_unchanged(self):
+        self.index.list_uris()
+
+        def fail(*args, **kwargs):
+            raise Exception('Feed read again!')
+        old = feedloader.load_feed
+        feedloader.load_feed = fail
+        try:
+            # The files haven't changed, so they aren't read again
+            self.touch_dir(self.dir)
+            self.assertEquals(None, self.index.get_feed(PROG).error)
+
+            # Until they do
+            self.write_feed(PROG, '')
+            self.touch_dir(self.dir)
+            self.assertEquals('Feed read again!', self.index.get_feed(PROG).error)
+        finally:
+            feedloader.load_feed = old
+
+    def test_invalid(self):
+        path = os.path.join(self.dir, escape(PROG))
+        stream = file(path, 'w')
+        stream.write('<interface')
+        stream.close()
+        self.index.rebuild()
+        info = self.index.get_feed(PROG)
+        self.assert_(info.error)
+        self.assertEquals(None, info.name)
+        self.assertEquals([], self.index.get_implementations(PROG))
+
+    def test_update_feed(self):
+        self.index.list_uris()
+        path = os.path.join(self.dir, escape(PROG))
+        stream = file(path)
+        feed = reader.parse_feed_data(PROG, stream.read().replace('sha1=1', 'sha1=5'), 1)
+        stream.close()
+        self.index.update_feed(PROG, path, feed)
+        self.assertEquals([PROG], self.index.find_implementation('sha1=5'))
+
+    def test_legacy_overrides(self):
+        self.index.list_uris()
+        user_overrides = basedir.save_config_path('0install.net', 'injector', 'user_overrides')
+        only = 'http://example.com/settings-only.xml'
+        for uri in [PROG, only]:
+            stream = file(os.path.join(user_overrides, escape(uri)), 'w')
+            stream.write(_LEGACY % uri)
+            stream.close()
+        self.touch_dir(user_overrides)
+
+        info = self.index.get_feed(PROG)
+        self.assertEquals(123, info.last_checked)
+        self.assertEquals(os.path.join(user_overrides, escape(PROG)), info.overrides_path)
+        info = self.index.get_feed(only)
+        self.assertEquals(None, info.path)
+        self.assertEquals(123, info.last_checked)
+
+    def test_overrides_store(self):
+        store = overrides.OverridesStore(os.path.join(self.tmp, 'user-overrides.xml'))
+        only = 'http://example.com/settings-only.xml'
+        for uri, last_checked in [(PROG, '456'), (only, '789')]:
+            element = overrides.make_element(uri)
+            element.attrs['last-checked'] = last_checked
+            store.set(uri, element)
+        store.set(EXTRA, overrides.make_element(EXTRA))
+        self.index.close()
+        self.index = feedindex.FeedIndex(os.path.join(self.tmp, 'index.sqlite'), store)
+
+        self.assertEquals([EXTRA, PROG, only], sorted(self.index.list_uris()))
+        self.assertEquals(456, self.index.get_feed(PROG).last_checked)
+        self.assertEquals(None, self.index.get_feed(EXTRA).last_checked)
+        info = self.index.get_feed(only)
+        self.assertEquals(789, info.last_checked)
+        self.assertEquals(None, info.path)
+        self.assertEquals(0, info.size + info.overrides_size)
+        self.assertEquals('(settings-only.xml)', info.get_name())
+        self.assertEquals(None, self.index.get_feed('http://example.com/missing.xml'))
+        feeds = dict([(info.uri, info.last_checked) for info in self.index.list_feeds()])
+        self.assertEquals({PROG: 456, EXTRA: None, only: 789}, feeds)
+
+        store.flush()
+
+    def test_iface_cache(self):
+        only = 'http://example.com/settings-only.xml'
+        element = overrides.make_element(only)
+        element.attrs['last-checked'] = '789'
+        iface_cache.get_user_overrides().set(only, element)
+        self.assertEquals(789, iface_cache.get_feed_index().get_feed(only).last_checked)
+        self.assertEquals([EXTRA, PROG, only], sorted(iface_cache.list_all_interfaces()))
+
+
+if __name__ == '__main__':
+    unittest.main()
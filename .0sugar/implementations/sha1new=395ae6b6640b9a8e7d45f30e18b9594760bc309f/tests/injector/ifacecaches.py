@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import os
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.injector import feedloader, reader
+from zeroinstall.injector.iface_cache import iface_cache, ReplayAttack
+from zeroinstall.injector.model import InvalidInterface, escape
+
+
+def uri(i):
+    return 'http://example.com/feed%d.xml' % i
+
+
+class TestInMemoryCache(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        for i in range(20):
+            self.write_feed(uri(i), '<implementation id="sha1=%x" version="1"/>' % i)
+        iface_cache.max_interfaces = 8
+
+    def loaded(self):
+        return sorted(iface_cache._interfaces.keys())
+
+    def test_lru(self):
+        for i in range(8):
+            iface_cache.get_interface(uri(i))
+        self.assertEquals(0, iface_cache.stats.evictions)
+        iface_cache.get_interface(uri(0))
+        self.assertEquals(1, iface_cache.stats.hits)
+
+        # Going over the limit drops the least recently used, down to 3/4 of it
+        iface_cache.get_interface(uri(8))
+        self.assertEquals(3, iface_cache.stats.evictions)
+        self.assertEquals(sorted([uri(i) for i in [0, 4, 5, 6, 7, 8]]), self.loaded())
+
+        # Dropped interfaces are just read again
+        misses = iface_cache.stats.misses
+        self.assertEquals(['sha1=1'], iface_cache.get_interface(uri(1)).implementations.keys())
+        self.assertEquals(misses + 1, iface_cache.stats.misses)
+
+    def test_unlimited(self):
+        iface_cache.max_interfaces = None
+        for i in range(20):
+            iface_cache.get_interface(uri(i))
+        self.assertEquals(0, iface_cache.stats.evictions)
+        self.assertEquals(20, len(self.loaded()))
+
+    def test_pinned(self):
+        from zeroinstall.injector.policy import Policy
+        self.write_feed(uri(0), '<implementation id="sha1=1" version="1">'
+                                '<requires interface="%s"/></implementation>' % uri(1))
+        policy = Policy(uri(0))
+        self.assertEquals(set([uri(0)]), iface_cache.get_pinned())
+        policy.solver.solve(policy.root, policy.target_arch)
+        self.assertEquals(set([uri(0), uri(1)]), iface_cache.get_pinned())
+
+        for i in range(2, 20):
+            iface_cache.get_interface(uri(i))
+        loaded = self.loaded()
+        self.assert_(uri(0) in loaded)
+        self.assert_(uri(1) in loaded)
+        self.assert_(len(loaded) <= 8)
+
+        # Only while the policy is alive
+        del policy
+        gc.collect()
+        self.assertEquals(set(), iface_cache.get_pinned())
+        for i in range(2, 20):
+            iface_cache.get_interface(uri(i))
+        self.assert_(uri(0) not in self.loaded())
+
+    def test_invalidate(self):
+        iface = iface_cache.get_interface(uri(0))
+        generation = iface_cache.generation
+        feed_generation = iface_cache.get_generation(uri(0))
+
+        iface_cache.invalidate(uri(1))		# (not loaded)
+        self.assertEquals(generation, iface_cache.generation)
+
+        self.write_feed(uri(0), '<implementation id="sha1=2" version="2"/>')
+        self.assert_(iface_cache.get_interface(uri(0)) is iface)
+        iface_cache.invalidate(uri(0))
+        self.assert_(iface_cache.generation > generation)
+        self.assert_(iface_cache.get_generation(uri(0)) > feed_generation)
+        self.assertEquals(['sha1=2'], iface_cache.get_interface(uri(0)).implementations.keys())
+
+        generation = iface_cache.generation
+        iface_cache.invalidate_all()
+        self.assertEquals([], self.loaded())
+        self.assert_(iface_cache.get_generation(uri(0)) > generation)
+
+
+_PROG = 'http://example.com/prog.xml'
+
+_XML = """<?xml version="1.0" ?>
+<interface xmlns="%s" uri="%s">
+  <name>prog</name>
+  <summary>test</summary>
+  %%s
+</interface>
+""" % (NS, _PROG)
+
+
+class TestImport(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        self.loads = []
+        self.load_feed = feedloader.load_feed
+        def load_feed(*args, **kwargs):
+            self.loads.append(args)
+            return self.load_feed(*args, **kwargs)
+        feedloader.load_feed = load_feed
+        self.cached = os.path.join(basedir.save_cache_path('0install.net', 'interfaces'), escape(_PROG))
+
+    def tearDown(self):
+        feedloader.load_feed = self.load_feed
+        TestInjector.tearDown(self)
+
+    def test_import(self):
+        iface = iface_cache.get_interface(_PROG)
+        self.assertEquals({}, iface.implementations)
+        generation = iface_cache.get_generation(_PROG)
+
+        xml = _XML % '<implementation id="sha1=1" version="1"/>'
+        iface_cache.update_interface_from_network(iface, xml, 1000000000)
+        # Parsed once, and the results used for everything
+        self.assertEquals(1, len(self.loads))
+        self.assertEquals(['sha1=1'], iface.implementations.keys())
+        self.assertEquals(1000000000, iface.last_modified)
+        self.assert_(iface.last_checked)
+        self.assert_(iface_cache.get_generation(_PROG) > generation)
+        self.assertEquals(1000000000, os.stat(self.cached).st_mtime)
+        self.assertEquals(['sha1=1'], reader._read_snapshot(_PROG, self.cached).implementations.keys())
+        self.assertEquals([_PROG], iface_cache.get_feed_index().find_implementation('sha1=1'))
+
+        # Reading it from the cache uses the snapshot
+        iface_cache.invalidate(_PROG)
+        self.assertEquals(['sha1=1'], iface_cache.get_interface(_PROG).implementations.keys())
+        self.assertEquals(1, len(self.loads))
+
+    def test_unchanged(self):
+        iface = iface_cache.get_interface(_PROG)
+        xml = _XML % '<implementation id="sha1=1" version="1"/>'
+        iface_cache.update_interface_from_network(iface, xml, 1000000000)
+        generation = iface_cache.get_generation(_PROG)
+
+        # The digest stored with the snapshot is used, rather than hashing the cached copy
+        hashed = []
+        sha1_new = reader.sha1_new
+        def record(data):
+            hashed.append(data)
+            return sha1_new(data)
+        reader.sha1_new = record
+        try:
+            iface_cache.update_interface_from_network(iface, xml, 1000000000)
+        finally:
+            reader.sha1_new = sha1_new
+        self.assertEquals([], hashed)
+        self.assertEquals(1, len(self.loads))
+        self.assertEquals(['sha1=1'], iface.implementations.keys())
+        self.assert_(iface_cache.get_generation(_PROG) > generation)
+
+    def test_replay(self):
+        iface = iface_cache.get_interface(_PROG)
+        iface_cache.update_interface_from_network(iface,
+                _XML % '<implementation id="sha1=2" version="2"/>', 1000000000)
+        self.assertRaises(ReplayAttack, iface_cache.update_interface_from_network, iface,
+                _XML % '<implementation id="sha1=1" version="1"/>', 999999999)
+        self.assertEquals(['sha1=2'], iface.implementations.keys())
+        self.assertEquals(['sha1=2'], reader._read_snapshot(_PROG, self.cached).implementations.keys())
+
+    def test_invalid(self):
+        iface = iface_cache.get_interface(_PROG)
+        self.assertRaises(InvalidInterface, iface_cache.update_interface_from_network, iface,
+                _XML % '<implementation id="sha1=1"/>', 1000000000)
+        self.assertEquals(False, os.path.exists(self.cached))
+        self.assertEquals({}, iface.implementations)
+
+
+if __name__ == '__main__':
+    unittest.main()
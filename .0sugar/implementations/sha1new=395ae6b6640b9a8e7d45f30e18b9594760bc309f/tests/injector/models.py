@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from StringIO import StringIO
+
+from __init__ import *
+from zeroinstall import SafeException
+from zeroinstall.injector import feedloader, model, qdom
+
+
+_FEED = """<?xml version="1.0" ?>
+<interface xmlns="%s" xmlns:foo="http://example.com/foo" uri="http://example.com/prog.xml">
+  <name>prog</name>
+  <summary>test</summary>
+  <group main="bin/prog" license="GPL">
+    <requires interface="http://example.com/lib.xml">
+      <version not-before="2"/>
+      <environment name="LIB" insert="."/>
+    </requires>
+    <environment name="PROG" insert="bin"/>
+    <implementation id="sha1=1" version="1" foo:extra="yes"/>
+    <implementation id="sha1=2" version="2">
+      <archive href="http://example.com/prog-2.tgz" size="100"/>
+      <environment name="PROG_2" insert="."/>
+    </implementation>
+    <group version="3" version-modifier="-pre" main="bin/prog3">
+      <requires interface="http://example.com/util.xml"/>
+      <implementation id="sha1=3" license="BSD"/>
+    </group>
+  </group>
+  <group>
+    <requires interface="http://example.com/lib.xml">
+      <version not-before="2"/>
+      <environment name="LIB" insert="."/>
+    </requires>
+    <implementation id="sha1=4" version="4"/>
+  </group>
+</interface>
+""" % NS
+
+
+def load_from_dom():
+    return model.ZeroInstallFeed(qdom.parse(StringIO(_FEED)))
+
+
+def load_streaming():
+    return feedloader.load_feed(StringIO(_FEED))
+
+
+class TestImplementations(unittest.TestCase):
+
+    def check_both(self, test):
+        for load in [load_from_dom, load_streaming]:
+            test(load().implementations)
+
+    def test_inherited(self):
+        def test(impls):
+            self.assertEquals('bin/prog', impls['sha1=1'].main)
+            self.assertEquals('bin/prog3', impls['sha1=3'].main)
+            self.assertEquals('3-pre', impls['sha1=3'].get_version())
+            self.assertEquals(['http://example.com/lib.xml'],
+                              [d.interface for d in impls['sha1=1'].requires])
+            self.assertEquals(['http://example.com/lib.xml', 'http://example.com/util.xml'],
+                              [d.interface for d in impls['sha1=3'].requires])
+            self.assertEquals(['PROG'], [b.name for b in impls['sha1=1'].bindings])
+            self.assertEquals(['PROG', 'PROG_2'], [b.name for b in impls['sha1=2'].bindings])
+            self.assertEquals(['LIB'], [b.name for b in impls['sha1=1'].requires[0].bindings])
+            self.assertEquals('GPL', impls['sha1=1'].metadata['license'])
+            self.assertEquals('BSD', impls['sha1=3'].metadata['license'])
+            self.assertEquals('3-pre', impls['sha1=3'].metadata['version'])
+            self.assertEquals('yes', impls['sha1=1'].metadata['http://example.com/foo extra'])
+        self.check_both(test)
+
+    def test_shared(self):
+        def test(impls):
+            one, two, three, four = [impls['sha1=%d' % i] for i in range(1, 5)]
+            # Implementations in the same group share the group's sequences
+            self.assert_(one.requires is two.requires)
+            self.assert_(one.bindings is three.bindings)
+            self.assert_(one.bindings is not two.bindings)
+            # Identical <requires> elements give the same object
+            self.assert_(one.requires[0] is three.requires[0])
+            self.assert_(one.requires[0] is four.requires[0])
+            self.assert_(one.requires[0].restrictions[0] is four.requires[0].restrictions[0])
+            # ... so they can't be changed in place
+            self.assertRaises(AttributeError, getattr, one.requires, 'append')
+            self.assertRaises(AttributeError, getattr, one.bindings, 'append')
+        self.check_both(test)
+
+    def test_replace(self):
+        def test(impls):
+            one, two = impls['sha1=1'], impls['sha1=2']
+            dep = model.InterfaceDependency('http://example.com/other.xml')
+            one.requires = list(one.requires) + [dep]
+            self.assertEquals(2, len(one.requires))
+            self.assertEquals(1, len(two.requires))
+        self.check_both(test)
+
+    def test_lazy(self):
+        def test(impls):
+            impl = impls['sha1=2']
+            self.assert_(impl._record is not None)
+            self.assertEquals(['http://example.com/prog-2.tgz'],
+                              [s.url for s in impl.download_sources])
+            self.assertEquals(100, impl.download_sources[0].size)
+            self.assertEquals(None, impl._record)
+
+            impl = impls['sha1=1']
+            self.assertEquals([], impl.download_sources)
+            self.assertEquals(None, impl._record)
+
+            # Setting an attribute first still loads the others
+            impl = impls['sha1=3']
+            impl.download_sources = []
+            self.assertEquals(None, impl._record)
+            self.assertEquals('BSD', impl.metadata['license'])
+            self.assertEquals(['PROG'], [b.name for b in impl.bindings])
+        self.check_both(test)
+
+    def test_not_from_feed(self):
+        impl = model.ZeroInstallImplementation(None, 'sha1=1')
+        self.assertEquals({}, impl.metadata)
+        self.assertEquals([], impl.bindings)
+        impl.requires.append(model.InterfaceDependency('http://example.com/lib.xml'))
+        impl.bindings.append(model.EnvironmentBinding('PATH', 'bin'))
+        impl.add_download_source('http://example.com/prog.tgz', 10, None)
+        self.assertEquals(1, len(impl.download_sources))
+
+
+def nested_version(version_string):
+    """The nested list form parse_version used to return, which defines the order."""
+    parts = model._version_re.split(version_string)
+    if parts[-1] == '':
+        del parts[-1]
+    else:
+        parts.append('')
+    for x in range(0, len(parts), 2):
+        parts[x] = parts[x] and map(int, parts[x].split('.')) or []
+    for x in range(1, len(parts), 2):
+        parts[x] = model._version_mod_to_value[parts[x]]
+    return parts
+
+
+# In increasing order
+_VERSIONS = ['0', '0.1', '1-pre', '1-pre1', '1-pre1.2', '1-pre2', '1-rc', '1-rc1',
+             '1', '1-0', '1-1-pre', '1-1', '1-1-post', '1-post', '1-post1', '1.0',
+             '1.0.1', '1.1-pre', '1.1', '2-pre-rc', '2', '10']
+
+
+class TestVersions(unittest.TestCase):
+
+    def setUp(self):
+        model._parsed_versions.clear()
+
+    def test_format(self):
+        for v in _VERSIONS:
+            self.assertEquals(v, model.format_version(model.parse_version(v)))
+        # (a bare "-" is the same as no modifier)
+        self.assertEquals(model.parse_version('1'), model.parse_version('1-'))
+        self.assertEquals('1--1', model.format_version(model.parse_version('1--1')))
+        self.assertEquals('-1', model.format_version(model.parse_version('-1')))
+
+    def test_order(self):
+        parsed = map(model.parse_version, _VERSIONS)
+        self.assertEquals(parsed, sorted(parsed))
+        others = ['1-', '1--1', '-1', '-pre']
+        for a in _VERSIONS + others:
+            for b in _VERSIONS + others:
+                self.assertEquals(cmp(nested_version(a), nested_version(b)),
+                                  cmp(model.parse_version(a), model.parse_version(b)),
+                                  (a, b))
+
+    def test_invalid(self):
+        for v in ['', 'x', '1.', '1..2', '1-beta', '1-Pre']:
+            self.assertRaises(SafeException, model.parse_version, v)
+            # (errors aren't cached)
+            self.assertRaises(SafeException, model.parse_version, v)
+        self.assertEquals(None, model.parse_version(None))
+
+    def test_cached(self):
+        version = model.parse_version('1.2-pre3')
+        self.assert_(version is model.parse_version('1.2-pre3'))
+        hash(version)
+
+    def test_lru(self):
+        cache = model._LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEquals(1, cache.get('a'))
+        cache.put('c', 3)		# (a and b become the old generation)
+        self.assertEquals(2, cache.get('b'))	# (b is used, so it's kept)
+        cache.put('d', 4)
+        self.assertEquals(None, cache.get('a'))
+        self.assertEquals(2, cache.get('b'))
+        self.assertEquals(3, cache.get('c'))
+        self.assertEquals(4, cache.get('d'))
+        cache.clear()
+        self.assertEquals(None, cache.get('d'))
+
+
+if __name__ == '__main__':
+    unittest.main()
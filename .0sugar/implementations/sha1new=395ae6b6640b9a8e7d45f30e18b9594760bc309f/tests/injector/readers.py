@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from __init__ import *
+from zeroinstall.injector import reader
+from zeroinstall.injector.model import Interface, InvalidInterface
+
+
+_URI = 'http://example.com/prog.xml'
+
+_FEED = """<?xml version="1.0" ?>
+<interface xmlns="%s" uri="%s">
+  <name>prog</name>
+  <summary>test</summary>
+  %%s
+</interface>
+""" % (NS, _URI)
+
+
+class TestReader(TestInjector):
+
+    def check_invalid(self, impl):
+        data = _FEED % impl
+        self.assertRaises(InvalidInterface, reader.parse_feed_data, _URI, data, 1)
+        path = self.write_feed(_URI, impl)
+        self.assertRaises(InvalidInterface, reader.update, Interface(_URI), path)
+        self.assertRaises(InvalidInterface, reader.check_readable, _URI, path)
+
+    def test_valid(self):
+        feed = reader.parse_feed_data(_URI, _FEED %
+                '<implementation id="sha1=1" version="1" size="10"/>', 1)
+        self.assertEquals(['sha1=1'], feed.implementations.keys())
+
+    def test_bad_xml(self):
+        self.check_invalid('<implementation>')
+
+    def test_bad_size(self):
+        # (ValueError from the loader)
+        self.check_invalid('<implementation id="sha1=1" version="1" size="big"/>')
+
+    def test_bad_version(self):
+        self.check_invalid('<implementation id="sha1=1" version="1..2"/>')
+
+    def test_bad_arch(self):
+        self.check_invalid('<implementation id="sha1=1" version="1" arch="Linux"/>')
+
+    def test_bad_archive_size(self):
+        # (checked when the feed is read, although the download sources are created later)
+        self.check_invalid('<implementation id="sha1=1" version="1">'
+                '<archive href="http://example.com/prog.tgz" size="big"/></implementation>')
+
+    def test_missing_href(self):
+        self.check_invalid('<implementation id="sha1=1" version="1">'
+                '<archive size="100"/></implementation>')
+
+    def test_bad_recipe(self):
+        self.check_invalid('<implementation id="sha1=1" version="1"><recipe>'
+                '<archive href="http://example.com/prog.tgz" size="100" start-offset="x"/>'
+                '</recipe></implementation>')
+
+    def test_bad_binding(self):
+        self.check_invalid('<implementation id="sha1=1" version="1">'
+                '<environment name="PATH" insert="bin" mode="sideways"/></implementation>')
+        self.check_invalid('<implementation id="sha1=1" version="1">'
+                '<environment insert="bin"/></implementation>')
+
+
+if __name__ == '__main__':
+    unittest.main()
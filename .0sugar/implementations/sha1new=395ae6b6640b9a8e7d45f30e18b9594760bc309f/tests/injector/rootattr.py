@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from StringIO import StringIO
+from xml.dom import minidom
+
+from __init__ import *
+from zeroinstall.injector import qdom
+
+
+_NS = 'http://zero-install.sourceforge.net/2004/injector/interface'
+
+_BODY = """
+  <name>prog</name>
+  <summary>a &lt;test&gt; program</summary>
+  <group main="bin/prog">
+    <implementation id="sha1=1" version="1.0" stability="stable"/>
+  </group>
+</interface>
+"""
+
+
+def tree(data):
+    """Everything qdom reports about a document, as plain values."""
+    def walk(element):
+        return (element.uri, element.name, element.attrs, element.content,
+                [walk(i) for i in element.childNodes])
+    return walk(qdom.parse(StringIO(data)))
+
+
+def with_minidom(data, name, value):
+    """The old way of setting the attribute."""
+    doc = minidom.parseString(data)
+    doc.documentElement.setAttribute(name, value)
+    return doc.toxml('utf-8')
+
+
+class TestSetRootAttribute(unittest.TestCase):
+
+    def check(self, data, value='1234'):
+        result = qdom.set_root_attribute(data, 'last-modified', value)
+
+        expected = tree(data)
+        expected[2]['last-modified'] = value
+        self.assertEqual(expected, tree(result))
+        self.assertEqual(tree(with_minidom(data, 'last-modified', value)),
+                tree(result))
+        return result
+
+    def testAdd(self):
+        data = '<?xml version="1.0"?>\n<interface xmlns="%s" uri="http://example.com/prog.xml">%s' % (_NS, _BODY)
+        result = self.check(data)
+        self.assertEqual(data.replace('prog.xml"', 'prog.xml" last-modified="1234"', 1), result)
+
+    def testReplace(self):
+        for quote in '"\'':
+            data = '<interface xmlns="%s" last-modified=%s99%s uri="http://example.com/prog.xml">%s' % (_NS, quote, quote, _BODY)
+            result = self.check(data)
+            self.assertEqual(data.replace('%s99%s' % (quote, quote), '"1234"'), result)
+
+    def testOnlyRootChanged(self):
+        data = '<interface xmlns="%s">\n<group last-modified="1"/>%s' % (_NS, _BODY)
+        result = self.check(data)
+        self.assertEqual(1, result.count('last-modified="1234"'))
+        self.assertEqual(1, result.count('last-modified="1"'))
+
+    def testProlog(self):
+        data = ('\xef\xbb\xbf<?xml version="1.0" encoding="utf-8"?>\n'
+                '<?xml-stylesheet type="text/xsl" href="interface.xsl"?>\n'
+                '<!-- <interface last-modified="1"> -->\n'
+                '<!DOCTYPE interface [\n'
+                '  <!ENTITY greeting "<hello>">\n'
+                ']>\n'
+                '<interface xmlns="%s">%s' % (_NS, _BODY))
+        result = self.check(data)
+        self.assertEqual(data.replace('<interface xmlns="%s">' % _NS,
+                '<interface xmlns="%s" last-modified="1234">' % _NS), result)
+
+    def testAwkwardTags(self):
+        self.check('<interface\n\txmlns="%s"\n\turi = \'http://example.com/a>b.xml\'\n>%s' % (_NS, _BODY))
+        self.check('<interface xmlns="%s" />' % _NS)
+        self.check('<interface xmlns="%s"/>' % _NS)
+        self.check('<interface/>')
+        self.check('<q:interface xmlns:q="%s" q:last-modified="1">%s' % (_NS, _BODY.replace('</interface>', '</q:interface>')))
+
+    def testNonASCII(self):
+        data = '<interface xmlns="%s" uri="http://example.com/\xc3\xa9.xml">%s' % (_NS, _BODY.replace('prog<', 'pr\xc3\xb6g<'))
+        self.check(data)
+
+    def testEscaping(self):
+        data = '<interface xmlns="%s">%s' % (_NS, _BODY)
+        self.check(data, value='a<b & "c"')
+
+    def testInvalid(self):
+        for data in ['', 'no markup', '<?xml version="1.0"', '<!-- unclosed',
+                     '<!DOCTYPE interface [', '< interface>',
+                     '<interface uri="unclosed>', '<interface uri=noquotes>']:
+            self.assertRaises(ValueError, qdom.set_root_attribute, data, 'last-modified', '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
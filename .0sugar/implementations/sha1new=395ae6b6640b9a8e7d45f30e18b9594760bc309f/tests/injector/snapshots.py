@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import marshal
+import cPickle
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.injector import reader, model
+from zeroinstall.injector.model import escape
+
+URI = 'http://example.com/prog.xml'
+
+_unpickled = []
+
+
+def record(tag):
+    _unpickled.append(tag)
+
+
+class Evil(object):
+    """Records that it was unpickled, as foreign code would run."""
+
+    def __reduce__(self):
+        return (record, ('evil',))
+
+
+def versions(feed):
+    return sorted([impl.get_version() for impl in feed.implementations.values()])
+
+
+class TestSnapshots(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        del _unpickled[:]
+        self.source = self.write_feed(URI,
+                '<implementation id="sha1=1" version="1.0"/>', mtime=1000000000)
+        self.snapshot = os.path.join(basedir.xdg_cache_home, '0install.net',
+                'interfaces-parsed', escape(URI))
+
+    def load(self):
+        iface = model.Interface(URI)
+        self.assert_(reader.update_from_cache(iface))
+        return iface._main_feed
+
+    def write_snapshot(self, path, payload):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        stream = file(path, 'wb')
+        marshal.dump(reader._get_snapshot_key(self.source), stream)
+        marshal.dump(reader.get_cached_digest(URI, self.source), stream)
+        cPickle.dump(payload, stream, cPickle.HIGHEST_PROTOCOL)
+        stream.close()
+        os.chmod(path, 0600)
+
+    def test_reuse(self):
+        self.assertEquals(['1.0'], versions(self.load()))
+        self.assert_(os.path.exists(self.snapshot))
+
+        # (prove that the snapshot is what gets loaded)
+        feed = self.load()
+        feed.implementations.clear()
+        self.write_snapshot(self.snapshot, feed)
+        self.assertEquals([], versions(self.load()))
+
+    def test_stale(self):
+        self.load()
+        # Same size and mtime (as when an import sets the signature time)
+        stream = file(self.source)
+        data = stream.read()
+        stream.close()
+        stream = file(self.source, 'w')
+        stream.write(data.replace('version="1.0"', 'version="2.0"'))
+        stream.close()
+        os.utime(self.source, (1000000000, 1000000000))
+
+        self.assertEquals(['2.0'], versions(self.load()))
+        self.assertEquals(['2.0'], versions(self.load()))
+
+    def test_not_hashed(self):
+        self.load()
+        hashed = []
+        old = reader.sha1_new
+        def sha1_new(data):
+            hashed.append(data)
+            return old(data)
+        reader.sha1_new = sha1_new
+        try:
+            # Only the source's stat is checked
+            self.assertEquals(['1.0'], versions(self.load()))
+        finally:
+            reader.sha1_new = old
+        self.assertEquals([], hashed)
+
+    def test_not_ours(self):
+        self.write_snapshot(self.snapshot, Evil())
+        os.chmod(self.snapshot, 0622)
+        self.assertEquals(['1.0'], versions(self.load()))
+        self.assertEquals([], _unpickled)
+
+        self.write_snapshot(self.snapshot, Evil())
+        real_geteuid = os.geteuid
+        os.geteuid = lambda: real_geteuid() + 1
+        try:
+            self.assertEquals(['1.0'], versions(self.load()))
+        finally:
+            os.geteuid = real_geteuid
+        self.assertEquals([], _unpickled)
+
+    def test_shared_cache_ignored(self):
+        shared = os.path.join(self.tmp, 'shared')
+        basedir.xdg_cache_dirs.append(shared)
+        self.write_snapshot(os.path.join(shared, '0install.net',
+            'interfaces-parsed', escape(URI)), Evil())
+        self.assertEquals(['1.0'], versions(self.load()))
+        self.assertEquals([], _unpickled)
+
+
+if __name__ == '__main__':
+    unittest.main()
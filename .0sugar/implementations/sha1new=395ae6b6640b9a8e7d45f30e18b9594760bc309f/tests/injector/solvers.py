@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import heapq
+import unittest
+
+from __init__ import *
+from zeroinstall import _, zerostore
+from zeroinstall.injector import arch, model, solver
+from zeroinstall.injector.iface_cache import iface_cache
+
+
+_TESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+_LIB = """
+<implementation id="sha1=a1" version="1.0" stability="stable"/>
+<implementation id="sha1=a2" version="2.0" stability="testing"/>
+<implementation id="sha1=a3" version="2.0" stability="stable" arch="Linux-i686"/>
+<implementation id="sha1=a4" version="2.0" stability="stable" arch="Linux-x86_64"/>
+<implementation id="sha1=a5" version="3.0" stability="developer"/>
+<implementation id="sha1=a6" version="1.5" stability="buggy"/>
+<implementation id="sha1=a7" version="2.0-pre" stability="stable" arch="Windows-i486"/>
+<implementation id="sha1=a8" version="2.0" stability="stable" arch="*-src"/>
+<implementation id="sha1=a9" version="1.0" stability="stable"/>
+<implementation id="sha1=aa" version="1.0" stability="stable"/>
+<implementation id="sha1=ab" version="0.9" stability="stable" arch="Linux-ppc64"/>
+<implementation id="sha1=ac" version="1.2" stability="stable" arch="Linux-i486"/>
+<implementation id="sha1=ad" version="1.2" stability="stable" arch="Linux-i686"/>
+<implementation id="sha1=ae" version="1.2" stability="stable" arch="POSIX-i686"/>
+"""
+
+_SIMPLE = """
+<implementation id="sha1=51" version="1" stability="stable"/>
+<implementation id="sha1=52" version="2" stability="stable"/>
+<implementation id="sha1=53" version="3" stability="testing"/>
+"""
+
+
+def requires(name, body=''):
+    return '<requires interface="http://example.com/%s.xml">%s</requires>' % (name, body)
+
+
+def old_order(s, interface, impls, restrictions, arch):
+    """The order the solver used to try candidates in: a full sort with the
+    old pairwise comparison, best last, popping from the end."""
+    machine = solver.machine_groups.get(os.uname()[-1], 0)
+
+    def compare(b, a):
+        a_stab = a.get_stability()
+        b_stab = b.get_stability()
+        r = cmp(s._is_unusable(b, restrictions, arch), s._is_unusable(a, restrictions, arch))
+        if r: return r
+        r = cmp(solver.machine_groups.get(a.machine, 0) == machine,
+                solver.machine_groups.get(b.machine, 0) == machine)
+        if r: return r
+        r = cmp(a_stab == model.preferred, b_stab == model.preferred)
+        if r: return r
+        if s.network_use != model.network_full:
+            r = cmp(s._get_cached(a), s._get_cached(b))
+            if r: return r
+        stab_policy = interface.stability_policy
+        if not stab_policy:
+            if s.help_with_testing: stab_policy = model.testing
+            else: stab_policy = model.stable
+        if a_stab >= stab_policy: a_stab = model.preferred
+        if b_stab >= stab_policy: b_stab = model.preferred
+        r = cmp(a_stab, b_stab)
+        if r: return r
+        r = cmp(a.version, b.version)
+        if r: return r
+        r = cmp(arch.os_ranks.get(b.os, None), arch.os_ranks.get(a.os, None))
+        if r: return r
+        r = cmp(arch.machine_ranks.get(b.machine, None), arch.machine_ranks.get(a.machine, None))
+        if r: return r
+        if s.network_use == model.network_full:
+            r = cmp(s._get_cached(a), s._get_cached(b))
+            if r: return r
+        return cmp(a.id, b.id)
+
+    impls = list(impls)
+    impls.sort(lambda a, b: compare(b, a))
+    impls.reverse()
+    return impls
+
+
+class TestSolvers(TestInjector):
+
+    def setUp(self):
+        TestInjector.setUp(self)
+        self.stores = zerostore.Stores()
+        os.makedirs(self.stores.stores[0].dir)
+        self.arch = arch.get_architecture('Linux', 'x86_64')
+
+    def add_feed(self, name, body):
+        uri = 'http://example.com/%s.xml' % name
+        self.write_feed(uri, body)
+        iface_cache.invalidate(uri)
+        return uri
+
+    def store(self, *ids):
+        for id in ids:
+            os.mkdir(os.path.join(self.stores.stores[0].dir, id))
+        self.stores.stores[0].invalidate()
+
+    def make_solver(self, kind='default', network_use=model.network_full, record_details=False):
+        s = solver.solvers[kind](network_use, iface_cache, self.stores)
+        s.record_details = record_details
+        return s
+
+    def get_selections(self, s):
+        return dict([(iface.uri, impl and impl.id) for iface, impl in s.selections.iteritems()])
+
+    def get_details(self, s):
+        return dict([(iface.uri, [(impl.id, reason) for impl, reason in s.details[iface]])
+                     for iface in s.details])
+
+    def solve(self, root, **kwargs):
+        s = self.make_solver(**kwargs)
+        s.solve(root, self.arch)
+        return s
+
+    # Ranking (the heap must give the same order as the old full sort)
+
+    def check_order(self, s, uri, restrictions=[]):
+        iface = iface_cache.get_interface(uri)
+        impls = s._get_implementations(iface, self.arch)
+        heap = s._rank(iface, impls, restrictions, self.arch)
+        ranked = [heapq.heappop(heap)[-1] for i in range(len(heap))]
+        self.assertEquals([impl.id for impl in old_order(s, iface, impls, restrictions, self.arch)],
+                          [impl.id for impl in ranked])
+
+    def test_order(self):
+        lib = self.add_feed('lib', _LIB)
+        self.store('sha1=a2', 'sha1=a9')
+        iface = iface_cache.get_interface(lib)
+        iface.implementations['sha1=a1'].user_stability = model.preferred
+        restrictions = [model.VersionRangeRestriction(None, model.parse_version('2.0'))]
+        for network_use in model.network_levels:
+            for help_with_testing in (False, True):
+                s = self.make_solver(network_use=network_use)
+                s.help_with_testing = help_with_testing
+                s.solve(lib, self.arch)
+                self.check_order(s, lib)
+                self.check_order(s, lib, restrictions)
+
+    def test_duplicates(self):
+        lib = self.add_feed('lib', _LIB)
+        extra = self.add_feed('extra', '<feed-for interface="%s"/>\n%s' % (lib, _LIB))
+        iface_cache.get_interface(lib).extra_feeds.append(model.Feed(extra, None, False))
+        s = self.solve(lib)
+        self.check_order(s, lib)
+
+    # The SAT solver must choose what the default one does
+
+    def check_same(self, root, network_use=model.network_full):
+        default = self.solve(root, network_use=network_use)
+        sat = self.solve(root, kind='sat', network_use=network_use)
+        self.assertEquals(default.ready, sat.ready)
+        if default.ready:
+            self.assertEquals(self.get_selections(default), self.get_selections(sat))
+        return sat
+
+    def test_sat_test_feeds(self):
+        for name in ['MyProg.xml', 'MyCompile.xml', 'MyDep.xml']:
+            self.check_same(os.path.abspath(os.path.join(_TESTS, name)))
+
+    def test_sat_restrictions(self):
+        self.add_feed('lib', _LIB)
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s</implementation>' %
+                             requires('lib', '<version before="2"/>'))
+        for network_use in model.network_levels:
+            self.check_same(prog, network_use)
+
+    def test_sat_backtrack(self):
+        prog = self.add_feed('prog', """
+            <implementation id="sha1=f2" version="2">%s%s</implementation>
+            <implementation id="sha1=f1" version="1">%s%s</implementation>""" % (
+                requires('lib', '<version not-before="2"/>'), requires('util'),
+                requires('lib'), requires('util')))
+        self.add_feed('lib', """
+            <implementation id="sha1=b2" version="2">%s</implementation>
+            <implementation id="sha1=b1" version="1">%s</implementation>""" % (
+                requires('util', '<version not-before="2"/>'), requires('util')))
+        self.add_feed('util', '<implementation id="sha1=c1" version="1"/>')
+        s = self.check_same(prog)
+        self.assertEquals({'http://example.com/prog.xml': 'sha1=f1',
+                           'http://example.com/lib.xml': 'sha1=b1',
+                           'http://example.com/util.xml': 'sha1=c1'}, self.get_selections(s))
+
+    def test_sat_unsatisfiable(self):
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s%s</implementation>' % (
+                requires('lib', '<version not-before="2"/>'), requires('util')))
+        self.add_feed('lib', '<implementation id="sha1=b2" version="2">%s</implementation>' %
+                      requires('util', '<version not-before="2"/>'))
+        self.add_feed('util', '<implementation id="sha1=c1" version="1"/>')
+        s = self.check_same(prog)
+        self.assertEquals(False, s.ready)
+
+    def test_sat_optional(self):
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s%s</implementation>' % (
+                requires('lib', '<version before="3"/>'),
+                '<requires optional="true" interface="http://example.com/extra.xml"/>'))
+        self.add_feed('lib', """
+            <implementation id="sha1=b3" version="3"/>
+            <implementation id="sha1=b2" version="2"/>""")
+        self.add_feed('extra', """
+            <implementation id="sha1=e2" version="2"/>
+            <implementation id="sha1=e1" version="1"/>""")
+        self.store('sha1=f1', 'sha1=b2')
+        for network_use in model.network_levels:
+            s = self.check_same(prog, network_use)
+            self.assertEquals(True, s.ready)
+            self.assertEquals(None, self.get_selections(s).get('http://example.com/extra.xml'))
+        self.store('sha1=e1')
+        for network_use in model.network_levels:
+            s = self.check_same(prog, network_use)
+            self.assertEquals('sha1=e1', self.get_selections(s)['http://example.com/extra.xml'])
+
+    def test_sat_machine_group(self):
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s%s</implementation>' % (
+                requires('gui'), requires('lib')))
+        self.add_feed('gui', '<implementation id="sha1=c61" version="1" arch="Linux-i686"/>')
+        self.add_feed('lib', """
+            <implementation id="sha1=b2" version="2" arch="Linux-x86_64"/>
+            <implementation id="sha1=b1" version="1" arch="Linux-i686"/>""")
+        s = self.check_same(prog)
+        self.assertEquals('sha1=b1', self.get_selections(s)['http://example.com/lib.xml'])
+
+    def test_sat_machine_group_kept(self):
+        # The default solver keeps the architecture group chosen for depA
+        # after rejecting lib 2; the SAT solver doesn't, so it can use lib 1
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s</implementation>' %
+                             requires('lib'))
+        self.add_feed('lib', """
+            <implementation id="sha1=b2" version="2">%s%s</implementation>
+            <implementation id="sha1=b1" version="1" arch="Linux-i686"/>
+            <implementation id="sha1=b0" version="0"/>""" % (requires('depA'), requires('depB')))
+        self.add_feed('depA', '<implementation id="sha1=d1" version="1" arch="Linux-x86_64"/>')
+        self.add_feed('depB', '')
+        lib = 'http://example.com/lib.xml'
+        self.assertEquals('sha1=b0', self.get_selections(self.solve(prog))[lib])
+        self.assertEquals('sha1=b1', self.get_selections(self.solve(prog, kind='sat'))[lib])
+
+    # Re-solving
+
+    def test_unchanged(self):
+        lib = self.add_feed('lib', _LIB)
+        s = self.make_solver()
+        s.stats = solver.SolverStats()
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=a4', s.selections[iface_cache.get_interface(lib)].id)
+        loaded = s.stats.feeds_loaded
+        selections = s.selections
+        s.solve(lib, self.arch)
+        self.assertEquals(loaded, s.stats.feeds_loaded)
+        self.assert_(s.selections is selections)
+
+    def test_feed_changed(self):
+        lib = self.add_feed('lib', _SIMPLE)
+        s = self.solve(lib)
+        self.assertEquals('sha1=52', self.get_selections(s)[lib])
+        self.add_feed('lib', _SIMPLE + '<implementation id="sha1=54" version="4" stability="stable"/>')
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=54', self.get_selections(s)[lib])
+
+    def test_stability_changed(self):
+        lib = self.add_feed('lib', _SIMPLE)
+        s = self.solve(lib)
+        self.assertEquals('sha1=52', self.get_selections(s)[lib])
+        iface = iface_cache.get_interface(lib)
+        iface.implementations['sha1=51'].user_stability = model.preferred
+        iface_cache.mark_changed(lib)
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=51', self.get_selections(s)[lib])
+
+    def test_network_use_changed(self):
+        lib = self.add_feed('lib', _SIMPLE)
+        self.store('sha1=51')
+        s = self.solve(lib, network_use=model.network_offline)
+        self.assertEquals('sha1=51', self.get_selections(s)[lib])
+        s.network_use = model.network_full
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=52', self.get_selections(s)[lib])
+
+    def test_help_with_testing_changed(self):
+        lib = self.add_feed('lib', _SIMPLE)
+        s = self.solve(lib)
+        self.assertEquals('sha1=52', self.get_selections(s)[lib])
+        s.help_with_testing = True
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=53', self.get_selections(s)[lib])
+        s.help_with_testing = False
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=52', self.get_selections(s)[lib])
+
+    def test_stored(self):
+        lib = self.add_feed('lib', _SIMPLE)
+        s = self.solve(lib, network_use=model.network_offline)
+        self.assertEquals(False, s.ready)
+        self.store('sha1=51')
+        s.solve(lib, self.arch)
+        self.assertEquals('sha1=51', self.get_selections(s)[lib])
+
+    # Details
+
+    def check_details(self, root, **kwargs):
+        recorded = self.solve(root, record_details=True, **kwargs)
+        lazy = self.solve(root, **kwargs)
+        self.assertEquals(self.get_selections(recorded), self.get_selections(lazy))
+        self.assertEquals(self.get_details(recorded), self.get_details(lazy))
+        return lazy
+
+    def test_details(self):
+        lib = self.add_feed('lib', _LIB)
+        self.store('sha1=a9')
+        for network_use in model.network_levels:
+            self.check_details(lib, network_use=network_use)
+
+    def test_details_sat(self):
+        lib = self.add_feed('lib', _LIB)
+        recorded = self.solve(lib, kind='sat', record_details=True)
+        lazy = self.solve(lib, kind='sat')
+        self.assertEquals(self.get_details(recorded), self.get_details(lazy))
+
+    def test_details_restricted(self):
+        self.add_feed('lib', _LIB)
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s</implementation>' %
+                             requires('lib', '<version before="2"/>'))
+        self.check_details(prog)
+
+    def test_details_machine_group(self):
+        # Trying lib 2 selects x86_64 for depA, and this isn't undone when
+        # depB fails, so lib 1 (i686) is rejected later on
+        prog = self.add_feed('prog', '<implementation id="sha1=f1" version="1">%s</implementation>' %
+                             requires('lib', '<version before="3"/>'))
+        self.add_feed('lib', """
+            <implementation id="sha1=b3" version="3"/>
+            <implementation id="sha1=b2" version="2">%s%s</implementation>
+            <implementation id="sha1=b1" version="1" arch="Linux-i686"/>
+            <implementation id="sha1=b0" version="0"/>""" % (requires('depA'), requires('depB')))
+        self.add_feed('depA', '<implementation id="sha1=d1" version="1" arch="Linux-x86_64"/>')
+        self.add_feed('depB', '')
+        s = self.check_details(prog)
+        self.assertEquals('sha1=b0', self.get_selections(s)['http://example.com/lib.xml'])
+        reasons = dict(self.get_details(s)['http://example.com/lib.xml'])
+        self.assertEquals(_("Incompatible with dependency restrictions"), reasons['sha1=b2'])
+        self.assertEquals(_("Incompatible with another selection from a different architecture group"),
+                          reasons['sha1=b1'])
+
+
+class NotId(model.Restriction):
+    """A non-version restriction, which the index leaves to meets_restriction."""
+
+    def __init__(self, id):
+        self.id = id
+
+    def meets_restriction(self, impl):
+        return impl.id != self.id
+
+
+class TestVersionIndex(unittest.TestCase):
+
+    def setUp(self):
+        # Unsorted, with equal versions
+        versions = ['1.0', '1', '2', '1.2-pre', '1.0', '0.9', '1.2', '1.0', '2-post', '1.0.1']
+        self.impls = []
+        for i, v in enumerate(versions):
+            impl = model.ZeroInstallImplementation(None, 'sha1=%x' % i)
+            impl.version = model.parse_version(v)
+            self.impls.append(impl)
+        self.index = model.VersionIndex(self.impls)
+
+    def check(self, restrictions):
+        expected = [impl for impl in self.impls
+                    if not [r for r in restrictions if not r.meets_restriction(impl)]]
+        self.assertEquals(expected, self.index.select(restrictions), map(str, restrictions))
+        return expected
+
+    def test_ranges(self):
+        # Stored versions, and ones which fall between them
+        bounds = [None, '0.1', '0.9', '1', '1.0', '1.0.0', '1.0.1', '1.1', '1.2-pre',
+                  '1.2-rc', '1.2', '2', '2-post', '2.0', '3']
+        for not_before in bounds:
+            for before in bounds:
+                self.check([model.VersionRangeRestriction(
+                    before=model.parse_version(before), not_before=model.parse_version(not_before))])
+
+    def test_examples(self):
+        def between(not_before, before):
+            return model.VersionRangeRestriction(
+                    before=model.parse_version(before), not_before=model.parse_version(not_before))
+        def versions(restrictions):
+            return [impl.get_version() for impl in self.check(restrictions)]
+        # not-before is inclusive, before is exclusive
+        self.assertEquals(['1.0', '1.0', '1.0', '1.0.1'], versions([between('1.0', '1.1')]))
+        self.assertEquals(['1.0', '1', '1.0', '0.9', '1.0'], versions([between(None, '1.0.1')]))
+        self.assertEquals(['2', '1.2', '2-post'], versions([between('1.2', None)]))
+        # Bounds between the stored versions
+        self.assertEquals(['1.2-pre'], versions([between('1.1', '1.2-rc')]))
+        # Empty ranges
+        self.assertEquals([], versions([between('1.0', '1.0')]))
+        self.assertEquals([], versions([between('2', '1')]))
+        self.assertEquals([], versions([between('3', None)]))
+        self.assertEquals([], versions([between(None, '0.1')]))
+
+    def test_exact(self):
+        for v in ['0.9', '1', '1.0', '1.1', '1.2-pre', '2-post', '3']:
+            self.check([model.VersionRestriction(model.parse_version(v))])
+        self.assertEquals(3, len(self.index.select([model.VersionRestriction(model.parse_version('1.0'))])))
+
+    def test_combined(self):
+        self.check([model.VersionRangeRestriction(before=model.parse_version('2'), not_before=model.parse_version('1')),
+                    model.VersionRangeRestriction(before=model.parse_version('1.2'), not_before=model.parse_version('1.0'))])
+        self.check([model.VersionRangeRestriction(before=model.parse_version('2'), not_before=None),
+                    model.VersionRestriction(model.parse_version('1.0')), NotId('sha1=4')])
+        self.check([model.VersionRestriction(model.parse_version('1.0')),
+                    model.VersionRestriction(model.parse_version('1.2'))])
+        self.check([NotId('sha1=0'), NotId('sha1=2')])
+        self.check([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.injector import overrides, qdom
+from zeroinstall.injector.model import escape
+
+
+_NS = 'http://zero-install.sourceforge.net/2004/injector/interface'
+
+_LEGACY = """<?xml version="1.0" ?>
+<interface-preferences xmlns="%s" uri="%%s" stability-policy="testing" last-checked="123">
+ <implementation id="sha1=1" user-stability="buggy"/>
+ <feed src="http://example.com/extra.xml" arch="Linux-*"/>
+</interface-preferences>
+""" % _NS
+
+
+class TestOverridesStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.saved = (basedir.xdg_config_home, basedir.xdg_config_dirs)
+        basedir.xdg_config_home = os.path.join(self.tmp, 'config')
+        basedir.xdg_config_dirs = [basedir.xdg_config_home]
+        basedir.invalidate()
+        self.user_overrides = basedir.save_config_path(
+                '0install.net', 'injector', 'user_overrides')
+        self.path = os.path.join(self.tmp, 'user-overrides.xml')
+
+    def tearDown(self):
+        basedir.xdg_config_home, basedir.xdg_config_dirs = self.saved
+        basedir.invalidate()
+        shutil.rmtree(self.tmp)
+
+    def write_legacy(self, uri):
+        path = os.path.join(self.user_overrides, escape(uri))
+        stream = file(path, 'w')
+        stream.write(_LEGACY % uri)
+        stream.close()
+        return path
+
+    def test_migrate(self):
+        self.write_legacy('http://example.com/a.xml')
+        self.write_legacy('http://example.com/b.xml')
+        store = overrides.OverridesStore(self.path)
+        self.assertEquals(['http://example.com/a.xml', 'http://example.com/b.xml'],
+                sorted(store.list_uris()))
+        element = store.get('http://example.com/a.xml')
+        self.assertEquals('testing', element.getAttribute('stability-policy'))
+        self.assertEquals(['implementation', 'feed'],
+                [child.name for child in element.childNodes])
+
+        store.flush()
+        reloaded = overrides.OverridesStore(self.path)
+        self.assertEquals('123', reloaded.get('http://example.com/b.xml').getAttribute('last-checked'))
+
+    def test_write_behind(self):
+        store = overrides.OverridesStore(self.path)
+        for i in range(10):
+            element = overrides.make_element('http://example.com/a.xml')
+            element.attrs['last-checked'] = str(i)
+            store.set('http://example.com/a.xml', element)
+        self.assertFalse(os.path.exists(self.path))
+
+        store.flush()
+        reloaded = overrides.OverridesStore(self.path)
+        self.assertEquals('9', reloaded.get('http://example.com/a.xml').getAttribute('last-checked'))
+
+    def test_merge(self):
+        first = overrides.OverridesStore(self.path)
+        second = overrides.OverridesStore(self.path)
+        first.set('http://example.com/a.xml', overrides.make_element('http://example.com/a.xml'))
+        second.set('http://example.com/b.xml', overrides.make_element('http://example.com/b.xml'))
+        first.flush()
+        second.flush()
+
+        reloaded = overrides.OverridesStore(self.path)
+        self.assertEquals(['http://example.com/a.xml', 'http://example.com/b.xml'],
+                sorted(reloaded.list_uris()))
+
+        second.remove('http://example.com/a.xml')
+        second.flush()
+        reloaded = overrides.OverridesStore(self.path)
+        self.assertEquals(['http://example.com/b.xml'], reloaded.list_uris())
+
+    def test_import_newer(self):
+        store = overrides.OverridesStore(self.path)
+        self.assertEquals([], store.list_uris())
+        store.flush()
+
+        # An older version saves some settings later
+        path = self.write_legacy('http://example.com/a.xml')
+        later = time.time() + 10
+        os.utime(path, (later, later))
+        os.utime(self.user_overrides, (later, later))
+        basedir.invalidate()
+        store = overrides.OverridesStore(self.path)
+        self.assertEquals(['http://example.com/a.xml'], store.list_uris())
+        store.flush()
+
+    def test_export(self):
+        store = overrides.OverridesStore(self.path)
+        element = overrides.make_element('http://example.com/a.xml')
+        element.attrs['stability-policy'] = 'stable'
+        element.childNodes.append(overrides.make_child(_NS, 'feed',
+            {'src': 'http://example.com/<extra>.xml'}))
+        store.set('http://example.com/a.xml', element)
+        self.assertEquals(1, store.export())
+
+        stream = file(os.path.join(self.user_overrides, escape('http://example.com/a.xml')))
+        root = qdom.parse(stream)
+        stream.close()
+        self.assertEquals((_NS, 'interface-preferences'), (root.uri, root.name))
+        self.assertEquals('stable', root.getAttribute('stability-policy'))
+        self.assertEquals('http://example.com/<extra>.xml', root.childNodes[0].getAttribute('src'))
+
+        # The exported files aren't imported again
+        store.set('http://example.com/a.xml', overrides.make_element('http://example.com/a.xml'))
+        store.flush()
+        reloaded = overrides.OverridesStore(self.path)
+        self.assertEquals(None, reloaded.get('http://example.com/a.xml').getAttribute('stability-policy'))
+
+
+if __name__ == '__main__':
+    unittest.main()
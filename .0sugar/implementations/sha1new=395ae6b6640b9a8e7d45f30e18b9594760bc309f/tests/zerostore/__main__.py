@@ -0,0 +1,16 @@
+import unittest
+
+import os
+import sys
+sys.path[0] = os.path.abspath(os.curdir)
+
+from manifests import *
+from stores import *
+from verifyledger import *
+from audits import *
+from dedups import *
+from optimisers import *
+
+
+if __name__ == '__main__':
+    unittest.main()
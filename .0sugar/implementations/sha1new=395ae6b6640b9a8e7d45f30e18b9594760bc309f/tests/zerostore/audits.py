@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+from zeroinstall.zerostore import manifest, audit
+
+
+class TestAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.items = []
+        alg = manifest.get_algorithm('sha1new')
+        for i in range(4):
+            tree = os.path.join(self.tmp, 'tmp-%d' % i)
+            os.mkdir(tree)
+            stream = file(os.path.join(tree, 'data'), 'w')
+            stream.write('data %d\n' % i * 100)
+            stream.close()
+            digest = alg.getID(manifest.add_manifest_file(tree, alg))
+            os.chmod(tree, 0755)
+            path = os.path.join(self.tmp, digest)
+            os.rename(tree, path)
+            self.items.append((path, digest))
+        os.chmod(self.items[2][0], 0755)
+        os.unlink(os.path.join(self.items[2][0], '.manifest'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_audit(self):
+        for workers in [1, 2]:
+            results = dict([(result.path, result) for result in
+                    audit.audit(self.items, full=True, workers=workers)])
+            results = [results[path] for path, digest in self.items]
+            self.assertEquals([None, None, 'Cached item does NOT verify.', None],
+                    [result.error for result in results])
+            self.assertEquals([1, 1, 1, 1], [result.files_read for result in results])
+            self.assertEquals(700, results[0].bytes_read)
+            assert 'No .manifest file' in results[2].detail
+            assert set(results[0].as_dict()) == set(audit.AuditResult.__slots__)
+
+
+if __name__ == '__main__':
+    unittest.main()
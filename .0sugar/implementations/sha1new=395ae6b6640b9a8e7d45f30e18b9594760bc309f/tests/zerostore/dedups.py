@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.zerostore import Store, manifest, dedup
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.old_cache_home = basedir.xdg_cache_home
+        basedir.xdg_cache_home = os.path.join(self.tmp, 'cache')
+        self.store = Store(os.path.join(self.tmp, 'implementations'))
+
+    def tearDown(self):
+        basedir.xdg_cache_home = self.old_cache_home
+        for root, dirs, files in os.walk(self.tmp):
+            os.chmod(root, 0755)
+        shutil.rmtree(self.tmp)
+
+    def add(self, name, files):
+        tree = os.path.join(self.tmp, name)
+        os.mkdir(tree)
+        for leaf, data in files.iteritems():
+            path = os.path.join(tree, leaf)
+            stream = file(path, 'w')
+            stream.write(data)
+            stream.close()
+            os.utime(path, (1000000000, 1000000000))
+        alg = manifest.get_algorithm('sha1new')
+        digest = alg.getID(manifest.add_manifest_file(tree, alg))
+        os.unlink(os.path.join(tree, '.manifest'))
+        self.store.add_dir_to_cache(digest, tree)
+        return os.path.join(self.store.dir, digest)
+
+    def inode(self, *path):
+        return os.stat(os.path.join(*path)).st_ino
+
+    def savings(self):
+        index = dedup.DedupIndex()
+        try:
+            return index.get_savings()
+        finally:
+            index.close()
+
+    def test_link_on_add(self):
+        a = self.add('a', {'lib': 'library\n' * 100, 'a': 'only in a\n'})
+        b = self.add('b', {'lib': 'library\n' * 100, 'b': 'only in b\n',
+                           'copy': 'library\n' * 100})
+        self.assertEquals(self.inode(a, 'lib'), self.inode(b, 'lib'))
+        self.assertEquals(self.inode(a, 'lib'), self.inode(b, 'copy'))
+        self.assertNotEquals(self.inode(a, 'a'), self.inode(b, 'b'))
+        self.assertEquals((2, 1600), self.savings())
+        manifest.verify(b)
+        self.assertEquals(0555, os.stat(b).st_mode & 0777)
+        self.assertEquals([], [leaf for leaf in os.listdir(self.store.dir)
+                               if not leaf.startswith('sha1new=')])
+
+        # Stale entries are replaced
+        os.chmod(self.store.dir, 0755)
+        os.chmod(a, 0755)
+        shutil.rmtree(a)
+        self.assertEquals((2, 1600), self.savings())
+        c = self.add('c', {'lib': 'library\n' * 100, 'c': 'only in c\n'})
+        self.assertEquals(self.inode(b, 'lib'), self.inode(c, 'lib'))
+        self.assertEquals((3, 2400), self.savings())
+
+    def test_modified(self):
+        a = self.add('a', {'lib': 'library\n' * 100})
+        # Changed in place, keeping its size and mtime
+        path = os.path.join(a, 'lib')
+        os.chmod(path, 0644)
+        stream = file(path, 'w')
+        stream.write('LIBRARY\n' * 100)
+        stream.close()
+        os.chmod(path, 0444)
+        os.utime(path, (1000000000, 1000000000))
+
+        b = self.add('b', {'lib': 'library\n' * 100, 'b': 'only in b\n'})
+        self.assertNotEquals(self.inode(a, 'lib'), self.inode(b, 'lib'))
+        manifest.verify(b)
+        self.assertEquals((0, 0), self.savings())
+
+        # The modified copy was dropped from the index
+        c = self.add('c', {'lib': 'library\n' * 100, 'c': 'only in c\n'})
+        self.assertEquals(self.inode(b, 'lib'), self.inode(c, 'lib'))
+        self.assertEquals((1, 800), self.savings())
+
+    def test_rebuild(self):
+        a = self.add('a', {'lib': 'library\n' * 100})
+        b = self.add('b', {'lib': 'library\n' * 100, 'b': 'b\n'})
+        index = dedup.DedupIndex()
+        try:
+            self.assertEquals(2, index.rebuild([self.store.dir, '/nonexistent']))
+            self.assertEquals((1, 800), index.get_savings())
+            self.assertEquals(3, index.count_files())
+        finally:
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
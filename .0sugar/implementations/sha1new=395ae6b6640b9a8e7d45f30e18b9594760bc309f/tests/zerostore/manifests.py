@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.zerostore import manifest, BadDigest
+
+
+def hexdigest(alg, data):
+    digest = alg.new_digest()
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.tree = os.path.join(self.tmp, 'tree')
+        os.makedirs(os.path.join(self.tree, 'bin'))
+        os.makedirs(os.path.join(self.tree, 'share', 'empty'))
+        self.write('bin/prog', '#!/bin/sh\n', 0555)
+        self.write('share/small', 'small\n', 0444)
+        # Spans several blocks, and doesn't end on a block boundary
+        self.write('share/big', ''.join([chr(i % 251) for i in range(manifest.BLOCK_SIZE * 3 + 17)]), 0444)
+        self.write('share/block', 'x' * manifest.BLOCK_SIZE, 0444)
+        self.write('share/nothing', '', 0444)
+        os.symlink('small', os.path.join(self.tree, 'share', 'link'))
+
+    def tearDown(self):
+        for root, dirs, files in os.walk(self.tmp):
+            os.chmod(root, 0755)
+        shutil.rmtree(self.tmp)
+
+    def write(self, path, data, mode):
+        path = os.path.join(self.tree, path)
+        stream = file(path, 'w')
+        stream.write(data)
+        stream.close()
+        os.chmod(path, mode)
+        os.utime(path, (1000000000, 1000000000))
+
+    def whole_file_manifest(self, alg):
+        """The manifest, hashing each file in one go (the old way)."""
+        lines = []
+        for line in alg.generate_manifest(self.tree):
+            if line[0] in 'XF':
+                type, digest, mtime, size, leaf = line.split(' ', 4)
+                assert int(size) == len(self.find(leaf))
+                line = ' '.join([type, hexdigest(alg, self.find(leaf)), mtime, size, leaf])
+            lines.append(line + '\n')
+        return ''.join(lines)
+
+    def find(self, leaf):
+        for root, dirs, files in os.walk(self.tree):
+            if leaf in files:
+                return file(os.path.join(root, leaf)).read()
+
+    def test_identical(self):
+        for name in ['sha1', 'sha1new', 'sha256']:
+            alg = manifest.get_algorithm(name)
+            expected = self.whole_file_manifest(alg)
+            digest = manifest.add_manifest_file(self.tree, alg)
+            mfile = os.path.join(self.tree, '.manifest')
+            self.assertEquals(expected, file(mfile).read())
+            self.assertEquals(hexdigest(alg, expected), digest.hexdigest())
+            self.assertEquals(0444, os.stat(mfile).st_mode & 0777)
+
+            manifest.verify(self.tree, alg.getID(digest))
+
+            os.chmod(self.tree, 0755)
+            os.unlink(mfile)
+
+    def test_parallel(self):
+        saved = manifest.PARALLEL_MIN_BYTES
+        manifest.PARALLEL_MIN_BYTES = 0
+        try:
+            for name in ['sha1', 'sha1new', 'sha256']:
+                alg = manifest.get_algorithm(name)
+                expected = list(alg.generate_manifest(self.tree))
+                for workers in [1, 2, 3]:
+                    self.assertEquals(expected,
+                            list(manifest.generate_manifest_parallel(alg, self.tree, workers)))
+        finally:
+            manifest.PARALLEL_MIN_BYTES = saved
+
+    def test_failure(self):
+        alg = manifest.get_algorithm('sha1new')
+        os.mkdir(os.path.join(self.tree, 'bad\ndir'))
+        self.assertRaises(BadDigest, manifest.add_manifest_file, self.tree, alg)
+        self.assertFalse(os.path.exists(os.path.join(self.tree, '.manifest')))
+
+    def test_verify(self):
+        alg = manifest.get_algorithm('sha1new')
+        required = alg.getID(manifest.add_manifest_file(self.tree, alg))
+        os.chmod(os.path.join(self.tree, 'share'), 0755)
+        self.write('share/small', 'changed\n', 0444)
+        try:
+            manifest.verify(self.tree, required)
+            assert False
+        except BadDigest, ex:
+            assert 'The contents of the directory have changed' in ex.detail
+            assert '+F %s 1000000000 8 small\n' % hexdigest(alg, 'changed\n') in ex.detail
+
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.saved = (basedir.xdg_config_home, basedir.xdg_config_dirs,
+                      manifest.workers, manifest.parallel_by_default)
+        basedir.xdg_config_home = self.tmp
+        basedir.xdg_config_dirs = [self.tmp]
+        basedir.invalidate()
+        manifest.workers = None
+        manifest.parallel_by_default = False
+
+    def tearDown(self):
+        (basedir.xdg_config_home, basedir.xdg_config_dirs,
+         manifest.workers, manifest.parallel_by_default) = self.saved
+        basedir.invalidate()
+        shutil.rmtree(self.tmp)
+
+    def configure(self, value):
+        path = basedir.save_config_path('0install.net', 'injector')
+        stream = file(os.path.join(path, 'manifest-workers'), 'w')
+        stream.write(value)
+        stream.close()
+        manifest.workers = None
+
+    def test_serial_by_default(self):
+        # (e.g. in a GTK program, where forking isn't safe)
+        self.assertEquals(1, manifest.get_workers())
+
+    def test_parallel_by_default(self):
+        manifest.parallel_by_default = True
+        self.assertEquals(manifest.multiprocessing.cpu_count(), manifest.get_workers())
+
+    def test_configured(self):
+        self.configure('3\n')
+        self.assertEquals(3, manifest.get_workers())
+        self.configure('0\n')
+        self.assertEquals(manifest.multiprocessing.cpu_count(), manifest.get_workers())
+        self.configure('1\n')
+        manifest.parallel_by_default = True
+        self.assertEquals(1, manifest.get_workers())
+
+
+if __name__ == '__main__':
+    unittest.main()
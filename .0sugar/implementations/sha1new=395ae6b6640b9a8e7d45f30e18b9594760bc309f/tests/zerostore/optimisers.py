@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+from zeroinstall.support import basedir
+from zeroinstall.zerostore import manifest, optimise
+
+LIB = 'library\n' * 1000
+
+
+class TestOptimise(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.old_cache_home = basedir.xdg_cache_home
+        basedir.xdg_cache_home = os.path.join(self.tmp, 'cache')
+        self.stores = []
+        for name in ['user', 'system']:
+            path = os.path.join(self.tmp, name, 'implementations')
+            os.makedirs(path)
+            self.stores.append(path)
+
+    def tearDown(self):
+        basedir.xdg_cache_home = self.old_cache_home
+        for root, dirs, files in os.walk(self.tmp):
+            os.chmod(root, 0755)
+        shutil.rmtree(self.tmp)
+
+    def add(self, store, files):
+        # (without linking duplicates as it's added)
+        tree = tempfile.mkdtemp(dir=store, prefix='tmp-')
+        for leaf, data in files.iteritems():
+            path = os.path.join(tree, leaf)
+            stream = file(path, 'w')
+            stream.write(data)
+            stream.close()
+            os.utime(path, (1000000000, 1000000000))
+        manifest.fixup_permissions(tree)
+        alg = manifest.get_algorithm('sha1new')
+        digest = alg.getID(manifest.add_manifest_file(tree, alg))
+        os.chmod(tree, 0755)
+        impl = os.path.join(store, digest)
+        os.rename(tree, impl)
+        os.chmod(impl, 0555)
+        return impl
+
+    def inode(self, *path):
+        return os.stat(os.path.join(*path)).st_ino
+
+    def test_optimise(self):
+        a = self.add(self.stores[0], {'lib': LIB, 'a': 'a\n'})
+        b = self.add(self.stores[0], {'lib': LIB, 'b': 'b\n'})
+        c = self.add(self.stores[1], {'lib': LIB, 'c': 'c\n', 'copy': LIB})
+
+        stats = optimise.optimise(self.stores, dry_run=True)
+        self.assertEquals({'uniq_size': 8006, 'dup_size': 24000, 'already_linked': 0,
+                           'man_size': stats.man_size, 'new_impls': 3, 'skipped_impls': 0},
+                          stats.as_dict())
+        self.assertNotEquals(self.inode(a, 'lib'), self.inode(b, 'lib'))
+
+        self.assertEquals(stats.as_dict(), optimise.optimise(self.stores).as_dict())
+        for impl in [b, c]:
+            self.assertEquals(self.inode(a, 'lib'), self.inode(impl, 'lib'))
+            manifest.verify(impl)
+        self.assertEquals(self.inode(a, 'lib'), self.inode(c, 'copy'))
+        self.assertEquals(0555, os.stat(os.path.join(c)).st_mode & 0777)
+        self.assertEquals(3, len(os.listdir(self.stores[0])) + len(os.listdir(self.stores[1])))
+
+        # Only new implementations are checked next time
+        d = self.add(self.stores[0], {'lib': LIB, 'd': 'd\n'})
+        stats = optimise.optimise(self.stores)
+        self.assertEquals({'uniq_size': 8008, 'dup_size': 8000, 'already_linked': 24000,
+                           'man_size': stats.man_size, 'new_impls': 1, 'skipped_impls': 3},
+                          stats.as_dict())
+        self.assertEquals(self.inode(a, 'lib'), self.inode(d, 'lib'))
+
+        stats = optimise.optimise(self.stores[0])
+        self.assertEquals((0, 0, 3), (stats.dup_size, stats.new_impls, stats.skipped_impls))
+
+
+if __name__ == '__main__':
+    unittest.main()
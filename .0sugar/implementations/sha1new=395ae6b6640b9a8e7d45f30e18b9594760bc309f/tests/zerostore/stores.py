@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+import zeroinstall.zerostore
+from zeroinstall.zerostore import Store, Stores, NotStored, BadDigest
+
+
+class TestStoresLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.stores = Stores()
+        self.stores.stores = []
+        for name in ['user', 'system']:
+            path = os.path.join(self.tmp, name)
+            os.mkdir(path)
+            self.stores.stores.append(Store(path))
+        self.add('user', 'sha1new=1')
+        self.add('system', 'sha1new=1')
+        self.add('system', 'sha256=2')
+        os.mkdir(os.path.join(self.tmp, 'system', 'tmp-xyz'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def add(self, store, digest):
+        os.mkdir(os.path.join(self.tmp, store, digest))
+
+    def test_lookup(self):
+        self.assertEquals(os.path.join(self.tmp, 'user', 'sha1new=1'),
+                self.stores.lookup('sha1new=1'))
+        self.assertEquals(os.path.join(self.tmp, 'system', 'sha256=2'),
+                self.stores.lookup('sha256=2'))
+        self.assertEquals({'hits': 2, 'misses': 0}, self.stores.stats.as_dict())
+
+        self.assertRaises(NotStored, self.stores.lookup, 'sha1new=3')
+        self.assertRaises(BadDigest, self.stores.lookup, 'sha1new=xyz')
+        self.assertRaises(BadDigest, self.stores.lookup, 'sha1new')
+        self.assertEquals({'hits': 2, 'misses': 2}, self.stores.stats.as_dict())
+
+    def test_index(self):
+        self.assertEquals(frozenset(['sha1new=1', 'sha256=2']), self.stores.get_index())
+        index = self.stores.get_index()
+        self.assert_(index is self.stores.get_index())
+
+        # Added by another process; not in the index yet, but still found
+        self.add('system', 'sha1new=3')
+        self.assertEquals(os.path.join(self.tmp, 'system', 'sha1new=3'),
+                self.stores.lookup('sha1new=3'))
+        self.assertEquals({'hits': 0, 'misses': 1}, self.stores.stats.as_dict())
+        self.assertEquals(frozenset(['sha1new=1', 'sha256=2', 'sha1new=3']), self.stores.get_index())
+        self.stores.lookup('sha1new=3')
+        self.assertEquals({'hits': 1, 'misses': 1}, self.stores.stats.as_dict())
+
+    def test_removed(self):
+        self.assertEquals(os.path.join(self.tmp, 'user', 'sha1new=1'),
+                self.stores.lookup('sha1new=1'))
+
+        # Removed by another process; still in the index, but not used
+        os.rmdir(os.path.join(self.tmp, 'user', 'sha1new=1'))
+        self.assertEquals(os.path.join(self.tmp, 'system', 'sha1new=1'),
+                self.stores.lookup('sha1new=1'))
+        self.assertEquals(frozenset(), self.stores.stores[0].get_digests())
+
+        os.rmdir(os.path.join(self.tmp, 'system', 'sha1new=1'))
+        self.assertRaises(NotStored, self.stores.lookup, 'sha1new=1')
+
+    def test_refresh(self):
+        store = self.stores.stores[1]
+        self.assertEquals(frozenset(['sha1new=1', 'sha256=2']), store.get_digests())
+        self.add('system', 'sha1new=3')
+        os.utime(store.dir, (1, 1))
+        self.assertEquals(frozenset(['sha1new=1', 'sha256=2']), store.get_digests())
+
+        # After INDEX_MAX_AGE, the changed mtime is noticed
+        store._digests_checked -= zeroinstall.zerostore.INDEX_MAX_AGE
+        self.assertEquals(frozenset(['sha1new=1', 'sha256=2', 'sha1new=3']), store.get_digests())
+
+        # Unchanged mtime; no need to list it again
+        digests = store.get_digests()
+        store._digests_checked -= zeroinstall.zerostore.INDEX_MAX_AGE
+        self.assert_(digests is store.get_digests())
+
+    def test_missing(self):
+        self.stores.stores.append(Store(os.path.join(self.tmp, 'missing')))
+        self.assertEquals(frozenset(['sha1new=1', 'sha256=2']), self.stores.get_index())
+        self.assertRaises(NotStored, self.stores.lookup, 'sha1new=3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from __init__ import *
+from zeroinstall.zerostore import manifest, ledger, BadDigest
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='0install-test-')
+        self.tree = os.path.join(self.tmp, 'tree')
+        os.makedirs(os.path.join(self.tree, 'lib'))
+        for name in ['a', 'lib/b', 'lib/c']:
+            self.write(name, 'contents of %s\n' % name)
+        alg = manifest.get_algorithm('sha1new')
+        self.digest = alg.getID(manifest.add_manifest_file(self.tree, alg))
+        self.ledger = ledger.Ledger(os.path.join(self.tmp, 'ledger.sqlite'))
+
+    def tearDown(self):
+        self.ledger.close()
+        for root, dirs, files in os.walk(self.tmp):
+            os.chmod(root, 0755)
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, data):
+        path = os.path.join(self.tree, name)
+        stream = file(path, 'w')
+        stream.write(data)
+        stream.close()
+        # (recent changes aren't recorded)
+        os.utime(path, (1000000000, 1000000000))
+
+    def verify(self):
+        self.ledger.stats = ledger.LedgerStats()
+        manifest.verify(self.tree, self.digest, ledger=self.ledger)
+        stats = self.ledger.stats
+        return stats.reused_files, stats.hashed_files
+
+    def test_incremental(self):
+        import time
+        time.sleep(2)    # (so the ctimes are old enough to record)
+        self.assertEquals((0, 3), self.verify())
+        self.assertEquals((3, 0), self.verify())
+
+        self.ledger.reuse = False
+        self.assertEquals((0, 3), self.verify())
+        self.ledger.reuse = True
+
+        # Changed in place, with the original size and mtime
+        path = os.path.join(self.tree, 'lib', 'b')
+        os.chmod(path, 0644)
+        self.write('lib/b', 'CONTENTS of lib/b\n')
+        os.chmod(path, 0444)
+        try:
+            self.verify()
+            assert False
+        except BadDigest, ex:
+            assert 'have changed' in ex.detail, ex.detail
+        # The changed file was hashed, but is too new to record
+        self.assertEquals(['a', 'lib/c'], sorted(self.ledger.get_files(self.tree, 'sha1new')))
+
+    def test_forget(self):
+        self.ledger.record(self.tree, 'sha1new', [('a', 1, 2, 3.0, 4.0, 'abc')])
+        self.ledger.record(os.path.join(self.tmp, 'missing'), 'sha1new', [('a', 1, 2, 3.0, 4.0, 'abc')])
+        self.assertEquals(1, self.ledger.forget_missing())
+        self.assertEquals({'a': (1, 2, 3.0, 4.0, 'abc')}, self.ledger.get_files(self.tree, 'sha1new'))
+        self.assertEquals({}, self.ledger.get_files(self.tree, 'sha256'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,7 @@ def compile(policy, interface, autocompile = False):
 		# A new local feed may have been registered, so update the interface from the cache
 		info(_("0compile command completed successfully. Reloading interface details."))
 		reader.update_from_cache(interface)
+		iface_cache.iface_cache.mark_changed(interface.uri)
 		policy.recalculate()
 
 	def build():
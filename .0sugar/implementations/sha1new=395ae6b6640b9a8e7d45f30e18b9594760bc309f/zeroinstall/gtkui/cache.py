@@ -95,6 +95,8 @@ class CachedInterface(object):
 		if user_overrides:
 			#print "Delete", user_overrides
 			os.unlink(user_overrides)
+		from zeroinstall.injector.iface_cache import iface_cache
+		iface_cache.get_user_overrides().remove(self.uri)
 	
 	def __cmp__(self, other):
 		return self.uri.__cmp__(other.uri)
@@ -341,27 +343,44 @@ class CacheExplorer:
 		error_interfaces = []
 
 		# Look through cached interfaces for implementation owners
-		all = self.iface_cache.list_all_interfaces()
+		# (using the feed index, if we can, to avoid loading them all)
+		index = self.iface_cache.get_feed_index()
+		if index:
+			indexed = dict([(info.uri, info) for info in index.list_feeds()])
+			all = indexed.keys()
+		else:
+			indexed = {}
+			all = self.iface_cache.list_all_interfaces()
 		all.sort()
 		for uri in all:
 			iface_size = 0
 			try:
-				if uri.startswith('/'):
-					cached_iface = uri
+				info = indexed.get(uri, None)
+				if info is not None and not uri.startswith('/'):
+					iface_size = info.size + info.overrides_size
+					if info.error:
+						error_interfaces.append((uri, info.error, iface_size))
+						continue
+					iface = info
+					impls = index.get_implementations(uri)
 				else:
-					cached_iface = basedir.load_first_cache(namespaces.config_site,
-							'interfaces', model.escape(uri))
-				user_overrides = basedir.load_first_config(namespaces.config_site,
-							namespaces.config_prog,
-							'user_overrides', model.escape(uri))
-
-				iface_size = size_if_exists(cached_iface) + size_if_exists(user_overrides)
-				iface = self.iface_cache.get_interface(uri)
+					if uri.startswith('/'):
+						cached_iface = uri
+					else:
+						cached_iface = basedir.load_first_cache(namespaces.config_site,
+								'interfaces', model.escape(uri))
+					user_overrides = basedir.load_first_config(namespaces.config_site,
+								namespaces.config_prog,
+								'user_overrides', model.escape(uri))
+
+					iface_size = size_if_exists(cached_iface) + size_if_exists(user_overrides)
+					iface = self.iface_cache.get_interface(uri)
+					impls = iface.implementations.values()
 			except Exception, ex:
 				error_interfaces.append((uri, str(ex), iface_size))
 			else:
 				cached_iface = ValidInterface(iface, iface_size)
-				for impl in iface.implementations.values():
+				for impl in impls:
 					if impl.id.startswith('/') or impl.id.startswith('.'):
 						cached_iface.in_cache.append(LocalImplementation(impl))
 					if impl.id in unowned:
@@ -34,6 +34,9 @@ def get_selections_gui(iface_uri, gui_args, test_callback = None):
 	import socket
 	cli, gui = socket.socketpair()
 
+	from zeroinstall.injector.iface_cache import iface_cache
+	iface_cache.flush_user_overrides()	# (so the GUI sees them, and the child doesn't save them again)
+
 	try:
 		child = os.fork()
 		if child == 0:
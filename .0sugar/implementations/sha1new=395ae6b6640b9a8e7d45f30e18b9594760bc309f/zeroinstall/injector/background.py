@@ -20,6 +20,7 @@ def _escape_xml(s):
 	return s.replace('&', '&amp;').replace('<', '&lt;')
 
 def _exec_gui(uri, *args):
+	iface_cache.flush_user_overrides()	# (atexit handlers won't run)
 	os.execvp('0launch', ['0launch', '--download-only', '--gui'] + list(args) + [uri])
 
 class _NetworkState:
@@ -136,6 +137,7 @@ class BackgroundHandler(handler.Handler):
 def _detach():
 	"""Fork a detached grandchild.
 	@return: True if we are the original."""
+	iface_cache.flush_user_overrides()
 	child = os.fork()
 	if child:
 		pid, status = os.waitpid(child, 0)
@@ -237,7 +239,10 @@ def spawn_background_update(policy, verbose):
 
 	try:
 		try:
-			_check_for_updates(policy, verbose)
+			try:
+				_check_for_updates(policy, verbose)
+			finally:
+				iface_cache.flush_user_overrides()	# (atexit handlers won't run)
 		except SystemExit:
 			raise
 		except:
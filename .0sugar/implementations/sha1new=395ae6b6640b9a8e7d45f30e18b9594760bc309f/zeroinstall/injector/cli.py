@@ -32,6 +32,16 @@ def _list_interfaces(args):
 	for i in matches:
 		print i
 
+def _rebuild_feed_index():
+	index = iface_cache.get_feed_index()
+	if index is None:
+		raise SafeException(_("The feed index is not available (is Python's sqlite3 module installed?)"))
+	print _("Indexed %d feeds") % index.rebuild()
+
+def _export_overrides():
+	count = iface_cache.get_user_overrides().export()
+	print _("Exported settings for %d interfaces") % count
+
 def _import_feed(args):
 	from zeroinstall.support import tasks
 	from zeroinstall.injector import gpg, handler
@@ -325,6 +335,7 @@ def main(command_args):
 	parser.add_option("", "--cpu", help=_("target CPU type"), metavar='CPU')
 	parser.add_option("-d", "--download-only", help=_("fetch but don't run"), action='store_true')
 	parser.add_option("-D", "--dry-run", help=_("just print actions"), action='store_true')
+	parser.add_option("", "--export-overrides", help=_("save settings in the format used by older versions"), action='store_true')
 	parser.add_option("-f", "--feed", help=_("add or remove a feed"), action='store_true')
 	parser.add_option("", "--get-selections", help=_("write selected versions as XML"), action='store_true')
 	parser.add_option("-g", "--gui", help=_("show graphical policy editor"), action='store_true')
@@ -336,6 +347,7 @@ def main(command_args):
 	parser.add_option("", "--os", help=_("target operation system type"), metavar='OS')
 	parser.add_option("-o", "--offline", help=_("try to avoid using the network"), action='store_true')
 	parser.add_option("-r", "--refresh", help=_("refresh all used interfaces"), action='store_true')
+	parser.add_option("", "--rebuild-feed-index", help=_("re-read all cached feeds into the feed index"), action='store_true')
 	parser.add_option("", "--set-selections", help=_("run versions specified in XML file"), metavar='FILE')
 	parser.add_option("-s", "--source", help=_("select source code"), action='store_true')
 	parser.add_option("", "--systray", help=_("download in the background"), action='store_true')
@@ -374,6 +386,10 @@ def main(command_args):
 					"\nYou may redistribute copies of this program"
 					"\nunder the terms of the GNU Lesser General Public License."
 					"\nFor more information about these matters, see the file named COPYING.")
+		elif options.export_overrides:
+			_export_overrides()
+		elif options.rebuild_feed_index:
+			_rebuild_feed_index()
 		elif options.set_selections:
 			from zeroinstall.injector import qdom, run
 			sels = selections.Selections(qdom.parse(file(options.set_selections)))
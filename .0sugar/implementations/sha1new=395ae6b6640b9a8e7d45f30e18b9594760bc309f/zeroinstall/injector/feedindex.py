@@ -0,0 +1,381 @@
+"""
+An index of the feeds in the cache, so that they can be listed without reading them.
+
+The cached feeds (in the C{interfaces} cache directories) and the user's
+settings for them (in the C{user_overrides} configuration directories) remain
+the real store; the index is just a summary of them, kept in an SQLite database
+in the cache. Before answering a query, the index checks the modification times
+of those directories and, if any have changed (or had only just changed when
+they were last scanned), brings itself up-to-date. Only files which have
+changed since they were indexed are read again.
+
+L{iface_cache.IfaceCache} updates the index itself when it imports a feed, so
+this doesn't cause the file to be read again either.
+
+The user's settings are now kept in a single file (see L{overrides}), which is
+not indexed. The per-interface files are still indexed, for older versions of
+the injector which use them. If the index is given the settings store, the
+results include the interfaces which only have settings there, and the
+last_checked times come from there.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+from zeroinstall import _
+import os, time
+from logging import debug, info, warn
+
+try:
+	import sqlite3
+except ImportError:
+	sqlite3 = None
+
+from zeroinstall.support import basedir
+from zeroinstall.injector import qdom, distro, feedloader, model
+from zeroinstall.injector.namespaces import config_site, config_prog
+from zeroinstall.injector.model import unescape, parse_version, format_version
+
+# Change this whenever the tables change
+_INDEX_FORMAT = 1
+
+_SCHEMA = """
+CREATE TABLE dirs (path TEXT PRIMARY KEY, mtime REAL);
+CREATE TABLE feeds (
+	uri TEXT PRIMARY KEY,
+	path TEXT, size INTEGER, mtime REAL,
+	name TEXT, summary TEXT, error TEXT,
+	overrides_path TEXT, overrides_size INTEGER, overrides_mtime REAL,
+	last_checked INTEGER);
+CREATE TABLE feed_for (uri TEXT, target TEXT);
+CREATE INDEX feed_for_target ON feed_for (target);
+CREATE TABLE implementations (uri TEXT, id TEXT, version TEXT);
+CREATE INDEX implementations_uri ON implementations (uri);
+CREATE INDEX implementations_id ON implementations (id);
+"""
+
+_FEED_COLUMNS = ['uri', 'path', 'size', 'mtime', 'name', 'summary', 'error',
+		 'overrides_path', 'overrides_size', 'overrides_mtime', 'last_checked']
+
+class FeedInfo(object):
+	"""What the index knows about one feed.
+	@ivar uri: the feed's URI
+	@ivar path: the cached copy of the feed, or None if there isn't one
+	@ivar size: the size of path, in bytes (0 if there is no cached copy)
+	@ivar name: the feed's name, or None if it isn't cached or can't be read
+	@ivar summary: the feed's summary, or None
+	@ivar error: why the cached copy couldn't be read, or None if it could
+	@ivar overrides_path: the old per-interface file with the user's settings for this feed, or None if there isn't one
+	@ivar overrides_size: the size of overrides_path, in bytes (0 if there isn't one)
+	@ivar last_checked: when the feed was last downloaded, or None"""
+	__slots__ = _FEED_COLUMNS
+
+	def __init__(self, row):
+		for name, value in zip(_FEED_COLUMNS, row):
+			setattr(self, name, value)
+
+	def get_name(self):
+		"""@return: the name, or a name made from the URI if we don't know it (as for L{model.Interface.get_name})"""
+		return self.name or '(' + os.path.basename(self.uri) + ')'
+
+	def __repr__(self):
+		return "<FeedInfo %s>" % self.uri
+
+class ImplementationInfo(object):
+	"""An implementation listed in an indexed feed.
+	@ivar id: the implementation's ID
+	@ivar version: the version, as a string"""
+	__slots__ = ['id', 'version']
+
+	def __init__(self, id, version):
+		self.id = id
+		self.version = version
+
+	def get_version(self):
+		return self.version
+
+	def __cmp__(self, other):
+		"""Newer versions come first (as for L{model.Implementation})"""
+		return cmp(parse_version(other.version), parse_version(self.version))
+
+	def __repr__(self):
+		return "<ImplementationInfo %s>" % self.id
+
+_missing = (None, 0, None)
+
+def _get_file(path):
+	"""@return: (path, size, mtime), or L{_missing} if path is None or doesn't exist"""
+	if path is None:
+		return _missing
+	try:
+		st = os.stat(path)
+	except OSError:
+		return _missing
+	return (path, st.st_size, st.st_mtime)
+
+class FeedIndex(object):
+	"""An SQLite index of the feed cache.
+	The query methods raise C{sqlite3.Error} if the database can't be used.
+	@ivar path: the database file"""
+
+	def __init__(self, path = None, overrides = None):
+		"""@param path: the database to use (default: C{feed-index.sqlite} in the injector's cache directory)
+		@param overrides: the user's settings, to include in the results (see L{iface_cache.IfaceCache.get_user_overrides})
+		@type overrides: L{overrides.OverridesStore}"""
+		if path is None:
+			path = os.path.join(basedir.save_cache_path(config_site, config_prog), 'feed-index.sqlite')
+		self.path = path
+		self._overrides = overrides
+		self._db = sqlite3.connect(path, timeout = 60)
+		self._db.text_factory = str
+		if self._db.execute('PRAGMA user_version').fetchone()[0] != _INDEX_FORMAT:
+			self._create()
+
+	def _create(self):
+		db = self._db
+		tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+		for (table,) in tables:
+			db.execute('DROP TABLE %s' % table)
+		db.executescript(_SCHEMA)
+		db.execute('PRAGMA user_version = %d' % _INDEX_FORMAT)
+		db.commit()
+
+	def _get_dirs(self):
+		"""@return: the directories to index, with their kinds and modification times;
+		feeds first, then user overrides, each in order of precedence
+		@rtype: [(str, str, float)]"""
+		dirs = []
+		for path in basedir.load_cache_paths(config_site, 'interfaces'):
+			dirs.append(('feeds', path, os.stat(path).st_mtime))
+		for path in basedir.load_config_paths(config_site, config_prog, 'user_overrides'):
+			dirs.append(('overrides', path, os.stat(path).st_mtime))
+		return dirs
+
+	def refresh(self):
+		"""Bring the index up-to-date, if any of the directories have changed.
+		This is done automatically by the query methods."""
+		dirs = self._get_dirs()
+		indexed = dict(self._db.execute('SELECT path, mtime FROM dirs').fetchall())
+		current = dict([(path, mtime) for kind, path, mtime in dirs])
+		if indexed != current:
+			self._sync(dirs)
+
+	def rebuild(self):
+		"""Throw away the index and create it again by reading every feed.
+		@return: the number of feeds indexed
+		@rtype: int"""
+		self._create()
+		self._sync(self._get_dirs())
+		return self._db.execute('SELECT COUNT(*) FROM feeds').fetchone()[0]
+
+	def _sync(self, dirs):
+		"""Index any new or changed files in dirs and forget about deleted ones.
+		@param dirs: the result of L{_get_dirs} (from before we list them, so
+		that any changes made while we're working will be noticed next time)"""
+		debug(_("Updating feed index %s"), self.path)
+		db = self._db
+		now = time.time()
+
+		found = {'feeds': {}, 'overrides': {}}	# Kind -> URI -> path
+		for kind, path, mtime in dirs:
+			files = found[kind]
+			for leaf in os.listdir(path):
+				if leaf.startswith('.'):
+					continue
+				uri = unescape(leaf)
+				if uri not in files:
+					files[uri] = os.path.join(path, leaf)
+
+		old = {}	# URI -> (feed file, overrides file), as from _get_file
+		for row in db.execute('SELECT uri, path, size, mtime, overrides_path, overrides_size, overrides_mtime FROM feeds'):
+			old[row[0]] = (row[1:4], row[4:7])
+
+		feeds = found['feeds']
+		overrides = found['overrides']
+		for uri in set(feeds) | set(overrides):
+			old_feed, old_overrides = old.pop(uri, (_missing, _missing))
+			feed_file = _get_file(feeds.get(uri, None))
+			if feed_file != old_feed:
+				self._index_feed(uri, feed_file)
+			overrides_file = _get_file(overrides.get(uri, None))
+			if overrides_file != old_overrides:
+				self._index_overrides(uri, overrides_file)
+
+		for uri in old:
+			self._forget(uri)
+
+		# A directory changed within a second of the scan might change again
+		# without its (coarse) mtime changing, so record it as unknown and scan
+		# it again next time
+		trusted = []
+		for kind, path, mtime in dirs:
+			if mtime >= int(now) - 1:
+				mtime = None
+			trusted.append((path, mtime))
+		db.execute('DELETE FROM dirs')
+		db.executemany('INSERT INTO dirs VALUES (?, ?)', trusted)
+		db.commit()
+
+	def _forget(self, uri):
+		db = self._db
+		db.execute('DELETE FROM feeds WHERE uri = ?', (uri,))
+		db.execute('DELETE FROM feed_for WHERE uri = ?', (uri,))
+		db.execute('DELETE FROM implementations WHERE uri = ?', (uri,))
+
+	def _ensure_row(self, uri):
+		self._db.execute('INSERT OR IGNORE INTO feeds (uri, size, overrides_size) VALUES (?, 0, 0)', (uri,))
+
+	def _index_feed(self, uri, feed_file, feed = None):
+		"""Record the cached feed (reading it if feed is None).
+		@param feed_file: the file's details, from L{_get_file}"""
+		db = self._db
+		self._ensure_row(uri)
+		db.execute('DELETE FROM feed_for WHERE uri = ?', (uri,))
+		db.execute('DELETE FROM implementations WHERE uri = ?', (uri,))
+
+		path, size, mtime = feed_file
+		if path is None:
+			db.execute('UPDATE feeds SET path = NULL, size = 0, mtime = NULL, name = NULL, summary = NULL, error = NULL WHERE uri = ?', (uri,))
+			return
+
+		error = None
+		if feed is None:
+			debug(_("Indexing feed %s"), path)
+			try:
+				stream = file(path)
+				try:
+					# (we only want the feed's own implementations, not the distribution's)
+					feed = feedloader.load_feed(stream, None, distro.Distribution())
+				finally:
+					stream.close()
+			except Exception, ex:
+				info(_("Can't index feed %(path)s: %(exception)s"), {'path': path, 'exception': ex})
+				error = str(ex) or repr(ex)
+
+		if feed is None:
+			name = summary = None
+		else:
+			name = feed.name
+			summary = feed.summary
+			db.executemany('INSERT INTO feed_for VALUES (?, ?)', [(uri, target) for target in feed.feed_for])
+			db.executemany('INSERT INTO implementations VALUES (?, ?, ?)',
+				[(uri, impl.id, format_version(impl.version)) for impl in feed.implementations.itervalues()
+				 if not isinstance(impl, model.DistributionImplementation)])
+
+		db.execute('UPDATE feeds SET path = ?, size = ?, mtime = ?, name = ?, summary = ?, error = ? WHERE uri = ?',
+			(path, size, mtime, name, summary, error, uri))
+
+	def _index_overrides(self, uri, overrides_file, last_checked = None):
+		"""Record the user's settings (reading them if last_checked is None).
+		@param overrides_file: the file's details, from L{_get_file}"""
+		db = self._db
+		self._ensure_row(uri)
+
+		path, size, mtime = overrides_file
+		if path is None:
+			db.execute('UPDATE feeds SET overrides_path = NULL, overrides_size = 0, overrides_mtime = NULL, last_checked = NULL WHERE uri = ?', (uri,))
+			return
+
+		if last_checked is None:
+			try:
+				stream = file(path)
+				try:
+					last_checked = qdom.parse(stream).getAttribute('last-checked')
+				finally:
+					stream.close()
+				if last_checked:
+					last_checked = int(last_checked)
+			except Exception, ex:
+				info(_("Can't index %(path)s: %(exception)s"), {'path': path, 'exception': ex})
+		db.execute('UPDATE feeds SET overrides_path = ?, overrides_size = ?, overrides_mtime = ?, last_checked = ? WHERE uri = ?',
+			(path, size, mtime, last_checked or None, uri))
+
+	def update_feed(self, uri, path, feed):
+		"""Record that a new version of a feed has been saved, so that it won't
+		need to be read again.
+		@param uri: the feed's URI
+		@param path: where it was saved
+		@param feed: the new feed
+		@type feed: L{model.ZeroInstallFeed}"""
+		try:
+			self._index_feed(uri, _get_file(path), feed)
+			self._db.commit()
+		except sqlite3.Error, ex:
+			# Not serious; we'll notice the change the next time we refresh
+			warn(_("Failed to update feed index %(path)s: %(exception)s"), {'path': self.path, 'exception': ex})
+
+	def _add_settings(self, info):
+		"""Take info's last_checked time from the settings store, if it has settings there.
+		@type info: L{FeedInfo}"""
+		element = self._overrides.get(info.uri)
+		if element is not None:
+			last_checked = element.getAttribute('last-checked')
+			if last_checked:
+				info.last_checked = int(last_checked)
+			else:
+				info.last_checked = None
+		return info
+
+	def _settings_only(self, uri):
+		"""@return: the details of an interface which only has settings in the settings store
+		@rtype: L{FeedInfo}"""
+		return self._add_settings(FeedInfo((uri, None, 0, None, None, None, None, None, 0, None, None)))
+
+	def list_uris(self):
+		"""@return: the URIs of all feeds which are cached or have user settings
+		@rtype: [str]"""
+		self.refresh()
+		uris = [uri for (uri,) in self._db.execute('SELECT uri FROM feeds')]
+		if self._overrides is not None:
+			indexed = set(uris)
+			uris += [uri for uri in self._overrides.list_uris() if uri not in indexed]
+		return uris
+
+	def get_feed(self, uri):
+		"""@return: what we know about the feed, or None if it isn't cached and has no user settings
+		@rtype: L{FeedInfo}"""
+		self.refresh()
+		row = self._db.execute('SELECT %s FROM feeds WHERE uri = ?' % ', '.join(_FEED_COLUMNS), (uri,)).fetchone()
+		if self._overrides is None:
+			if row is None:
+				return None
+			return FeedInfo(row)
+		if row is None:
+			if self._overrides.get(uri) is None:
+				return None
+			return self._settings_only(uri)
+		return self._add_settings(FeedInfo(row))
+
+	def list_feeds(self):
+		"""@return: everything we know about every feed
+		@rtype: [L{FeedInfo}]"""
+		self.refresh()
+		feeds = [FeedInfo(row) for row in self._db.execute('SELECT %s FROM feeds' % ', '.join(_FEED_COLUMNS))]
+		if self._overrides is not None:
+			indexed = set([info.uri for info in feeds])
+			for info in feeds:
+				self._add_settings(info)
+			feeds += [self._settings_only(uri) for uri in self._overrides.list_uris() if uri not in indexed]
+		return feeds
+
+	def get_implementations(self, uri):
+		"""@return: the implementations in the cached copy of the feed
+		@rtype: [L{ImplementationInfo}]"""
+		self.refresh()
+		return [ImplementationInfo(id, version) for id, version in
+			self._db.execute('SELECT id, version FROM implementations WHERE uri = ?', (uri,))]
+
+	def find_implementation(self, id):
+		"""@return: the URIs of the cached feeds which list an implementation with this ID
+		@rtype: [str]"""
+		self.refresh()
+		return [uri for (uri,) in self._db.execute('SELECT uri FROM implementations WHERE id = ?', (id,))]
+
+	def find_feeds_for(self, target):
+		"""@return: the URIs of the cached feeds which say they are feeds for target
+		@rtype: [str]"""
+		self.refresh()
+		return [uri for (uri,) in self._db.execute('SELECT uri FROM feed_for WHERE target = ?', (target,))]
+
+	def close(self):
+		self._db.close()
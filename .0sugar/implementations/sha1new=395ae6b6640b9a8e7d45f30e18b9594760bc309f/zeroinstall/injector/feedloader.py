@@ -0,0 +1,233 @@
+"""
+Builds a L{model.ZeroInstallFeed} directly from a feed's XML, in a single pass.
+
+L{qdom.parse} builds a tree of the whole document, which L{model.ZeroInstallFeed}
+then walks. Most of that tree is <group> and <implementation> elements, which
+are only needed while the implementations are being created. This loader
+handles them as the parser reports them instead, keeping only the attributes
+each implementation inherits and the few small elements the model needs
+(<requires>, bindings, <archive>, <recipe> and the top-level elements).
+Anything the model would ignore, such as elements in other namespaces inside
+an implementation, is skipped without being stored.
+
+The result is the same as C{ZeroInstallFeed(qdom.parse(source), ...)}, except
+that top-level groups and implementations are not also added to the feed's
+metadata.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+import os
+from xml.parsers import expat
+
+from zeroinstall.injector import qdom
+from zeroinstall.injector.namespaces import XMLNS_IFACE
+from zeroinstall.injector.model import ZeroInstallFeed, binding_names, process_binding, process_depends, _merge_attrs, _extend
+
+_item_names = frozenset(['group', 'implementation', 'package-implementation'])
+
+class _Item(object):
+	"""A <group>, <implementation> or <package-implementation>.
+	@ivar element: the element, with no children except (for implementations)
+	<archive>, <recipe> and bindings
+	@ivar attrs: the element's attributes merged with those it inherits, or
+	(for implementations) just the inherited ones
+	@ivar depends: the element's own <requires> (not its parents')
+	@ivar bindings: the element's own bindings (not its parents'); not used
+	for implementations
+	@ivar parent: the enclosing group, or None at the top level
+	@ivar all_depends: depends and the inherited dependencies, as a tuple shared
+	with any children that don't add their own (see L{get_depends})
+	@ivar all_bindings: likewise for bindings"""
+	__slots__ = ['element', 'attrs', 'depends', 'bindings', 'parent', 'all_depends', 'all_bindings']
+
+	def __init__(self, element, attrs, parent):
+		self.element = element
+		self.attrs = attrs
+		self.depends = []
+		self.bindings = []
+		self.parent = parent
+		self.all_depends = None
+		self.all_bindings = None
+
+	# These are only valid once the whole document has been read, since a
+	# group's <requires> may come after the items inside it.
+
+	def get_depends(self):
+		"""Get our dependencies, including the inherited ones."""
+		if self.all_depends is None:
+			if self.parent is None:
+				self.all_depends = _extend((), self.depends)
+			else:
+				self.all_depends = _extend(self.parent.get_depends(), self.depends)
+		return self.all_depends
+
+	def get_bindings(self):
+		"""Get our bindings, including the inherited ones."""
+		if self.all_bindings is None:
+			if self.parent is None:
+				self.all_bindings = _extend((), self.bindings)
+			else:
+				self.all_bindings = _extend(self.parent.get_bindings(), self.bindings)
+		return self.all_bindings
+
+class _FeedHandler(object):
+	"""Receives the expat events for a feed document."""
+	def __init__(self, local_path, distro):
+		self.local_path = local_path
+		self.distro = distro
+		self.feed = None
+		self.root_attrs = None
+		self.item = None		# The innermost _Item we're inside, or None
+		self.impls = []			# Implementation _Items, in document order
+		self.elements = []		# Stack of qdom.Elements being built
+		self.contents = []		# Text of the innermost element being built
+		self.skip = 0			# Depth inside an ignored element
+		self.cache = {}			# Shares identical dependencies and bindings
+
+	def start_element(self, fullname, attrs):
+		if self.skip:
+			self.skip += 1
+			return
+
+		split = fullname.split(' ', 1)
+		if len(split) == 2:
+			uri, name = split
+		else:
+			uri, name = None, fullname
+
+		if self.elements:
+			self.elements.append(qdom.Element(uri, name, attrs))
+			self.contents = []
+			return
+
+		if self.feed is None:
+			root = qdom.Element(uri, name, attrs)
+			root.content = None
+			self.feed = ZeroInstallFeed.__new__(ZeroInstallFeed)
+			self.root_attrs = self.feed._init_feed(root, self.local_path)
+			return
+
+		item = self.item
+		if item is None:
+			# A child of the root
+			if uri == XMLNS_IFACE and name in _item_names:
+				self._start_item(uri, name, attrs)
+			else:
+				self._start_kept(uri, name, attrs)
+			return
+
+		if uri != XMLNS_IFACE:
+			self.skip = 1
+		elif name == 'requires' or name in binding_names:
+			self._start_kept(uri, name, attrs)
+		else:
+			item_name = item.element.name
+			if item_name == 'group' and name in _item_names:
+				self._start_item(uri, name, attrs)
+			elif item_name == 'implementation' and name in ('archive', 'recipe'):
+				self._start_kept(uri, name, attrs)
+			else:
+				self.skip = 1
+
+	def _start_item(self, uri, name, attrs):
+		element = qdom.Element(uri, name, attrs)
+		element.content = None		# (we don't keep an item's text)
+		parent = self.item
+		if parent is None:
+			inherited = self.root_attrs
+		else:
+			inherited = parent.attrs
+		if name == 'implementation':
+			self.item = _Item(element, inherited, parent)
+		else:
+			self.item = _Item(element, _merge_attrs(inherited, element), parent)
+		if name != 'group':
+			self.impls.append(self.item)
+
+	def _start_kept(self, uri, name, attrs):
+		self.elements.append(qdom.Element(uri, name, attrs))
+		self.contents = []
+
+	def characters(self, data):
+		if self.elements:
+			self.contents.append(data)
+
+	def end_element(self, fullname):
+		if self.skip:
+			self.skip -= 1
+			return
+
+		if self.elements:
+			element = self.elements.pop()
+			element.content = ''.join(self.contents).strip()
+			self.contents = []
+			if self.elements:
+				self.elements[-1].childNodes.append(element)
+			else:
+				self._got_element(element)
+			return
+
+		if self.item is not None:
+			self.item = self.item.parent
+
+	def _got_element(self, element):
+		item = self.item
+		if item is None:
+			self.feed._process_header(element, self.local_path)
+		elif element.name == 'requires':
+			item.depends.append(process_depends(element, self.cache))
+		elif element.name in binding_names and item.element.name != 'implementation':
+			item.bindings.append(process_binding(element, self.cache))
+		else:
+			item.element.childNodes.append(element)
+
+	def finish(self):
+		"""Create the implementations, now that we have all their dependencies.
+		@return: the new feed"""
+		feed = self.feed
+		feed._check_header()
+
+		if self.local_path:
+			local_dir = os.path.dirname(self.local_path)
+		else:
+			local_dir = None
+
+		package_impls = [0, []]		# Best score so far and packages with that score
+		for item in self.impls:
+			if item.element.name == 'implementation':
+				if item.parent is None:
+					base_bindings = ()
+				else:
+					base_bindings = item.parent.get_bindings()
+				feed._process_impl(item.element, item.attrs, item.get_depends(), base_bindings, local_dir)
+			else:
+				feed._add_package_impl(package_impls, self.distro, item.element, item.attrs, item.get_depends())
+
+		for args in package_impls[1]:
+			feed._process_native_impl(self.distro, *args)
+
+		return feed
+
+def load_feed(source, local_path = None, distro = None):
+	"""Read a feed. The arguments and result are as for L{model.ZeroInstallFeed},
+	but the XML is read from source rather than from a L{qdom} tree.
+	@param source: the feed's XML
+	@type source: file
+	@param local_path: the pathname of this local feed, or None for remote feeds
+	@param distro: used to resolve distribution package references
+	@type distro: L{distro.Distribution} or None
+	@raise expat.ExpatError: if source isn't well-formed XML
+	@raise model.InvalidInterface: if it isn't a valid feed
+	@rtype: L{model.ZeroInstallFeed}"""
+	handler = _FeedHandler(local_path, distro)
+	parser = expat.ParserCreate(namespace_separator = ' ')
+	parser.buffer_text = True
+
+	parser.StartElementHandler = handler.start_element
+	parser.EndElementHandler = handler.end_element
+	parser.CharacterDataHandler = handler.characters
+
+	parser.ParseFile(source)
+	return handler.finish()
@@ -28,21 +28,25 @@ creating new cache objects.
 #
 # Eventually, support for the first and third cases will be removed.
 
-import os, sys, time
+import os, sys, time, itertools, weakref
 from logging import debug, info, warn
-from cStringIO import StringIO
 
 from zeroinstall import _
 from zeroinstall.support import basedir
-from zeroinstall.injector import reader, model
+from zeroinstall.injector import reader, model, qdom
 from zeroinstall.injector.namespaces import config_site, config_prog
 from zeroinstall.injector.model import Interface, escape, unescape
 from zeroinstall import zerostore, SafeException
+from zeroinstall.zerostore.manifest import sha1_new
 
 def _pretty_time(t):
 	assert isinstance(t, (int, long)), t
 	return time.strftime('%Y-%m-%d %H:%M:%S UTC', time.localtime(t))
 
+# Generation numbers are unique across all IfaceCache objects, so information
+# from a cache which has since been reset can never look up-to-date.
+_generations = itertools.count(1)
+
 class ReplayAttack(SafeException):
 	"""Attempt to import a feed that's older than the one in the cache."""
 	pass
@@ -161,6 +165,27 @@ class PendingFeed(object):
 			info(_("Failed to check GPG signature. Data received was:\n") + repr(self.signed_data.read()))
 			raise
 
+class IfaceCacheStats(object):
+	"""Counts how well the in-memory part of an L{IfaceCache} is working.
+	@ivar hits: the number of L{IfaceCache.get_interface} calls answered from memory
+	@type hits: int
+	@ivar misses: the number of calls which had to read the interface from disk
+	@type misses: int
+	@ivar evictions: the number of interfaces dropped to keep within L{IfaceCache.max_interfaces}
+	@type evictions: int
+	"""
+	__slots__ = ['hits', 'misses', 'evictions']
+
+	def __init__(self):
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def as_dict(self):
+		"""@return: all the counters, as plain Python values
+		@rtype: dict"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__])
+
 class IfaceCache(object):
 	"""
 	The interface cache stores downloaded and verified interfaces in
@@ -175,12 +200,36 @@ class IfaceCache(object):
 	It will probably be split into two in future.
 
 	@see: L{iface_cache} - the singleton IfaceCache instance.
+
+	The in-memory cache holds at most L{max_interfaces} interfaces. When it is
+	full, the least recently used ones are dropped (and will be read from disk
+	again if they are needed later), except for those in use by a live
+	L{policy.Policy} (see L{add_policy}).
+
+	@ivar generation: increases whenever any cached information changes (see L{get_generation})
+	@type generation: int
+	@ivar max_interfaces: the number of interfaces to keep in memory, or None for no limit
+	@type max_interfaces: int | None
+	@ivar stats: hit, miss and eviction counts for the in-memory cache
+	@type stats: L{IfaceCacheStats}
 	"""
 
-	__slots__ = ['_interfaces', 'stores']
+	__slots__ = ['_interfaces', 'stores', 'generation', '_generations',
+		     'max_interfaces', 'stats', '_last_used', '_clock', '_policies',
+		     '_feed_index', '_overrides']
 
 	def __init__(self):
 		self._interfaces = {}
+		self._generations = {}		# URI -> generation when last changed
+		self.generation = _generations.next()
+
+		self.max_interfaces = 1000
+		self.stats = IfaceCacheStats()
+		self._last_used = {}		# URI -> value of _clock when last got
+		self._clock = 0
+		self._policies = weakref.WeakKeyDictionary()	# Policy -> None
+		self._feed_index = None		# (False if it can't be opened)
+		self._overrides = None
 
 		self.stores = zerostore.Stores()
 	
@@ -226,12 +275,10 @@ class IfaceCache(object):
 			# signatures Otherwise, we can get the time from the
 			# signature, and adding this attribute just makes the
 			# signature invalid.
-			from xml.dom import minidom
-			doc = minidom.parseString(new_xml)
-			doc.documentElement.setAttribute('last-modified', str(modified_time))
-			new_xml = StringIO()
-			doc.writexml(new_xml)
-			new_xml = new_xml.getvalue()
+			try:
+				new_xml = qdom.set_root_attribute(new_xml, 'last-modified', str(modified_time))
+			except ValueError, ex:
+				raise model.InvalidInterface(_("Invalid XML"), ex)
 
 		self._import_new_interface(interface, new_xml, modified_time)
 
@@ -244,6 +291,8 @@ class IfaceCache(object):
 
 	def _import_new_interface(self, interface, new_xml, modified_time):
 		"""Write new_xml into the cache.
+		The XML is parsed only once; the resulting feed is checked, saved as the
+		cache's snapshot and then used to update interface directly.
 		@param interface: updated once the new XML is written
 		@param new_xml: the data to write
 		@param modified_time: when new_xml was modified
@@ -253,33 +302,28 @@ class IfaceCache(object):
 
 		upstream_dir = basedir.save_cache_path(config_site, 'interfaces')
 		cached = os.path.join(upstream_dir, escape(interface.uri))
+		new_digest = sha1_new(new_xml).hexdigest()
 
 		if os.path.exists(cached):
-			old_xml = file(cached).read()
-			if old_xml == new_xml:
+			if reader.get_cached_digest(interface.uri, cached) == new_digest:
 				debug(_("No change"))
 				reader.update_from_cache(interface)
+				self.mark_changed(interface.uri)
 				return
 
-		stream = file(cached + '.new', 'w')
-		stream.write(new_xml)
-		stream.close()
-		os.utime(cached + '.new', (modified_time, modified_time))
-		new_mtime = reader.check_readable(interface.uri, cached + '.new')
-		assert new_mtime == modified_time
+		new_feed = reader.parse_feed_data(interface.uri, new_xml, modified_time)
 
 		old_modified = self._get_signature_date(interface.uri)
 		if old_modified is None:
 			old_modified = interface.last_modified
 
 		if old_modified:
-			if new_mtime < old_modified:
-				os.unlink(cached + '.new')
+			if modified_time < old_modified:
 				raise ReplayAttack(_("New interface's modification time is "
 					"before old version!\nOld time: %(old_time)s\nNew time: %(new_time)s\n"
 					"Refusing update.")
-					% {'old_time': _pretty_time(old_modified), 'new_time': _pretty_time(new_mtime)})
-			if new_mtime == old_modified:
+					% {'old_time': _pretty_time(old_modified), 'new_time': _pretty_time(modified_time)})
+			if modified_time == old_modified:
 				# You used to have to update the modification time manually.
 				# Now it comes from the signature, this check isn't useful
 				# and often causes problems when the stored format changes
@@ -287,10 +331,20 @@ class IfaceCache(object):
 				pass
 				#raise SafeException("Interface has changed, but modification time "
 				#		    "hasn't! Refusing update.")
+
+		stream = file(cached + '.new', 'w')
+		stream.write(new_xml)
+		stream.close()
+		os.utime(cached + '.new', (modified_time, modified_time))
 		os.rename(cached + '.new', cached)
 		debug(_("Saved as %s") % cached)
 
-		reader.update_from_cache(interface)
+		reader.save_snapshot(interface, cached, new_feed, new_digest)
+		index = self.get_feed_index()
+		if index:
+			index.update_feed(interface.uri, cached, new_feed)
+		reader.update_from_feed(interface, new_feed)
+		self.mark_changed(interface.uri)
 
 	def get_feed(self, url):
 		"""Get a feed from the cache.
@@ -315,27 +369,152 @@ class IfaceCache(object):
 			uri = unicode(uri)
 		assert isinstance(uri, unicode)
 
-		if uri in self._interfaces:
-			return self._interfaces[uri]
+		self._clock += 1
+		self._last_used[uri] = self._clock
+
+		iface = self._interfaces.get(uri, None)
+		if iface is not None:
+			self.stats.hits += 1
+			return iface
 
+		self.stats.misses += 1
 		debug(_("Initialising new interface object for %s"), uri)
-		self._interfaces[uri] = Interface(uri)
-		reader.update_from_cache(self._interfaces[uri])
-		return self._interfaces[uri]
+		iface = Interface(uri)
+		self._interfaces[uri] = iface
+		reader.update_from_cache(iface)
+		self.mark_changed(uri)
+
+		if self.max_interfaces is not None and len(self._interfaces) > self.max_interfaces:
+			self._evict(uri)
+		return iface
+
+	def _evict(self, keep):
+		"""Drop the least recently used interfaces until we're well under
+		L{max_interfaces} (so that we don't have to do this again on the next miss).
+		Interfaces used by live policies, and keep, are never dropped."""
+		pinned = self.get_pinned()
+		pinned.add(keep)
+		target = self.max_interfaces * 3 // 4
+		excess = len(self._interfaces) - target
+		if excess <= 0:
+			return
+
+		last_used = self._last_used
+		unpinned = [(last_used.get(uri, 0), uri) for uri in self._interfaces if uri not in pinned]
+		unpinned.sort()
+		for used, uri in unpinned[:excess]:
+			del self._interfaces[uri]
+			del last_used[uri]
+			self.stats.evictions += 1
+		debug(_("Dropped %d interfaces from the in-memory cache"), min(excess, len(unpinned)))
+
+	def add_policy(self, policy):
+		"""Stop the interfaces used by policy from being dropped from memory
+		while policy is alive. Called by L{policy.Policy} itself.
+		@see: L{get_pinned}"""
+		self._policies[policy] = None
+
+	def get_pinned(self):
+		"""Get the URIs which must stay in memory: the root of each live policy,
+		the interfaces chosen by its last solve and the feeds used to choose them.
+		@rtype: set(str)"""
+		pinned = set()
+		for policy in self._policies.keys():
+			pinned.add(policy.root)
+			solver = policy.solver
+			if solver.selections:
+				for iface in solver.selections:
+					pinned.add(iface.uri)
+			if solver.feeds_used:
+				pinned.update(solver.feeds_used)
+		return pinned
+
+	def invalidate(self, uri):
+		"""Forget the in-memory copy of an interface, so that the next
+		L{get_interface} reads it from disk again. Does nothing if it isn't loaded.
+		@param uri: the URI of the interface or feed"""
+		if type(uri) == str:
+			uri = unicode(uri)
+		if self._interfaces.pop(uri, None) is not None:
+			del self._last_used[uri]
+			self.mark_changed(uri)
+
+	def invalidate_all(self):
+		"""Forget all in-memory interfaces (see L{invalidate})."""
+		self.generation = _generations.next()
+		for uri in self._interfaces:
+			self._generations[uri] = self.generation
+		self._interfaces.clear()
+		self._last_used.clear()
+
+	def mark_changed(self, uri):
+		"""Record that the information about an interface or feed has changed.
+		This is done automatically when the cache loads or imports a feed, and by
+		L{writer.save_interface}. If you reload an interface yourself (e.g. with
+		L{reader.update_from_cache}), call this so that solvers notice.
+		@param uri: the URI of the interface or feed"""
+		self.generation = _generations.next()
+		self._generations[uri] = self.generation
+
+	def get_generation(self, uri):
+		"""Get the value of L{generation} when the information about uri last changed.
+		If it is the same as last time you looked, the interface (and any feed with
+		this URI) is unchanged.
+		@param uri: the URI of the interface or feed
+		@return: the generation, or 0 if uri hasn't been loaded
+		@rtype: int"""
+		return self._generations.get(uri, 0)
+
+	def get_feed_index(self):
+		"""Get the index of the cached feeds, opening it on first use.
+		@return: the index, or None if it can't be used (e.g. if Python has no sqlite3 module)
+		@rtype: L{feedindex.FeedIndex}"""
+		if self._feed_index is None:
+			from zeroinstall.injector import feedindex
+			self._feed_index = False
+			if feedindex.sqlite3 is None:
+				info(_("No sqlite3 module; the feed index is not available"))
+			else:
+				try:
+					self._feed_index = feedindex.FeedIndex(overrides = self.get_user_overrides())
+				except feedindex.sqlite3.Error, ex:
+					warn(_("Can't open the feed index: %s"), ex)
+		return self._feed_index or None
+
+	def get_user_overrides(self):
+		"""Get the user's settings for all interfaces, loading them on first use.
+		@rtype: L{overrides.OverridesStore}"""
+		if self._overrides is None:
+			from zeroinstall.injector import overrides
+			self._overrides = overrides.OverridesStore()
+		return self._overrides
+
+	def flush_user_overrides(self):
+		"""Save any changes to the user's settings now, rather than waiting
+		until the process is idle or exits. Call this before replacing or
+		forking the process."""
+		if self._overrides is not None:
+			self._overrides.flush()
 
 	def list_all_interfaces(self):
 		"""List all interfaces in the cache.
 		@rtype: [str]
 		"""
-		all = set()
+		all = set(self.get_user_overrides().list_uris())
+
+		index = self.get_feed_index()
+		if index:
+			from zeroinstall.injector import feedindex
+			try:
+				all.update(index.list_uris())
+				return list(all)
+			except feedindex.sqlite3.Error, ex:
+				warn(_("Can't read the feed index: %s"), ex)
+
 		for d in basedir.load_cache_paths(config_site, 'interfaces'):
 			for leaf in os.listdir(d):
 				if not leaf.startswith('.'):
 					all.add(unescape(leaf))
-		for d in basedir.load_config_paths(config_site, config_prog, 'user_overrides'):
-			for leaf in os.listdir(d):
-				if not leaf.startswith('.'):
-					all.add(unescape(leaf))
 		return list(all)	# Why not just return the set?
 
 	def get_icon_path(self, iface):
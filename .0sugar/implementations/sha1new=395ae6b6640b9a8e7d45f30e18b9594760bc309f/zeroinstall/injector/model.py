@@ -15,6 +15,7 @@ well-known variables.
 
 from zeroinstall import _
 import os, re
+from bisect import bisect_left, bisect_right
 from logging import info, debug
 from zeroinstall import SafeException, version
 from zeroinstall.injector.namespaces import XMLNS_IFACE
@@ -79,8 +80,17 @@ class Stability(object):
 	def __repr__(self):
 		return _("<Stability: %s>") % self.description
 
-def process_binding(e):
-	"""Internal"""
+	def __reduce__(self):
+		# There is only one of each level; pickles must refer to it, not copy it
+		return (_get_stability, (self.name,))
+
+def _get_stability(name):
+	return stability_levels[name]
+
+def process_binding(e, cache = None):
+	"""Internal
+	@param cache: if not None, a dict used to share bindings; if an identical binding
+	has already been created with this cache, that one is returned instead of a new one"""
 	if e.name == 'environment':
 		mode = {
 			None: EnvironmentBinding.PREPEND,
@@ -95,14 +105,21 @@ def process_binding(e):
 					     mode = mode)
 		if not binding.name: raise InvalidInterface(_("Missing 'name' in binding"))
 		if binding.insert is None: raise InvalidInterface(_("Missing 'insert' in binding"))
-		return binding
+		key = ('environment', binding.name, binding.insert, binding.default, binding.mode)
 	elif e.name == 'overlay':
-		return OverlayBinding(e.getAttribute('src'), e.getAttribute('mount-point'))
+		binding = OverlayBinding(e.getAttribute('src'), e.getAttribute('mount-point'))
+		key = ('overlay', binding.src, binding.mount_point)
 	else:
 		raise Exception(_("Unknown binding type '%s'") % e.name)
+	if cache is None:
+		return binding
+	return cache.setdefault(key, binding)
 
-def process_depends(item):
-	"""Internal"""
+def process_depends(item, cache = None):
+	"""Internal
+	@param cache: if not None, a dict used to share dependencies, bindings and restrictions;
+	if an identical dependency has already been created with this cache, that one is
+	returned instead of a new one. Shared objects must not be modified."""
 	# Note: also called from selections
 	dep_iface = item.getAttribute('interface')
 	if not dep_iface:
@@ -112,12 +129,28 @@ def process_depends(item):
 	for e in item.childNodes:
 		if e.uri != XMLNS_IFACE: continue
 		if e.name in binding_names:
-			dependency.bindings.append(process_binding(e))
+			dependency.bindings.append(process_binding(e, cache))
 		elif e.name == 'version':
-			dependency.restrictions.append(
-				VersionRangeRestriction(not_before = parse_version(e.getAttribute('not-before')),
-						        before = parse_version(e.getAttribute('before'))))
-	return dependency
+			not_before = e.getAttribute('not-before')
+			before = e.getAttribute('before')
+			if cache is None:
+				restriction = None
+			else:
+				key = ('version', not_before, before)
+				restriction = cache.get(key, None)
+			if restriction is None:
+				restriction = VersionRangeRestriction(not_before = parse_version(not_before),
+								      before = parse_version(before))
+				if cache is not None:
+					cache[key] = restriction
+			dependency.restrictions.append(restriction)
+
+	if cache is None:
+		return dependency
+	# The children have already been shared, so we can compare them by identity
+	key = ('requires', dep_iface, tuple(sorted(item.attrs.items())),
+		tuple(map(id, dependency.restrictions)), tuple(map(id, dependency.bindings)))
+	return cache.setdefault(key, dependency)
 
 def N_(message): return message
 
@@ -145,6 +178,7 @@ class Restriction(object):
 class VersionRestriction(Restriction):
 	"""Only select implementations with a particular version number.
 	@since: 0.40"""
+	__slots__ = ['version']
 
 	def __init__(self, version):
 		"""@param version: the required version number
@@ -189,6 +223,52 @@ class VersionRangeRestriction(Restriction):
 			range = 'none'
 		return _("(restriction: %s)") % range
 
+class VersionIndex(object):
+	"""A list of implementations, indexed by version so that the ones meeting
+	version restrictions can be found without checking each one.
+	@ivar impls: the implementations, in their original order
+	@type impls: [L{Implementation}]"""
+	__slots__ = ['impls', '_versions', '_positions']
+
+	def __init__(self, impls):
+		self.impls = impls
+		order = [(impl.version, i) for i, impl in enumerate(impls)]
+		order.sort()
+		self._versions = [version for version, i in order]
+		self._positions = [i for version, i in order]
+
+	def select(self, restrictions):
+		"""Get the implementations which meet all of the restrictions.
+		Version restrictions are answered from the index using bisection; any others
+		are checked against each implementation within the version range.
+		@type restrictions: [L{Restriction}]
+		@return: the matching implementations, in their original order
+		@rtype: [L{Implementation}]"""
+		versions = self._versions
+		lo = 0
+		hi = len(versions)
+		others = []
+		for r in restrictions:
+			if type(r) is VersionRangeRestriction:
+				if r.not_before:
+					lo = max(lo, bisect_left(versions, r.not_before))
+				if r.before:
+					hi = min(hi, bisect_left(versions, r.before))
+			elif type(r) is VersionRestriction:
+				lo = max(lo, bisect_left(versions, r.version))
+				hi = min(hi, bisect_right(versions, r.version))
+			else:
+				others.append(r)
+		if lo >= hi:
+			return []
+
+		positions = self._positions[lo:hi]
+		positions.sort()
+		impls = [self.impls[i] for i in positions]
+		for r in others:
+			impls = [impl for impl in impls if r.meets_restriction(impl)]
+		return impls
+
 class Binding(object):
 	"""Information about how the choice of a Dependency is made known
 	to the application being run."""
@@ -383,35 +463,62 @@ class Implementation(object):
 	@type upstream_stability: [insecure | buggy | developer | testing | stable | packaged | preferred]
 	@ivar langs: natural languages supported by this package
 	@ivar requires: interfaces this package depends on
+	@type requires: [L{Dependency}]
 	@ivar main: the default file to execute when running as a program
 	@ivar metadata: extra metadata from the feed
 	@type metadata: {"[URI ]localName": str}
 	@ivar id: a unique identifier for this Implementation
 	@ivar version: a parsed version number
 	@ivar released: release date
+	@note: for implementations read from a feed, metadata, bindings and
+	download_sources are only created when first used (see L{ZeroInstallFeed}).
+	Their requires and bindings are tuples, shared with other implementations
+	in the same group; the L{Dependency} and L{Binding} objects in them may be
+	shared too, so none of these may be modified. Assign a new sequence instead.
 	"""
 
 	# Note: user_stability shouldn't really be here
 
 	__slots__ = ['upstream_stability', 'user_stability', 'langs',
-		     'requires', 'main', 'metadata', 'download_sources',
-		     'id', 'feed', 'version', 'released', 'bindings', 'machine']
+		     'requires', 'main', '_metadata', '_download_sources',
+		     'id', 'feed', 'version', 'released', '_bindings', 'machine',
+		     '_record']
 
 	def __init__(self, feed, id):
 		assert id
+		self._record = None	# Used by ZeroInstallFeed to create the lazy attributes
 		self.feed = feed
 		self.id = id
 		self.main = None
 		self.user_stability = None
 		self.upstream_stability = None
-		self.metadata = {}	# [URI + " "] + localName -> value
 		self.requires = []
 		self.version = None
 		self.released = None
-		self.download_sources = []
 		self.langs = None
 		self.machine = None
-		self.bindings = []
+
+	def _lazy(name, default):
+		# Most implementations in a large feed are never used, so the
+		# values (or empty defaults) are only created when first accessed
+		def get(self):
+			if self._record is not None:
+				self.feed._load_impl_details(self)
+			try:
+				return getattr(self, name)
+			except AttributeError:
+				value = default()
+				setattr(self, name, value)
+				return value
+		def set(self, value):
+			if self._record is not None:
+				self.feed._load_impl_details(self)
+			setattr(self, name, value)
+		return property(get, set)
+	metadata = _lazy('_metadata', dict)		# [URI + " "] + localName -> value
+	download_sources = _lazy('_download_sources', list)
+	bindings = _lazy('_bindings', list)
+	del _lazy
 
 	def get_stability(self):
 		return self.user_stability or self.upstream_stability or testing
@@ -557,15 +664,61 @@ def _merge_attrs(attrs, item):
 		new[str(a)] = item.attrs[a]
 	return new
 
+def _extend(base, extra):
+	"""Add the items in the list extra to the tuple base.
+	@return: base itself if extra is empty, so it can be shared
+	@rtype: tuple"""
+	if extra:
+		return base + tuple(extra)
+	return base
+
+def _get_inherited(item, attrs, name):
+	"""Get an attribute of item, or the value it inherits from attrs if it doesn't have one.
+	This is the same as C{_merge_attrs(attrs, item).get(name)}, without the copy."""
+	value = item.attrs.get(name, None)
+	if value is None:
+		return attrs.get(name, None)
+	return value
+
 def _get_long(elem, attr_name):
 	val = elem.getAttribute(attr_name)
 	if val is not None:
 		try:
 			val = long(val)
 		except ValueError, ex:
-			raise SafeException(_("Invalid value for integer attribute '%(attribute_name)s': %(value)s") % {'attribute_name': attr_name, 'value': val})
+			raise InvalidInterface(_("Invalid value for integer attribute '%(attribute_name)s': %(value)s") % {'attribute_name': attr_name, 'value': val})
 	return val
 
+_binding_modes = frozenset([None, 'prepend', 'append', 'replace'])
+
+def _check_impl_details(children):
+	"""Check the child elements of an <implementation> which
+	L{ZeroInstallFeed._load_impl_details} will use, so that a broken feed is
+	rejected when it is read rather than when the details are first used."""
+	for elem in children:
+		if elem.uri != XMLNS_IFACE: continue
+		if elem.name == 'environment':
+			if not elem.getAttribute('name'): raise InvalidInterface(_("Missing 'name' in binding"))
+			if elem.getAttribute('insert') is None: raise InvalidInterface(_("Missing 'insert' in binding"))
+			if elem.getAttribute('mode') not in _binding_modes:
+				raise InvalidInterface(_("Unknown binding mode '%s'") % elem.getAttribute('mode'))
+		elif elem.name == 'archive':
+			_check_archive(elem)
+		elif elem.name == 'recipe':
+			for recipe_step in elem.childNodes:
+				if recipe_step.uri == XMLNS_IFACE and recipe_step.name == 'archive':
+					_check_archive(recipe_step)
+				else:
+					break		# (the recipe will be skipped)
+
+def _check_archive(elem):
+	if not elem.getAttribute('href'):
+		raise InvalidInterface(_("Missing href attribute on <archive>"))
+	if not elem.getAttribute('size'):
+		raise InvalidInterface(_("Missing size attribute on <archive>"))
+	_get_long(elem, 'size')
+	_get_long(elem, 'start-offset')
+
 class ZeroInstallFeed(object):
 	"""A feed lists available implementations of an interface.
 	@ivar url: the URL for this feed
@@ -593,8 +746,71 @@ class ZeroInstallFeed(object):
 		@type feed_element: L{qdom.Element}
 		@param local_path: the pathname of this local feed, or None for remote feeds
 		@param distro: used to resolve distribution package references
-		@type distro: L{distro.Distribution} or None"""
+		@type distro: L{distro.Distribution} or None
+		@see: L{feedloader.load_feed}, which builds a feed directly from the XML"""
 		assert feed_element
+		root_attrs = self._init_feed(feed_element, local_path)
+
+		for x in feed_element.childNodes:
+			self._process_header(x, local_path)
+
+		self._check_header()
+
+		if local_path:
+			local_dir = os.path.dirname(local_path)
+		else:
+			local_dir = None	# Can't have relative paths
+
+		package_impls = [0, []]		# Best score so far and packages with that score
+		cache = {}	# Shares identical dependencies and bindings between groups
+
+		# base_depends and base_bindings are tuples, so that items which don't add
+		# anything can share their group's
+		def process_group(group, group_attrs, base_depends, base_bindings):
+			for item in group.childNodes:
+				if item.uri != XMLNS_IFACE: continue
+
+				if item.name not in ('group', 'implementation', 'package-implementation'):
+					continue
+
+				depends = []
+
+				# We've found a group or implementation. Scan for dependencies
+				# and bindings. Doing this here means that:
+				# - We can share the code for groups and implementations here.
+				# - The order doesn't matter, because these get processed first.
+				# A side-effect is that the document root cannot contain
+				# these.
+				for child in item.childNodes:
+					if child.uri != XMLNS_IFACE: continue
+					if child.name == 'requires':
+						dep = process_depends(child, cache)
+						depends.append(dep)
+				depends = _extend(base_depends, depends)
+
+				if item.name == 'group':
+					bindings = []
+					for child in item.childNodes:
+						if child.uri == XMLNS_IFACE and child.name in binding_names:
+							bindings.append(process_binding(child, cache))
+					process_group(item, _merge_attrs(group_attrs, item), depends, _extend(base_bindings, bindings))
+				elif item.name == 'implementation':
+					# (an implementation's own bindings are read by _load_impl_details)
+					self._process_impl(item, group_attrs, depends, base_bindings, local_dir)
+				elif item.name == 'package-implementation':
+					self._add_package_impl(package_impls, distro, item, _merge_attrs(group_attrs, item), depends)
+				else:
+					assert 0
+
+		process_group(feed_element, root_attrs, (), ())
+
+		for args in package_impls[1]:
+			self._process_native_impl(distro, *args)
+
+	def _init_feed(self, feed_element, local_path):
+		"""Set up an empty feed from the attributes of the root element.
+		@return: the attributes inherited by top-level groups and implementations
+		@rtype: {str: str}"""
 		self.implementations = {}
 		self.name = None
 		self.summary = None
@@ -614,12 +830,10 @@ class ZeroInstallFeed(object):
 
 		if local_path:
 			self.url = local_path
-			local_dir = os.path.dirname(local_path)
 		else:
 			self.url = feed_element.getAttribute('uri')
 			if not self.url:
 				raise InvalidInterface(_("<interface> uri attribute missing"))
-			local_dir = None	# Can't have relative paths
 
 		min_injector_version = feed_element.getAttribute('min-injector-version')
 		if min_injector_version:
@@ -629,192 +843,170 @@ class ZeroInstallFeed(object):
 							"You can get a newer version from http://0install.net") %
 							{'min_version': min_injector_version, 'version': version})
 
-		for x in feed_element.childNodes:
-			if x.uri != XMLNS_IFACE:
-				self.metadata.append(x)
-				continue
-			if x.name == 'name':
-				self.name = x.content
-			elif x.name == 'description':
-				self.description = x.content
-			elif x.name == 'summary':
-				self.summary = x.content
-			elif x.name == 'feed-for':
-				feed_iface = x.getAttribute('interface')
-				if not feed_iface:
-					raise InvalidInterface(_('Missing "interface" attribute in <feed-for>'))
-				self.feed_for.add(feed_iface)
-				# Bug report from a Debian/stable user that --feed gets the wrong value.
-				# Can't reproduce (even in a Debian/stable chroot), but add some logging here
-				# in case it happens again.
-				debug(_("Is feed-for %s"), feed_iface)
-			elif x.name == 'feed':
-				feed_src = x.getAttribute('src')
-				if not feed_src:
-					raise InvalidInterface(_('Missing "src" attribute in <feed>'))
-				if feed_src.startswith('http:') or local_path:
-					self.feeds.append(Feed(feed_src, x.getAttribute('arch'), False, langs = x.getAttribute('langs')))
-				else:
-					raise InvalidInterface(_("Invalid feed URL '%s'") % feed_src)
+		root_attrs = {'stability': 'testing'}
+		if main:
+			root_attrs['main'] = main
+		return root_attrs
+
+	def _process_header(self, x, local_path):
+		"""Process a child of the root element."""
+		if x.uri != XMLNS_IFACE:
+			self.metadata.append(x)
+			return
+		if x.name == 'name':
+			self.name = x.content
+		elif x.name == 'description':
+			self.description = x.content
+		elif x.name == 'summary':
+			self.summary = x.content
+		elif x.name == 'feed-for':
+			feed_iface = x.getAttribute('interface')
+			if not feed_iface:
+				raise InvalidInterface(_('Missing "interface" attribute in <feed-for>'))
+			self.feed_for.add(feed_iface)
+			# Bug report from a Debian/stable user that --feed gets the wrong value.
+			# Can't reproduce (even in a Debian/stable chroot), but add some logging here
+			# in case it happens again.
+			debug(_("Is feed-for %s"), feed_iface)
+		elif x.name == 'feed':
+			feed_src = x.getAttribute('src')
+			if not feed_src:
+				raise InvalidInterface(_('Missing "src" attribute in <feed>'))
+			if feed_src.startswith('http:') or local_path:
+				self.feeds.append(Feed(feed_src, x.getAttribute('arch'), False, langs = x.getAttribute('langs')))
 			else:
-				self.metadata.append(x)
+				raise InvalidInterface(_("Invalid feed URL '%s'") % feed_src)
+		else:
+			self.metadata.append(x)
 
+	def _check_header(self):
 		if not self.name:
 			raise InvalidInterface(_("Missing <name> in feed"))
 		if not self.summary:
 			raise InvalidInterface(_("Missing <summary> in feed"))
 
-		package_impls = [0, []]		# Best score so far and packages with that score
-
-		def process_group(group, group_attrs, base_depends, base_bindings):
-			for item in group.childNodes:
-				if item.uri != XMLNS_IFACE: continue
-
-				if item.name not in ('group', 'implementation', 'package-implementation'):
-					continue
-
-				depends = base_depends[:]
-				bindings = base_bindings[:]
+	def _process_impl(self, item, group_attrs, depends, base_bindings, local_dir):
+		"""Create the implementation for an <implementation> element.
+		Only the attributes the solver needs are set here. The rest are checked,
+		but only created by L{_load_impl_details} if they're used.
+		@param group_attrs: the attributes item inherits from its groups
+		@param base_bindings: the bindings item inherits from its groups"""
+		id = item.getAttribute('id')
+		if id is None:
+			raise InvalidInterface(_("Missing 'id' attribute on %s") % item)
+		if local_dir and (id.startswith('/') or id.startswith('.')):
+			impl = self._get_impl(os.path.abspath(os.path.join(local_dir, id)))
+		else:
+			if '=' not in id:
+				raise InvalidInterface(_('Invalid "id"; form is "alg=value" (got "%s")') % id)
+			alg, sha1 = id.split('=')
+			try:
+				long(sha1, 16)
+			except Exception, ex:
+				raise InvalidInterface(_('Bad SHA1 attribute: %s') % ex)
+			impl = self._get_impl(id)
+
+		version = _get_inherited(item, group_attrs, 'version')
+		if version is None:
+			raise InvalidInterface(_("Missing version attribute"))
+		version_mod = _get_inherited(item, group_attrs, 'version-modifier')
+		if version_mod:
+			version += version_mod
+		impl.version = parse_version(version)
+
+		item_main = _get_inherited(item, group_attrs, 'main')
+		if item_main and item_main.startswith('/'):
+			raise InvalidInterface(_("'main' attribute must be relative, but '%s' starts with '/'!") %
+						item_main)
+		impl.main = item_main
 
-				item_attrs = _merge_attrs(group_attrs, item)
+		impl.released = _get_inherited(item, group_attrs, 'released')
+		impl.langs = _get_inherited(item, group_attrs, 'langs')
 
-				# We've found a group or implementation. Scan for dependencies
-				# and bindings. Doing this here means that:
-				# - We can share the code for groups and implementations here.
-				# - The order doesn't matter, because these get processed first.
-				# A side-effect is that the document root cannot contain
-				# these.
-				for child in item.childNodes:
-					if child.uri != XMLNS_IFACE: continue
-					if child.name == 'requires':
-						dep = process_depends(child)
-						depends.append(dep)
-					elif child.name in binding_names:
-						bindings.append(process_binding(child))
-
-				if item.name == 'group':
-					process_group(item, item_attrs, depends, bindings)
-				elif item.name == 'implementation':
-					process_impl(item, item_attrs, depends, bindings)
-				elif item.name == 'package-implementation':
-					distro_names = item_attrs.get('distributions', '')
-					for distro_name in distro_names.split(' '):
-						score = distro.get_score(distro_name)
-						if score > package_impls[0]:
-							package_impls[0] = score
-							package_impls[1] = []
-						if score == package_impls[0]:
-							package_impls[1].append((item, item_attrs, depends))
+		size = item.getAttribute('size')
+		if size:
+			impl.size = long(size)
+		impl.arch = _get_inherited(item, group_attrs, 'arch')
+		stab = str(_get_inherited(item, group_attrs, 'stability'))
+		try:
+			stability = stability_levels[stab]
+		except KeyError:
+			if stab != stab.lower():
+				raise InvalidInterface(_('Stability "%s" invalid - use lower case!') % stab)
+			raise InvalidInterface(_('Stability "%s" invalid') % stab)
+		if stability >= preferred:
+			raise InvalidInterface(_("Upstream can't set stability to preferred!"))
+		impl.upstream_stability = stability
+
+		impl.requires = depends
+		_check_impl_details(item.childNodes)
+		impl._record = (item.attrs, item.childNodes, group_attrs, base_bindings)
+
+	def _load_impl_details(self, impl):
+		"""Create the metadata, bindings and download sources of an implementation
+		created (and checked) by L{_process_impl}."""
+		attrs, children, group_attrs, base_bindings = impl._record
+
+		metadata = group_attrs.copy()
+		for a in attrs:
+			metadata[str(a)] = attrs[a]
+		version_mod = metadata.get('version-modifier', None)
+		if version_mod:
+			metadata['version'] += version_mod
+			del metadata['version-modifier']
+
+		bindings = []
+		download_sources = []
+		for elem in children:
+			if elem.uri != XMLNS_IFACE: continue
+			if elem.name in binding_names:
+				bindings.append(process_binding(elem))
+			elif elem.name == 'archive':
+				download_sources.append(DownloadSource(impl, url = elem.getAttribute('href'), size = _get_long(elem, 'size'),
+						extract = elem.getAttribute('extract'),
+						start_offset = _get_long(elem, 'start-offset'),
+						type = elem.getAttribute('type')))
+			elif elem.name == 'recipe':
+				recipe = Recipe()
+				for recipe_step in elem.childNodes:
+					if recipe_step.uri == XMLNS_IFACE and recipe_step.name == 'archive':
+						recipe.steps.append(DownloadSource(None, url = recipe_step.getAttribute('href'), size = _get_long(recipe_step, 'size'),
+								extract = recipe_step.getAttribute('extract'),
+								start_offset = _get_long(recipe_step, 'start-offset'),
+								type = recipe_step.getAttribute('type')))
+					else:
+						info(_("Unknown step '%s' in recipe; skipping recipe"), recipe_step.name)
+						break
 				else:
-					assert 0
-
-		def process_impl(item, item_attrs, depends, bindings):
-			id = item.getAttribute('id')
-			if id is None:
-				raise InvalidInterface(_("Missing 'id' attribute on %s") % item)
-			if local_dir and (id.startswith('/') or id.startswith('.')):
-				impl = self._get_impl(os.path.abspath(os.path.join(local_dir, id)))
-			else:
-				if '=' not in id:
-					raise InvalidInterface(_('Invalid "id"; form is "alg=value" (got "%s")') % id)
-				alg, sha1 = id.split('=')
-				try:
-					long(sha1, 16)
-				except Exception, ex:
-					raise InvalidInterface(_('Bad SHA1 attribute: %s') % ex)
-				impl = self._get_impl(id)
-
-			impl.metadata = item_attrs
-			try:
-				version_mod = item_attrs.get('version-modifier', None)
-				if version_mod:
-					item_attrs['version'] += version_mod
-					del item_attrs['version-modifier']
-				version = item_attrs['version']
-			except KeyError:
-				raise InvalidInterface(_("Missing version attribute"))
-			impl.version = parse_version(version)
-
-			item_main = item_attrs.get('main', None)
-			if item_main and item_main.startswith('/'):
-				raise InvalidInterface(_("'main' attribute must be relative, but '%s' starts with '/'!") %
-							item_main)
-			impl.main = item_main
-
-			impl.released = item_attrs.get('released', None)
-			impl.langs = item_attrs.get('langs', None)
-
-			size = item.getAttribute('size')
-			if size:
-				impl.size = long(size)
-			impl.arch = item_attrs.get('arch', None)
-			try:
-				stability = stability_levels[str(item_attrs['stability'])]
-			except KeyError:
-				stab = str(item_attrs['stability'])
-				if stab != stab.lower():
-					raise InvalidInterface(_('Stability "%s" invalid - use lower case!') % item_attrs.stability)
-				raise InvalidInterface(_('Stability "%s" invalid') % item_attrs['stability'])
-			if stability >= preferred:
-				raise InvalidInterface(_("Upstream can't set stability to preferred!"))
-			impl.upstream_stability = stability
-
-			impl.bindings = bindings
+					download_sources.append(recipe)
+
+		impl._record = None
+		impl.metadata = metadata
+		impl.bindings = _extend(base_bindings, bindings)
+		impl.download_sources = download_sources
+
+	def _add_package_impl(self, package_impls, distro, item, item_attrs, depends):
+		distro_names = item_attrs.get('distributions', '')
+		for distro_name in distro_names.split(' '):
+			score = distro.get_score(distro_name)
+			if score > package_impls[0]:
+				package_impls[0] = score
+				package_impls[1] = []
+			if score == package_impls[0]:
+				package_impls[1].append((item, item_attrs, depends))
+
+	def _process_native_impl(self, distro, item, item_attrs, depends):
+		package = item_attrs.get('package', None)
+		if package is None:
+			raise InvalidInterface(_("Missing 'package' attribute on %s") % item)
+
+		def factory(id):
+			impl = self._get_package_impl(id, item_attrs, DistributionImplementation)
 			impl.requires = depends
+			return impl
 
-			for elem in item.childNodes:
-				if elem.uri != XMLNS_IFACE: continue
-				if elem.name == 'archive':
-					url = elem.getAttribute('href')
-					if not url:
-						raise InvalidInterface(_("Missing href attribute on <archive>"))
-					size = elem.getAttribute('size')
-					if not size:
-						raise InvalidInterface(_("Missing size attribute on <archive>"))
-					impl.add_download_source(url = url, size = long(size),
-							extract = elem.getAttribute('extract'),
-							start_offset = _get_long(elem, 'start-offset'),
-							type = elem.getAttribute('type'))
-				elif elem.name == 'recipe':
-					recipe = Recipe()
-					for recipe_step in elem.childNodes:
-						if recipe_step.uri == XMLNS_IFACE and recipe_step.name == 'archive':
-							url = recipe_step.getAttribute('href')
-							if not url:
-								raise InvalidInterface(_("Missing href attribute on <archive>"))
-							size = recipe_step.getAttribute('size')
-							if not size:
-								raise InvalidInterface(_("Missing size attribute on <archive>"))
-							recipe.steps.append(DownloadSource(None, url = url, size = long(size),
-									extract = recipe_step.getAttribute('extract'),
-									start_offset = _get_long(recipe_step, 'start-offset'),
-									type = recipe_step.getAttribute('type')))
-						else:
-							info(_("Unknown step '%s' in recipe; skipping recipe"), recipe_step.name)
-							break
-					else:
-						impl.download_sources.append(recipe)
-
-		def process_native_impl(item, item_attrs, depends):
-			package = item_attrs.get('package', None)
-			if package is None:
-				raise InvalidInterface(_("Missing 'package' attribute on %s") % item)
-
-			def factory(id):
-				impl = self._get_package_impl(id, item_attrs, DistributionImplementation)
-				impl.requires = depends
-				return impl
-
-			if not distro.get_package_info(package, factory):
-				self._packages_to_install.append((item_attrs, depends))
-		
-		root_attrs = {'stability': 'testing'}
-		if main:
-			root_attrs['main'] = main
-		process_group(feed_element, root_attrs, [], [])
-
-		for args in package_impls[1]:
-			process_native_impl(*args)
+		if not distro.get_package_info(package, factory):
+			self._packages_to_install.append((item_attrs, depends))
 
 	def get_name(self):
 		return self.name or '(' + os.path.basename(self.url) + ')'
@@ -957,6 +1149,45 @@ del x
 
 _version_re = re.compile('-([a-z]*)')
 
+# Marks the end of each dotted list in a parsed version. It must sort before
+# any component (which are all >= 0) so that "1.2" < "1.2.0", as for lists.
+_version_list_end = -1
+
+class _LRUCache(object):
+	"""A cache which keeps (approximately) the max_size most recently used entries.
+	Entries are kept in two generations. New or used entries go in the new one; when
+	that is full, it becomes the old one and the previous old one is discarded. This
+	is much cheaper than keeping exact usage order."""
+	__slots__ = ['max_size', 'new', 'old']
+
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.new = {}
+		self.old = {}
+
+	def get(self, key):
+		"""@return: the cached value, or None"""
+		value = self.new.get(key, None)
+		if value is None:
+			value = self.old.get(key, None)
+			if value is not None:
+				self.put(key, value)
+		return value
+
+	def put(self, key, value):
+		if len(self.new) >= self.max_size:
+			self.old = self.new
+			self.new = {}
+		self.new[key] = value
+
+	def clear(self):
+		self.new = {}
+		self.old = {}
+
+# Version string -> parsed version (the same versions appear in many feeds, and are
+# parsed again each time a feed is loaded)
+_parsed_versions = _LRUCache(5000)
+
 def parse_version(version_string):
 	"""Convert a version string to an internal representation.
 	The parsed format can be compared quickly using the standard Python functions.
@@ -966,6 +1197,13 @@ def parse_version(version_string):
 	@raise SafeException: if the string isn't a valid version
 	@since: 0.24 (moved from L{reader}, from where it is still available):"""
 	if version_string is None: return None
+	parsed = _parsed_versions.get(version_string)
+	if parsed is None:
+		parsed = _parse_version(version_string)
+		_parsed_versions.put(version_string, parsed)
+	return parsed
+
+def _parse_version(version_string):
 	parts = _version_re.split(version_string)
 	if parts[-1] == '':
 		del parts[-1]	# Ends with a modifier
@@ -983,23 +1221,38 @@ def parse_version(version_string):
 				parts[x] = []	# (because ''.split('.') == [''], not [])
 		for x in range(1, l, 2):
 			parts[x] = _version_mod_to_value[parts[x]]
-		return parts
 	except ValueError, ex:
 		raise SafeException(_("Invalid version format in '%(version_string)s': %(exception)s") % {'version_string': version_string, 'exception': ex})
 	except KeyError, ex:
 		raise SafeException(_("Invalid version modifier in '%(version_string)s': %(exception)s") % {'version_string': version_string, 'exception': ex})
 
+	# Flatten [[1, 2], mod, [3], mod] to (1, 2, END, mod, 3, END, mod), which is
+	# hashable, can be shared, and sorts in the same order
+	flat = []
+	for x in range(0, l, 2):
+		flat.extend(parts[x])
+		flat.append(_version_list_end)
+		flat.append(parts[x + 1])
+	return tuple(flat)
+
 def format_version(version):
 	"""Format a parsed version for display. Undoes the effect of L{parse_version}.
 	@see: L{Implementation.get_version}
 	@rtype: str
 	@since: 0.24"""
-	version = version[:]
-	l = len(version)
-	for x in range(0, l, 2):
-		version[x] = '.'.join(map(str, version[x]))
-	for x in range(1, l, 2):
-		version[x] = '-' + _version_value_to_mod[version[x]]
-	if version[-1] == '-': del version[-1]
-	return ''.join(version)
+	parts = []
+	dotted = []
+	is_mod = False
+	for x in version:
+		if is_mod:
+			parts.append('-' + _version_value_to_mod[x])
+			is_mod = False
+		elif x == _version_list_end:
+			parts.append('.'.join(map(str, dotted)))
+			dotted = []
+			is_mod = True
+		else:
+			dotted.append(x)
+	if parts[-1] == '-': del parts[-1]
+	return ''.join(parts)
 
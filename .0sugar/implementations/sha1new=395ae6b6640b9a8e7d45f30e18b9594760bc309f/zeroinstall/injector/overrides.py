@@ -0,0 +1,287 @@
+"""
+Stores the user's settings for every interface in a single file.
+
+Older versions kept a separate C{user_overrides/<escaped-uri>} file for each
+interface, rewriting it whenever anything changed (including after every
+download, to record the last-checked time) and parsing one for each interface
+loaded. The L{OverridesStore} reads everything at once, the first time it is
+needed, and changes are only written out when the main loop is idle (or when
+the process exits), so that many changes are saved together.
+
+Per-interface files are still read: any that are newer than the last time the
+store looked (e.g. because an older version of the injector wrote them) are
+imported automatically, which also migrates existing settings the first time.
+L{OverridesStore.export} writes them all out again, for older versions to use.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+from zeroinstall import _
+import os, time
+from logging import debug, info, warn
+from xml.sax.saxutils import quoteattr
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None	# Windows?
+
+from zeroinstall.support import basedir
+from zeroinstall.injector import qdom
+from zeroinstall.injector.namespaces import config_site, config_prog, XMLNS_IFACE
+from zeroinstall.injector.model import escape, unescape
+
+# Seconds to trust our copy before checking whether another process has changed the files
+CHECK_INTERVAL = 2
+
+def _get_mtime(path):
+	try:
+		return os.stat(path).st_mtime
+	except OSError:
+		return None
+
+def _format_element(element, indent, out):
+	"""Append the XML for element to out. Only elements in the injector's
+	namespace and unqualified attributes are written, which is all that the
+	settings use."""
+	out.append('%s<%s' % (indent, element.name))
+	for name, value in sorted(element.attrs.items()):
+		if ' ' not in name:
+			out.append(' %s=%s' % (name, quoteattr(value)))
+	children = [child for child in element.childNodes if child.uri == XMLNS_IFACE]
+	if children:
+		out.append('>\n')
+		for child in children:
+			_format_element(child, indent + ' ', out)
+		out.append('%s</%s>\n' % (indent, element.name))
+	else:
+		out.append('/>\n')
+
+def _write_atomic(path, out):
+	"""Replace path with the (unicode) strings in out."""
+	stream = file(path + '.new', 'w')
+	try:
+		stream.write(u''.join(out).encode('utf-8'))
+	finally:
+		stream.close()
+	os.chmod(path + '.new', 0660)
+	os.rename(path + '.new', path)
+
+def make_element(uri):
+	"""Create an empty set of settings for an interface.
+	@param uri: the interface's URI
+	@rtype: L{qdom.Element}"""
+	return make_child(XMLNS_IFACE, 'interface-preferences', {'uri': uri})
+
+def make_child(ns, name, attrs):
+	"""Create an element to add to the settings.
+	@rtype: L{qdom.Element}"""
+	element = qdom.Element(ns, name, attrs)
+	element.content = ''
+	return element
+
+class OverridesStore(object):
+	"""The user's settings for all interfaces. Each interface's settings are an
+	<interface-preferences> element, as in the old per-interface files.
+	@ivar path: the file holding the settings"""
+
+	def __init__(self, path = None):
+		"""@param path: the file to use (default: C{user-overrides.xml} in the injector's configuration directory)"""
+		if path is None:
+			path = os.path.join(basedir.save_config_path(config_site, config_prog), 'user-overrides.xml')
+		self.path = path
+		self._entries = None		# URI -> qdom.Element, once loaded
+		self._dirty = set()		# URIs set or removed since the last flush
+		self._mtime = None		# Of path, when we last read or wrote it
+		self._migrated = 0		# When we last imported per-interface files
+		self._checked = 0		# When we last checked for changes by other processes
+		self._flush_scheduled = False
+		self._exit_registered = False
+
+	def _update(self):
+		"""Make sure our copy is loaded and (nearly) up-to-date."""
+		now = time.time()
+		if self._entries is not None and 0 <= now - self._checked < CHECK_INTERVAL:
+			return
+		self._checked = now
+		mtime = _get_mtime(self.path)
+		if self._entries is None or mtime != self._mtime:
+			self._read(mtime)
+		self._import_files(now)
+
+	def _read(self, mtime):
+		"""Load the file, keeping any changes we haven't flushed yet."""
+		entries = {}
+		migrated = 0
+		if mtime is not None:
+			debug(_("Loading user overrides from %s"), self.path)
+			try:
+				stream = file(self.path)
+				try:
+					root = qdom.parse(stream)
+				finally:
+					stream.close()
+			except Exception, ex:
+				warn(_("Error reading '%(path)s': %(exception)s"), {'path': self.path, 'exception': ex})
+			else:
+				migrated = float(root.getAttribute('migrated') or 0)
+				for item in root.childNodes:
+					if item.uri == XMLNS_IFACE and item.name == 'interface-preferences':
+						uri = item.getAttribute('uri')
+						if uri:
+							entries[uri] = item
+
+		if self._entries is not None:
+			for uri in self._dirty:
+				if uri in self._entries:
+					entries[uri] = self._entries[uri]
+				else:
+					entries.pop(uri, None)
+			migrated = max(migrated, self._migrated)
+
+		self._entries = entries
+		self._mtime = mtime
+		self._migrated = migrated
+
+	def _import_files(self, now):
+		"""Import any per-interface files changed since we last looked."""
+		dirs = list(basedir.load_config_paths(config_site, config_prog, 'user_overrides'))
+		for path in dirs:
+			if _get_mtime(path) >= self._migrated:
+				break
+		else:
+			return		# Nothing has changed
+
+		# As for load_first_config, the first directory to have a file for a URI wins
+		files = {}
+		for path in dirs:
+			for leaf in os.listdir(path):
+				if leaf.startswith('.'):
+					continue
+				uri = unescape(leaf)
+				if uri not in files:
+					files[uri] = os.path.join(path, leaf)
+
+		for uri, path in files.iteritems():
+			if _get_mtime(path) < self._migrated:
+				continue
+			info(_("Importing user overrides from %s"), path)
+			try:
+				stream = file(path)
+				try:
+					root = qdom.parse(stream)
+				finally:
+					stream.close()
+			except Exception, ex:
+				warn(_("Error reading '%(user)s': %(exception)s"), {'user': path, 'exception': ex})
+				continue
+			root.attrs['uri'] = uri
+			self._entries[uri] = root
+			self._dirty.add(uri)
+
+		self._migrated = now
+		self._dirty.add(None)		# (record the new migration time)
+		self._schedule_flush()
+
+	def get(self, uri):
+		"""Get the settings for an interface. Don't modify the result; use L{set}.
+		@return: the settings, or None if there aren't any
+		@rtype: L{qdom.Element}"""
+		self._update()
+		return self._entries.get(uri, None)
+
+	def set(self, uri, element):
+		"""Replace the settings for an interface. They are saved later (see L{flush}).
+		@param element: the new settings (see L{make_element})
+		@type element: L{qdom.Element}"""
+		self._update()
+		self._entries[uri] = element
+		self._dirty.add(uri)
+		self._schedule_flush()
+
+	def remove(self, uri):
+		"""Forget the settings for an interface. This is saved later (see L{flush})."""
+		self._update()
+		if self._entries.pop(uri, None) is not None:
+			self._dirty.add(uri)
+			self._schedule_flush()
+
+	def list_uris(self):
+		"""@return: the URIs of all interfaces with settings
+		@rtype: [str]"""
+		self._update()
+		return self._entries.keys()
+
+	def _schedule_flush(self):
+		if not self._exit_registered:
+			import atexit
+			atexit.register(self._flush_at_exit)
+			self._exit_registered = True
+		if not self._flush_scheduled:
+			try:
+				import gobject
+			except ImportError:
+				return		# Just save at exit
+			gobject.idle_add(self._idle_flush)
+			self._flush_scheduled = True
+
+	def _idle_flush(self):
+		self._flush_scheduled = False
+		try:
+			self.flush()
+		except Exception, ex:
+			warn(_("Failed to save user overrides: %s"), ex)
+		return False
+
+	def _flush_at_exit(self):
+		try:
+			self.flush()
+		except Exception, ex:
+			warn(_("Failed to save user overrides: %s"), ex)
+
+	def flush(self):
+		"""Save any changes now. Changes made by other processes since we loaded
+		the file are kept, except for interfaces which we have also changed."""
+		if not self._dirty:
+			return
+		lock = None
+		if fcntl is not None:
+			lock = file(self.path + '.lock', 'w')
+			fcntl.lockf(lock, fcntl.LOCK_EX)
+		try:
+			mtime = _get_mtime(self.path)
+			if mtime != self._mtime:
+				self._read(mtime)
+
+			out = ['<?xml version="1.0" ?>\n',
+			       '<user-overrides xmlns=%s migrated=%s>\n' % (quoteattr(XMLNS_IFACE), quoteattr(repr(self._migrated)))]
+			for uri in sorted(self._entries):
+				_format_element(self._entries[uri], ' ', out)
+			out.append('</user-overrides>\n')
+			_write_atomic(self.path, out)
+			self._mtime = _get_mtime(self.path)
+			self._dirty.clear()
+			debug(_("Saved user overrides to %s"), self.path)
+		finally:
+			if lock is not None:
+				lock.close()
+
+	def export(self):
+		"""Write a per-interface file for every interface with settings, for
+		older versions of the injector to read.
+		@return: the number of files written
+		@rtype: int"""
+		self._update()
+		user_overrides = basedir.save_config_path(config_site, config_prog, 'user_overrides')
+		for uri, element in self._entries.iteritems():
+			out = ['<?xml version="1.0" ?>\n']
+			_format_element(element, '', out)
+			out[1] = out[1].replace('<interface-preferences', '<interface-preferences xmlns=%s' % quoteattr(XMLNS_IFACE), 1)
+			_write_atomic(os.path.join(user_overrides, escape(uri)), out)
+
+		# Don't import them all again
+		self._migrated = time.time()
+		self._dirty.add(None)
+		self.flush()
+		return len(self._entries)
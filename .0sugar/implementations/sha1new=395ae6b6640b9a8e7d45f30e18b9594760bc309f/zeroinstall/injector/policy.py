@@ -49,10 +49,13 @@ class Policy(object):
 	@type src: bool
 	@ivar stale_feeds: set of feeds which are present but haven't been checked for a long time
 	@type stale_feeds: set
+	@ivar solves: the number of times the solver has been run
+	@type solves: int
 	"""
 	__slots__ = ['root', 'watchers',
 		     'freshness', 'handler', '_warned_offline',
-		     'target_arch', 'src', 'stale_feeds', 'solver', '_fetcher']
+		     'target_arch', 'src', 'stale_feeds', 'solver', '_fetcher', 'solves',
+		     '__weakref__']
 	
 	help_with_testing = property(lambda self: self.solver.help_with_testing,
 				     lambda self, value: setattr(self.solver, 'help_with_testing', value))
@@ -76,6 +79,7 @@ class Policy(object):
 		self.freshness = 60 * 60 * 24 * 30
 		self.src = src				# Root impl must be a "src" machine type
 		self.stale_feeds = set()
+		self.solves = 0
 
 		from zeroinstall.injector.solver import DefaultSolver
 		self.solver = DefaultSolver(network_full, iface_cache, iface_cache.stores)
@@ -101,10 +105,13 @@ class Policy(object):
 				self.solver.network_use = config.get('global', 'network_use')
 				self.freshness = int(config.get('global', 'freshness'))
 				assert self.solver.network_use in network_levels, self.solver.network_use
+				if config.has_option('global', 'solver'):
+					self.set_solver(config.get('global', 'solver'))
 			except Exception, ex:
 				warn(_("Error loading config: %s"), str(ex) or repr(ex))
 
 		self.set_root(root)
+		iface_cache.add_policy(self)	# Keep our interfaces in memory
 
 		self.target_arch = arch.get_host_architecture()
 
@@ -121,6 +128,21 @@ class Policy(object):
 		self.root = root
 		for w in self.watchers: w()
 
+	def set_solver(self, name):
+		"""Switch to a different solver, keeping the current settings.
+		@param name: the name of the solver (see L{solver.solvers})
+		@type name: str
+		@raise SafeException: if there is no solver with this name"""
+		from zeroinstall.injector import solver
+		if name not in solver.solvers:
+			raise SafeException(_("Unknown solver '%(name)s' (available: %(solvers)s)") %
+					{'name': name, 'solvers': ', '.join(sorted(solver.solvers))})
+		old = self.solver
+		self.solver = solver.solvers[name](old.network_use, old.iface_cache, old.stores, old.extra_restrictions)
+		self.solver.help_with_testing = old.help_with_testing
+		self.solver.record_details = old.record_details
+		self.solver.stats = old.stats
+
 	def save_config(self):
 		"""Write global settings."""
 		config = ConfigParser.ConfigParser()
@@ -129,6 +151,7 @@ class Policy(object):
 		config.set('global', 'help_with_testing', self.help_with_testing)
 		config.set('global', 'network_use', self.network_use)
 		config.set('global', 'freshness', self.freshness)
+		config.set('global', 'solver', self.solver.name)
 
 		path = basedir.save_config_path(config_site, config_prog)
 		path = os.path.join(path, 'global')
@@ -142,6 +165,7 @@ class Policy(object):
 		host_arch = self.target_arch
 		if self.src:
 			host_arch = arch.SourceArchitecture(host_arch)
+		self.solves += 1
 		self.solver.solve(self.root, host_arch)
 
 		if self.network_use == network_offline:
@@ -250,32 +274,30 @@ class Policy(object):
 						interface.name)
 			raise ex
 
-	def get_cached(self, impl):
+	def get_cached(self, impl, stored = None):
 		"""Check whether an implementation is available locally.
 		@type impl: model.Implementation
+		@param stored: digests known to be in the stores, from L{zerostore.Stores.get_index}
+		@type stored: frozenset(str)
 		@rtype: bool
 		"""
 		if isinstance(impl, DistributionImplementation):
 			return impl.installed
 		if impl.id.startswith('/'):
 			return os.path.exists(impl.id)
-		else:
-			try:
-				path = self.get_implementation_path(impl)
-				assert path
-				return True
-			except:
-				pass # OK
-		return False
+		if stored is None:
+			stored = iface_cache.stores.get_index()
+		return impl.id in stored
 	
 	def get_uncached_implementations(self):
 		"""List all chosen implementations which aren't yet available locally.
 		@rtype: [(L{model.Interface}, L{model.Implementation})]"""
+		stored = iface_cache.stores.get_index()
 		uncached = []
 		for iface in self.solver.selections:
 			impl = self.solver.selections[iface]
 			assert impl, self.solver.selections
-			if not self.get_cached(impl):
+			if not self.get_cached(impl, stored):
 				uncached.append((iface, impl))
 		return uncached
 	
@@ -308,6 +330,8 @@ class Policy(object):
 		"""Run the solver, then download any feeds that are missing or
 		that need to be updated. Each time a new feed is imported into
 		the cache, the solver is run again, possibly adding new downloads.
+		The solver only looks again at interfaces whose feeds have changed
+		since the previous run (see L{iface_cache.IfaceCache.get_generation}).
 		@param force: whether to download even if we're already ready to run."""
 		
 		downloads_finished = set()		# Successful or otherwise
@@ -318,6 +342,7 @@ class Policy(object):
 			host_arch = arch.SourceArchitecture(host_arch)
 
 		while True:
+			self.solves += 1
 			postponed = self.solver.solve(self.root, host_arch,
                     return_postponed=True)
 
@@ -385,6 +410,7 @@ class Policy(object):
 		host_arch = self.target_arch
 		if self.src:
 			host_arch = arch.SourceArchitecture(host_arch)
+		self.solves += 1
 		self.solver.solve(self.root, host_arch)
 		for w in self.watchers: w()
 
@@ -399,7 +425,8 @@ class Policy(object):
 	def download_uncached_implementations(self):
 		"""Download all implementations chosen by the solver that are missing from the cache."""
 		assert self.solver.ready, "Solver is not ready!\n%s" % self.solver.selections
-		return self.fetcher.download_impls([impl for impl in self.solver.selections.values() if not self.get_cached(impl)],
+		stored = iface_cache.stores.get_index()
+		return self.fetcher.download_impls([impl for impl in self.solver.selections.values() if not self.get_cached(impl, stored)],
 						   iface_cache.stores)
 
 	def download_icon(self, interface, force = False):
@@ -8,7 +8,9 @@ This is our light-weight version.
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _
+import re
 from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
 
 class Element(object):
 	"""An XML element.
@@ -53,15 +55,17 @@ class QSAXhandler:
 			self.stack.append(Element(split[0], split[1], attrs))
 		else:
 			self.stack.append(Element(None, fullname, attrs))
-		self.contents = ''
+		self.contents = []
 	
 	def characters(self, data):
-		self.contents += data
+		# expat may deliver text in many small pieces; joining them once
+		# at the end is linear, whereas += is quadratic
+		self.contents.append(data)
 	
 	def endElementNS(self, name):
-		contents = self.contents.strip()
+		contents = ''.join(self.contents).strip()
 		self.stack[-1].content = contents
-		self.contents = ''
+		self.contents = []
 		new = self.stack.pop()
 		if self.stack:
 			self.stack[-1].childNodes.append(new)
@@ -83,3 +87,60 @@ def parse(source):
 
 	parser.ParseFile(source)
 	return handler.doc
+
+_doctype = re.compile(r"""<!DOCTYPE(?:[^[>"']|"[^"]*"|'[^']*'|\[(?:[^]"']|"[^"]*"|'[^']*')*\])*>""")
+_element_name = re.compile(r'[^\s/>]+')
+_attribute = re.compile(r"""\s+([^\s=/>]+)\s*=\s*("[^"]*"|'[^']*')""")
+_tag_end = re.compile(r'\s*/?>')
+
+def set_root_attribute(data, name, value):
+	"""Set an attribute on the root element of an XML document, without parsing
+	the rest of it. Everything except the attribute's value is left exactly as it
+	was; if the attribute isn't already there, it is added after the others.
+	@param data: the XML document
+	@type data: str
+	@param name: the attribute's name (with no namespace)
+	@type name: str
+	@param value: the new value
+	@type value: str
+	@return: the new document
+	@rtype: str
+	@raise ValueError: if the root element's start tag can't be found"""
+	# Skip the prolog (XML declaration, processing instructions, comments and DOCTYPE)
+	pos = 0
+	while True:
+		start = data.find('<', pos)
+		if start == -1:
+			raise ValueError(_("No root element found"))
+		if data.startswith('<?', start):
+			end = data.find('?>', start + 2)
+			pos = end + 2
+		elif data.startswith('<!--', start):
+			end = data.find('-->', start + 4)
+			pos = end + 3
+		elif data.startswith('<!', start):
+			doctype = _doctype.match(data, start)
+			if doctype is None:
+				raise ValueError(_("Invalid declaration in prolog"))
+			end = pos = doctype.end()
+		else:
+			break
+		if end == -1:
+			raise ValueError(_("Unterminated markup in prolog"))
+
+	tag_name = _element_name.match(data, start + 1)
+	if tag_name is None:
+		raise ValueError(_("Invalid start tag for root element"))
+
+	pos = tag_name.end()
+	while True:
+		attr = _attribute.match(data, pos)
+		if attr is None:
+			break
+		if attr.group(1) == name:
+			return data[:attr.start(2)] + quoteattr(value) + data[attr.end(2):]
+		pos = attr.end()
+
+	if _tag_end.match(data, pos) is None:
+		raise ValueError(_("Invalid start tag for root element"))
+	return data[:pos] + ' %s=%s' % (name, quoteattr(value)) + data[pos:]
@@ -7,13 +7,21 @@ Parses an XML interface into a Python representation.
 
 from zeroinstall import _
 import os
+import marshal
+import cPickle
+from cStringIO import StringIO
 from logging import debug, info, warn
 
+from zeroinstall import version
 from zeroinstall.support import basedir
-from zeroinstall.injector import qdom, distro
-from zeroinstall.injector.namespaces import config_site, config_prog, XMLNS_IFACE
+from zeroinstall.injector import qdom, distro, feedloader
+from zeroinstall.injector.namespaces import config_site, XMLNS_IFACE
 from zeroinstall.injector.model import Interface, InvalidInterface, ZeroInstallFeed, escape, Feed, stability_levels
 from zeroinstall.injector import model
+from zeroinstall.zerostore.manifest import sha1_new
+
+# Change this whenever the model classes (or the snapshot key) change in a way that affects pickling
+_SNAPSHOT_FORMAT = 5
 
 def update_from_cache(interface):
 	"""Read a cached interface and any native feeds or user overrides.
@@ -25,6 +33,7 @@ def update_from_cache(interface):
 	@rtype: bool"""
 	interface.reset()
 	main_feed = None
+	cached = None
 
 	if interface.uri.startswith('/'):
 		debug(_("Loading local interface file '%s'"), interface.uri)
@@ -34,8 +43,29 @@ def update_from_cache(interface):
 		cached = basedir.load_first_cache(config_site, 'interfaces', escape(interface.uri))
 		if cached:
 			debug(_("Loading cached information for %(interface)s from %(cached)s"), {'interface': interface, 'cached': cached})
-			main_feed = update(interface, cached)
+			main_feed = _load_snapshot(interface, cached)
+			if main_feed is None:
+				main_feed = update(interface, cached)
+				save_snapshot(interface, cached, main_feed)
+
+	_add_local_info(interface, main_feed)
+
+	return bool(cached)
+
+def update_from_feed(interface, feed):
+	"""Make feed the interface's main feed, as L{update_from_cache} would if
+	it read feed from the cache. Used when a feed has just been imported, to
+	avoid reading it back again.
+	@param interface: the interface object to update
+	@type interface: L{model.Interface}
+	@param feed: the interface's new main feed (from L{parse_feed_data})
+	@type feed: L{model.ZeroInstallFeed}"""
+	interface.reset()
+	interface._main_feed = feed
+	_add_local_info(interface, feed)
 
+def _add_local_info(interface, main_feed):
+	"""Add the native feeds and user overrides for interface."""
 	# Add the distribution package manager's version, if any
 	path = basedir.load_first_data(config_site, 'native_feeds', model._pretty_escape(interface.uri))
 	if path:
@@ -45,8 +75,6 @@ def update_from_cache(interface):
 
 	update_user_overrides(interface, main_feed)
 
-	return bool(cached)
-
 def update_user_overrides(interface, main_feed = None):
 	"""Update an interface with user-supplied information.
 	@param interface: the interface object to update
@@ -54,17 +82,11 @@ def update_user_overrides(interface, main_feed = None):
 	@param main_feed: feed to update with last_checked information
 	@note: feed updates shouldn't really be here. main_feed may go away in future.
 	"""
-	user = basedir.load_first_config(config_site, config_prog,
-					   'user_overrides', escape(interface.uri))
-	if not user:
+	from zeroinstall.injector.iface_cache import iface_cache
+	root = iface_cache.get_user_overrides().get(interface.uri)
+	if root is None:
 		return
 
-	try:
-		root = qdom.parse(file(user))
-	except Exception, ex:
-		warn(_("Error reading '%(user)s': %(exception)s"), {'user': user, 'exception': ex})
-		raise
-
 	# This is a bit wrong; this information is about the feed,
 	# not the interface.
 	if main_feed:
@@ -97,6 +119,143 @@ def update_user_overrides(interface, main_feed = None):
 				raise InvalidInterface(_('Missing "src" attribute in <feed>'))
 			interface.extra_feeds.append(Feed(feed_src, item.getAttribute('arch'), True, langs = item.getAttribute('langs')))
 
+def _get_snapshot_key(source):
+	"""Everything a snapshot of the feed in source depends on. This only needs a
+	stat of source: a feed rewritten with the same size and mtime (as when an
+	import sets the mtime to the signature time) still gets a new inode or
+	change time."""
+	stat = os.stat(source)
+	return (_SNAPSHOT_FORMAT, version, distro.get_host_distribution().__class__.__name__,
+		source, stat.st_ino, stat.st_mtime, stat.st_ctime, stat.st_size)
+
+def _get_snapshot_path(uri):
+	"""Snapshots are only ever read from the user's own cache; one in a shared
+	cache directory could have been written by someone else."""
+	return os.path.join(basedir.xdg_cache_home, config_site, 'interfaces-parsed', escape(uri))
+
+def _open_snapshot(uri, source):
+	"""Open the snapshot of the feed at uri, if it is for the current version of
+	source. The snapshot starts with two marshalled fields, the key and the
+	SHA-1 digest of source, which are checked (along with the file's owner and
+	permissions) before anything is unpickled.
+	@return: the stream, positioned at the pickled feed, and the stored digest,
+	or None if there is no usable snapshot
+	@rtype: (file, str)"""
+	path = _get_snapshot_path(uri)
+	try:
+		stream = file(path, 'rb')
+	except IOError:
+		return None
+	try:
+		details = os.fstat(stream.fileno())
+		if details.st_uid != os.geteuid() or details.st_mode & 022:
+			warn(_("Ignoring snapshot %s, which is not owned by the current user (or is writable by others)"), path)
+			stream.close()
+			return None
+		key = marshal.load(stream)
+		digest = marshal.load(stream)
+		if key != _get_snapshot_key(source):
+			debug(_("Snapshot of %s is out-of-date"), uri)
+			stream.close()
+			return None
+	except:
+		stream.close()
+		raise
+	return (stream, digest)
+
+def _read_snapshot(uri, source):
+	"""Read the snapshot of the feed at uri, if it is for the current version of source.
+	@return: the feed, or None if there is no usable snapshot
+	@rtype: L{model.ZeroInstallFeed}"""
+	try:
+		snapshot = _open_snapshot(uri, source)
+		if snapshot is None:
+			return None
+		stream, digest = snapshot
+		try:
+			return cPickle.load(stream)
+		finally:
+			stream.close()
+	except Exception, ex:
+		info(_("Failed to load snapshot of %(interface)s: %(exception)s"), {'interface': uri, 'exception': ex})
+		return None
+
+def _load_snapshot(interface, source):
+	"""Load the feed for interface from the snapshot saved by L{save_snapshot},
+	if there is one and source hasn't changed since.
+	@return: the feed, or None if the XML must be parsed instead
+	@rtype: L{model.ZeroInstallFeed}"""
+	feed = _read_snapshot(interface.uri, source)
+	if feed is None:
+		return None
+	interface._main_feed = feed
+	return feed
+
+def get_cached_digest(uri, source):
+	"""Get the SHA-1 digest of a cached feed's XML. This is the one stored with
+	the feed's snapshot, if it has an up-to-date one; the file is only read
+	and hashed if not.
+	@param uri: the URI of the feed
+	@param source: the cached copy of the feed
+	@type source: str
+	@return: the hex digest
+	@rtype: str"""
+	try:
+		snapshot = _open_snapshot(uri, source)
+	except Exception, ex:
+		info(_("Failed to load snapshot of %(interface)s: %(exception)s"), {'interface': uri, 'exception': ex})
+		snapshot = None
+	if snapshot is not None:
+		stream, digest = snapshot
+		stream.close()
+		return digest
+
+	stream = file(source, 'rb')
+	try:
+		return sha1_new(stream.read()).hexdigest()
+	finally:
+		stream.close()
+
+def save_snapshot(interface, source, feed, digest = None):
+	"""Save a pre-parsed copy of feed (just read from source), so that
+	L{update_from_cache} doesn't need to parse source again while it is
+	unchanged. Feeds using distribution packages aren't saved, because their
+	implementations depend on what is installed at the time. Errors are only
+	logged.
+	@param interface: the interface whose main feed this is
+	@type interface: L{model.Interface}
+	@param source: the cached copy of the feed
+	@type source: str
+	@param feed: the feed parsed from source
+	@type feed: L{model.ZeroInstallFeed}
+	@param digest: the SHA-1 digest of source, if known (see L{get_cached_digest})
+	@type digest: str"""
+	if feed._packages_to_install:
+		return
+	for impl in feed.implementations.itervalues():
+		if isinstance(impl, model.DistributionImplementation):
+			return
+	try:
+		if digest is None:
+			stream = file(source, 'rb')
+			try:
+				digest = sha1_new(stream.read()).hexdigest()
+			finally:
+				stream.close()
+		basedir.save_cache_path(config_site, 'interfaces-parsed')
+		path = _get_snapshot_path(interface.uri)
+		stream = file(path + '.new', 'wb')
+		try:
+			os.chmod(path + '.new', 0600)
+			marshal.dump(_get_snapshot_key(source), stream)
+			marshal.dump(digest, stream)
+			cPickle.dump(feed, stream, cPickle.HIGHEST_PROTOCOL)
+		finally:
+			stream.close()
+		os.rename(path + '.new', path)
+	except Exception, ex:
+		info(_("Failed to save snapshot of %(interface)s: %(exception)s"), {'interface': interface.uri, 'exception': ex})
+
 def check_readable(interface_uri, source):
 	"""Test whether an interface file is valid.
 	@param interface_uri: the interface's URI
@@ -111,14 +270,56 @@ def check_readable(interface_uri, source):
 	try:
 		update(tmp, source)
 	except InvalidInterface, ex:
-		info(_("Error loading feed:\n"
-			"Interface URI: %(uri)s\n"
-			"Local file: %(source)s\n"
-			"%(exception)s") %
-			{'uri': interface_uri, 'source': source, 'exception': ex})
-		raise InvalidInterface(_("Error loading feed '%(uri)s':\n\n%(exception)s") % {'uri': interface_uri, 'exception': ex})
+		_report_invalid(interface_uri, source, ex)
 	return tmp.last_modified
 
+def parse_feed_data(interface_uri, data, modified_time):
+	"""Parse and check a newly-downloaded feed. This does the same checks as
+	L{check_readable}, but without needing the feed to be saved first.
+	@param interface_uri: the URI the feed was downloaded from
+	@type interface_uri: str
+	@param data: the feed's XML
+	@type data: str
+	@param modified_time: the feed's modification time (from its signature)
+	@type modified_time: int
+	@return: the new feed
+	@rtype: L{model.ZeroInstallFeed}
+	@raise InvalidInterface: if the data isn't a valid feed for interface_uri"""
+	try:
+		feed = _load_feed(StringIO(data), None)
+		_check_url(feed, interface_uri)
+	except InvalidInterface, ex:
+		_report_invalid(interface_uri, _('(downloaded data)'), ex)
+	feed.last_modified = modified_time
+	return feed
+
+def _load_feed(stream, local_path):
+	"""Parse a feed with L{feedloader}. Errors other than L{InvalidInterface} (e.g. a
+	ValueError from a malformed attribute) are reported as L{InvalidInterface}s too.
+	@raise IOError: if the stream can't be read"""
+	try:
+		return feedloader.load_feed(stream, local_path, distro.get_host_distribution())
+	except (InvalidInterface, IOError):
+		raise
+	except Exception, ex:
+		raise InvalidInterface(_("Invalid XML"), ex)
+
+def _report_invalid(interface_uri, source, ex):
+	"""Log the details of why a feed couldn't be loaded and raise an error for the user."""
+	info(_("Error loading feed:\n"
+		"Interface URI: %(uri)s\n"
+		"Local file: %(source)s\n"
+		"%(exception)s") %
+		{'uri': interface_uri, 'source': source, 'exception': ex})
+	raise InvalidInterface(_("Error loading feed '%(uri)s':\n\n%(exception)s") % {'uri': interface_uri, 'exception': ex})
+
+def _check_url(feed, interface_uri):
+	if feed.url != interface_uri:
+		raise InvalidInterface(_("Incorrect URL used for feed.\n\n"
+					"%(feed_url)s is given in the feed, but\n"
+					"%(interface_uri)s was requested") %
+					{'feed_url': feed.url, 'interface_uri': interface_uri})
+
 def update(interface, source, local = False):
 	"""Read in information about an interface.
 	@param interface: the interface object to update
@@ -131,28 +332,26 @@ def update(interface, source, local = False):
 	@see: L{update_from_cache}, which calls this"""
 	assert isinstance(interface, Interface)
 
+	if local:
+		local_path = source
+	else:
+		local_path = None
+
 	try:
-		root = qdom.parse(file(source))
+		stream = file(source)
+		try:
+			feed = _load_feed(stream, local_path)
+		finally:
+			stream.close()
 	except IOError, ex:
 		if ex.errno == 2:
 			raise InvalidInterface(_("Feed not found. Perhaps this is a local feed that no longer exists? You can remove it from the list of feeds in that case."), ex)
 		raise InvalidInterface(_("Can't read file"), ex)
-	except Exception, ex:
-		raise InvalidInterface(_("Invalid XML"), ex)
-	
-	if local:
-		local_path = source
-	else:
-		local_path = None
-	feed = ZeroInstallFeed(root, local_path, distro.get_host_distribution())
+
 	feed.last_modified = int(os.stat(source).st_mtime)
 
 	if not local:
-		if feed.url != interface.uri:
-			raise InvalidInterface(_("Incorrect URL used for feed.\n\n"
-						"%(feed_url)s is given in the feed, but\n"
-						"%(interface_uri)s was requested") %
-						{'feed_url': feed.url, 'interface_uri': interface.uri})
-	
+		_check_url(feed, interface.uri)
+
 	interface._main_feed = feed
 	return feed
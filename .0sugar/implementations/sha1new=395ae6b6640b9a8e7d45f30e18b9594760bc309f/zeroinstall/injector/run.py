@@ -162,6 +162,7 @@ def _execute(root_impl, prog_args, dry_run, main, wrapper):
 		print _("Would execute: %s") % ' '.join([prog_path] + prog_args)
 	else:
 		info(_("Executing: %s"), prog_path)
+		iface_cache.flush_user_overrides()	# (atexit handlers won't run)
 		sys.stdout.flush()
 		sys.stderr.flush()
 		try:
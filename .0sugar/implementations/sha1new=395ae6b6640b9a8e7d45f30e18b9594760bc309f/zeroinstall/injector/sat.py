@@ -0,0 +1,354 @@
+"""
+A small SAT solver, used by L{solver.SATSolver}.
+
+This is not a general-purpose solver; it only knows about the two kinds of
+constraint the Zero Install solver needs ("at least one of these" and "at most
+one of these"). It does unit propagation using watched literals, learns a new
+clause from each conflict (first unique implication point) and backjumps.
+Every assignment is recorded on a trail so that backtracking just pops the
+trail, undoing each change in constant time.
+
+The caller chooses which literal to try next (see L{SATProblem.run_solver}),
+which is how the Zero Install solver keeps its "best version first" behaviour.
+
+Literals are ints: variable number v is the positive literal v and its
+negation is C{neg(v) == -1 - v}.
+
+This is internal; the API may change at any time.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+from logging import debug
+
+def neg(lit):
+	"""Negate a literal."""
+	return -1 - lit
+
+def var_of(lit):
+	"""Get the variable number of a literal."""
+	if lit < 0:
+		return -1 - lit
+	return lit
+
+class UnionClause(object):
+	"""At least one of the literals must be True.
+	The first two literals are watched; lits[0] is the one we imply."""
+	__slots__ = ['problem', 'lits']
+
+	def __init__(self, problem, lits):
+		self.problem = problem
+		self.lits = lits
+
+		problem.watch_lit(neg(lits[0]), self)
+		problem.watch_lit(neg(lits[1]), self)
+
+	def propagate(self, lit):
+		"""lit has just become True, so one of our watched literals is now False.
+		@return: False on conflict"""
+		problem = self.problem
+		lits = self.lits
+		false_lit = neg(lit)
+
+		# Make sure the false literal is lits[1]
+		if lits[0] == false_lit:
+			lits[0] = lits[1]
+			lits[1] = false_lit
+
+		if problem.lit_value(lits[0]) is True:
+			# Already satisfied
+			problem.watch_lit(lit, self)
+			return True
+
+		# Look for another literal to watch instead
+		for i in xrange(2, len(lits)):
+			if problem.lit_value(lits[i]) is not False:
+				lits[1] = lits[i]
+				lits[i] = false_lit
+				problem.watch_lit(neg(lits[1]), self)
+				return True
+
+		# Everything except lits[0] is False, so it must be True
+		problem.watch_lit(lit, self)
+		return problem.enqueue(lits[0], self)
+
+	def calc_reason(self, lit):
+		"""@return: the True literals which forced lit (or caused a conflict, if lit is None)"""
+		return [neg(l) for l in self.lits if l != lit]
+
+	def __repr__(self):
+		return "<some: %s>" % ', '.join(map(self.problem.name_lit, self.lits))
+
+class AtMostOneClause(object):
+	"""At most one of the literals may be True.
+	All literals are watched; when one becomes True, the others are set to False."""
+	__slots__ = ['problem', 'lits', 'current']
+
+	def __init__(self, problem, lits):
+		self.problem = problem
+		self.lits = lits
+		self.current = None		# The True literal, once we've propagated it
+
+		for l in lits:
+			problem.watch_lit(l, self)
+
+	def propagate(self, lit):
+		problem = self.problem
+		problem.watch_lit(lit, self)
+
+		if self.current is not None:
+			return False		# Two of our literals were set in the same batch
+
+		self.current = lit
+		problem.add_undo(var_of(lit), self)
+
+		for l in self.lits:
+			if l != lit and not problem.enqueue(neg(l), self):
+				return False
+		return True
+
+	def undo(self, lit):
+		self.current = None
+
+	def calc_reason(self, lit):
+		if lit is None:
+			return [l for l in self.lits if self.problem.lit_value(l) is True]
+		return [self.current]
+
+	def __repr__(self):
+		return "<at most one: %s>" % ', '.join(map(self.problem.name_lit, self.lits))
+
+class SATProblem(object):
+	"""A set of variables and clauses, and the search state for solving them.
+	Typical use:
+	 1. Create variables with L{add_variable}.
+	 2. Add constraints with L{add_clause} and L{at_most_one}.
+	 3. Call L{run_solver}.
+	 4. Read the results with L{get_value}.
+	@ivar assigns: the value of each variable (True, False or None if unassigned)
+	@ivar conflicts: number of conflicts found (and clauses learnt)
+	@ivar decisions: number of times the caller's decide function chose a literal"""
+
+	def __init__(self):
+		self.assigns = []	# Var -> bool | None
+		self.level = []		# Var -> decision level at which it was assigned
+		self.reason = []	# Var -> clause that implied it, or None for decisions
+		self.undo = []		# Var -> [object with an undo(lit) method]
+		self.names = []		# Var -> user data (used for debug messages)
+		self.watches = {}	# Lit -> [clause to notify when lit becomes True]
+
+		self.trail = []		# Lits, in the order they became True
+		self.trail_lim = []	# Length of trail at the start of each decision level
+		self.qhead = 0		# Index in trail of the next literal to propagate
+
+		self.toplevel_conflict = False
+		self.conflicts = 0
+		self.decisions = 0
+
+	def add_variable(self, name):
+		"""Create a new variable.
+		@param name: anything; returned by L{get_name} and used in debug messages
+		@return: the positive literal for the new variable
+		@rtype: int"""
+		var = len(self.assigns)
+		self.assigns.append(None)
+		self.level.append(-1)
+		self.reason.append(None)
+		self.undo.append([])
+		self.names.append(name)
+		return var
+
+	def get_name(self, lit):
+		return self.names[var_of(lit)]
+
+	def name_lit(self, lit):
+		if lit < 0:
+			return "not(%s)" % self.names[neg(lit)]
+		return str(self.names[lit])
+
+	def lit_value(self, lit):
+		"""@return: True, False or None if the literal's variable is unassigned"""
+		if lit < 0:
+			value = self.assigns[-1 - lit]
+			if value is None:
+				return None
+			return not value
+		return self.assigns[lit]
+
+	def get_value(self, lit):
+		"""Same as L{lit_value}; use this after L{run_solver} has returned."""
+		return self.lit_value(lit)
+
+	def watch_lit(self, lit, clause):
+		self.watches.setdefault(lit, []).append(clause)
+
+	def add_undo(self, var, obj):
+		self.undo[var].append(obj)
+
+	def get_decision_level(self):
+		return len(self.trail_lim)
+
+	def enqueue(self, lit, reason):
+		"""Make lit True, because of reason (a clause, or None for a decision).
+		@return: False if lit is already False (a conflict)"""
+		value = self.lit_value(lit)
+		if value is not None:
+			return value
+		var = var_of(lit)
+		self.assigns[var] = lit >= 0
+		self.level[var] = len(self.trail_lim)
+		self.reason[var] = reason
+		self.trail.append(lit)
+		return True
+
+	def add_clause(self, lits):
+		"""Require at least one of lits to be True.
+		Must be called before L{run_solver}.
+		@return: the new clause, or None if it didn't need one"""
+		lits = list(set(lits))
+		for l in lits:
+			if neg(l) in lits:
+				return None		# Always true
+		if not lits:
+			self.toplevel_conflict = True
+			return None
+		if len(lits) == 1:
+			if not self.enqueue(lits[0], None):
+				self.toplevel_conflict = True
+			return None
+		return UnionClause(self, lits)
+
+	def at_most_one(self, lits):
+		"""Require at most one of lits to be True.
+		Must be called before L{run_solver}.
+		@return: the new clause, or None if it didn't need one"""
+		if len(lits) < 2:
+			return None
+		return AtMostOneClause(self, lits[:])
+
+	def propagate(self):
+		"""Propagate every pending assignment.
+		@return: the conflicting clause, or None if everything is consistent"""
+		trail = self.trail
+		while self.qhead < len(trail):
+			lit = trail[self.qhead]
+			self.qhead += 1
+			watchers = self.watches.get(lit, None)
+			if not watchers:
+				continue
+			self.watches[lit] = []
+			for i in xrange(len(watchers)):
+				clause = watchers[i]
+				if not clause.propagate(lit):
+					# Conflict; put back the ones we didn't get to
+					self.watches[lit].extend(watchers[i + 1:])
+					self.qhead = len(trail)
+					return clause
+		return None
+
+	def cancel(self):
+		"""Undo the most recent decision and everything that followed from it."""
+		start = self.trail_lim.pop()
+		trail = self.trail
+		while len(trail) > start:
+			lit = trail.pop()
+			var = var_of(lit)
+			undo = self.undo[var]
+			while undo:
+				undo.pop().undo(lit)
+			self.assigns[var] = None
+			self.level[var] = -1
+			self.reason[var] = None
+		self.qhead = len(trail)
+
+	def cancel_until(self, level):
+		while len(self.trail_lim) > level:
+			self.cancel()
+
+	def analyse(self, cause):
+		"""Work out why the conflict in cause happened.
+		@return: the clause to learn (whose first literal is the one to set after
+		backjumping), and the level to backjump to
+		@rtype: ([int], int)"""
+		current_level = len(self.trail_lim)
+		seen = set()
+		learnt = [None]
+		btlevel = 0
+		counter = 0		# Literals from the current level still to look at
+		p = None
+		index = len(self.trail) - 1
+
+		while True:
+			for q in cause.calc_reason(p):
+				var = var_of(q)
+				if var in seen:
+					continue
+				seen.add(var)
+				level = self.level[var]
+				if level == current_level:
+					counter += 1
+				elif level > 0:
+					learnt.append(neg(q))
+					btlevel = max(btlevel, level)
+				# (level 0 literals are always True; no need to mention them)
+
+			# Find the most recent assignment that we still need to explain
+			while True:
+				p = self.trail[index]
+				index -= 1
+				if var_of(p) in seen:
+					break
+			counter -= 1
+			if counter <= 0:
+				break
+			cause = self.reason[var_of(p)]
+
+		learnt[0] = neg(p)
+		return learnt, btlevel
+
+	def _learn(self, learnt):
+		"""Add a learnt clause after backjumping; learnt[0] is unassigned and the rest are False."""
+		if len(learnt) == 1:
+			self.enqueue(learnt[0], None)
+			return
+		# Watch the asserting literal and the most recently assigned of the others
+		best = 1
+		for i in xrange(2, len(learnt)):
+			if self.level[var_of(learnt[i])] > self.level[var_of(learnt[best])]:
+				best = i
+		learnt[1], learnt[best] = learnt[best], learnt[1]
+		clause = UnionClause(self, learnt)
+		self.enqueue(learnt[0], clause)
+
+	def run_solver(self, decide):
+		"""Search for an assignment satisfying all the clauses.
+		@param decide: called whenever propagation is finished; it should return an
+		unassigned literal to make True, or None if the current assignment is complete
+		(any variables still unassigned are then considered False by the caller)
+		@type decide: () -> int | None
+		@return: whether a solution was found
+		@rtype: bool"""
+		if self.toplevel_conflict:
+			return False
+
+		while True:
+			conflict = self.propagate()
+			if conflict is not None:
+				self.conflicts += 1
+				if not self.trail_lim:
+					debug("SAT: conflict at top level in %s", conflict)
+					return False
+				learnt, btlevel = self.analyse(conflict)
+				debug("SAT: conflict in %s; learnt %s",
+					conflict, ', '.join(map(self.name_lit, learnt)))
+				self.cancel_until(btlevel)
+				self._learn(learnt)
+			else:
+				lit = decide()
+				if lit is None:
+					return True
+				assert self.lit_value(lit) is None, self.name_lit(lit)
+				self.decisions += 1
+				self.trail_lim.append(len(self.trail))
+				self.enqueue(lit, None)
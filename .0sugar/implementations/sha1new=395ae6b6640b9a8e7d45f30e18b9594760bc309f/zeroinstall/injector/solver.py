@@ -6,14 +6,103 @@ Chooses a set of components to make a running program.
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _
-import os
+import os, heapq, time, logging
 from logging import debug, warn, info
 
-from zeroinstall.zerostore import BadDigest, NotStored
-
 from zeroinstall.injector.arch import machine_groups
 from zeroinstall.injector import model
 
+class _Descending(object):
+	"""Wraps a value so that it sorts in the opposite order.
+	Used in ranking keys for values that can't simply be negated (versions, IDs)."""
+	__slots__ = ['value']
+
+	def __init__(self, value):
+		self.value = value
+
+	def __cmp__(self, other):
+		return cmp(other.value, self.value)
+
+class SolverStats(object):
+	"""Counters collected while solving, if enabled with L{Solver.stats}.
+	The counts add up over every call to L{Solver.solve}, and the same object may
+	be shared by several solvers.
+	@ivar considered: the number of implementations considered
+	@type considered: int
+	@ivar rejected: the number of candidates rejected, by reason
+	@type rejected: {str: int}
+	@ivar backtracks: the number of choices undone because their dependencies couldn't be met
+	@type backtracks: int
+	@ivar store_lookups: the number of checks for whether an implementation is cached
+	@type store_lookups: int
+	@ivar feeds_loaded: the number of feeds read (feeds unchanged since an earlier solve aren't counted again)
+	@type feeds_loaded: int
+	@ivar iface_times: seconds spent collecting and ranking the candidates for each interface
+	@type iface_times: {str: float}
+	"""
+	__slots__ = ['considered', 'rejected', 'backtracks', 'store_lookups', 'feeds_loaded', 'iface_times']
+
+	def __init__(self):
+		self.considered = 0
+		self.rejected = {}
+		self.backtracks = 0
+		self.store_lookups = 0
+		self.feeds_loaded = 0
+		self.iface_times = {}
+
+	def reject(self, reason):
+		self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+	def add_time(self, uri, seconds):
+		self.iface_times[uri] = self.iface_times.get(uri, 0) + seconds
+
+	def as_dict(self):
+		"""@return: all the counters, as plain Python values
+		@rtype: dict"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+class _LazyDetails(object):
+	"""A read-only mapping from interfaces to details, which works out the
+	details for an interface only when they are first asked for.
+	Used for L{Solver.details} when record_details is off."""
+	__slots__ = ['_explain', '_ifaces', '_cache']
+
+	def __init__(self, explain, ifaces):
+		"""@param explain: function to get the details for one interface
+		@type explain: L{model.Interface} -> [(L{model.Implementation}, str)]
+		@param ifaces: the interfaces which have details"""
+		self._explain = explain
+		self._ifaces = ifaces
+		self._cache = {}
+
+	def __getitem__(self, iface):
+		details = self._cache.get(iface, None)
+		if details is None:
+			if iface not in self._ifaces:
+				raise KeyError(iface)
+			details = self._cache[iface] = self._explain(iface)
+		return details
+
+	def get(self, iface, default = None):
+		if iface not in self._ifaces:
+			return default
+		return self[iface]
+
+	def __contains__(self, iface):
+		return iface in self._ifaces
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self._ifaces)
+
+	def keys(self):
+		return list(self._ifaces)
+
+	def items(self):
+		return [(iface, self[iface]) for iface in self._ifaces]
+
 class Solver(object):
 	"""Chooses a set of implementations to satisfy the requirements of a program and its user.
 	Typical use:
@@ -28,16 +117,21 @@ class Solver(object):
 	@ivar feeds_used: the feeds which contributed to the choice in L{selections}
 	@type feeds_used: set(str)
 	@ivar record_details: whether to record information about unselected implementations
-	@type record_details: {L{Interface}: [(L{Implementation}, str)]}
-	@ivar details: extra information, if record_details mode was used
-	@type details: {str: [(Implementation, comment)]}
+	while solving, rather than working it out when details are asked for
+	@type record_details: bool
+	@ivar details: why each implementation was or wasn't chosen. Unless record_details
+	was set, this is worked out for each interface as it is looked up
+	@type details: {L{model.Interface}: [(L{model.Implementation}, str)]}
+	@ivar stats: counters to update while solving, or None (the default) to collect nothing
+	@type stats: L{SolverStats}
 	"""
-	__slots__ = ['selections', 'requires', 'feeds_used', 'details', 'record_details', 'ready']
+	__slots__ = ['selections', 'requires', 'feeds_used', 'details', 'record_details', 'ready', 'stats']
 
 	def __init__(self):
 		self.selections = self.requires = self.feeds_used = self.details = None
 		self.record_details = False
 		self.ready = False
+		self.stats = None
 	
 	def solve(self, root_interface, arch, return_postponed=False):
 		"""Get the best implementation of root_interface and all of its dependencies.
@@ -49,7 +143,16 @@ class Solver(object):
 		raise NotImplementedError("Abstract")
 
 class DefaultSolver(Solver):
-	"""The standard (rather naive) Zero Install solver."""
+	"""The standard (rather naive) Zero Install solver.
+
+	The solver remembers the candidates for each interface between calls to
+	L{solve}, and only looks at an interface's feeds again when the
+	L{iface_cache.IfaceCache} reports that one of them has changed. If nothing
+	at all has changed since the last call, the previous results are kept.
+	This makes re-solving after each download (see
+	L{policy.Policy.solve_with_downloads}) cheap."""
+	name = 'default'
+
 	def __init__(self, network_use, iface_cache, stores, extra_restrictions = None):
 		"""
 		@param network_use: how much use to make of the network
@@ -68,16 +171,73 @@ class DefaultSolver(Solver):
 		self.help_with_testing = False
 		self.extra_restrictions = extra_restrictions or {}
 
-	def solve(self, root_interface, arch, return_postponed=False):
+		self._settings = None		# What the cached candidates and keys depend on
+		self._candidates = {}		# (Interface, Architecture) -> ([(feed URI, generation)], [Implementation])
+		self._version_indexes = {}	# (Interface, Architecture) -> VersionIndex
+		self._rank_keys = {}		# (Interface, Architecture) -> {Implementation: tuple}
+		self._postponed = []
+		self._last_solve = None		# (inputs, generation) for the current results
+
+	def _start_solve(self, root_interface, arch, return_postponed):
+		"""Reset the results and the per-solve state used by the helper methods.
+		@return: True if nothing has changed since the last solve, so the current results are still correct
+		@rtype: bool"""
+		# Which implementations are available locally; one listing of each
+		# store rather than a stat per store per comparison
+		stored = self.stores.get_index()
+
+		settings = (self.network_use, self.help_with_testing, stored)
+		if settings != self._settings:
+			self._settings = settings
+			self._candidates = {}
+			self._rank_keys = {}
+			self._version_indexes = {}
+			self._last_solve = None
+
+		self._inputs = (root_interface, arch, return_postponed, self.record_details,
+				frozenset((iface, tuple(restrictions)) for iface, restrictions in self.extra_restrictions.iteritems()))
+		if self._last_solve == (self._inputs, self.iface_cache.generation) and not self._postponed:
+			debug(_("Nothing has changed since the last solve"))
+			return True
+
 		self.selections = {}
 		self.requires = {}
 		self.feeds_used = set()
-		self.details = self.record_details and {}
+		self._decisions = {}		# Interface -> how it was last processed (for _explain)
+		if self.record_details:
+			self.details = {}
+		else:
+			self.details = _LazyDetails(self._explain, self._decisions)
 		self._machine_group = None
-		postponed = []
+		self._return_postponed = return_postponed
+		self._postponed = []
+		self._complete = True		# Whether no feed had anything pending
+		self._stored = stored
+		self._host_machine_group = machine_groups.get(os.uname()[-1], 0)
+
+		# Checked once here, so that the inner loops don't build messages nobody will see
+		logger = logging.getLogger()
+		self._log_debug = logger.isEnabledFor(logging.DEBUG)
+		self._log_info = logger.isEnabledFor(logging.INFO)
+		return False
+
+	def _finish_solve(self):
+		"""Record that the current results are correct for the current state of the cache."""
+		if self._complete:
+			self._last_solve = (self._inputs, self.iface_cache.generation)
+		else:
+			self._last_solve = None
+
+	def solve(self, root_interface, arch, return_postponed=False):
+		if self._start_solve(root_interface, arch, return_postponed):
+			return self._postponed
 
 		debug(_("Solve! root = %s"), root_interface)
 
+		stats = self.stats
+		log_debug = self._log_debug
+		log_info = self._log_info
+
 		def process(dep, arch):
 			iface = self.iface_cache.get_interface(dep.interface)
 			iface_restrictions = dep.restrictions + self.extra_restrictions.get(iface, [])
@@ -85,30 +245,46 @@ class DefaultSolver(Solver):
 			if iface in self.selections:
 				impl = self.selections[iface]
 				if impl is not None:
-					return not get_unusable_reason(impl, iface_restrictions, arch)
+					return not self._get_unusable_reason(impl, iface_restrictions, arch)
 				else:
 					warn("Interface %s requested twice but first one was failed", iface)
 					return True
 			self.selections[iface] = None	# Avoid cycles
 
-			impls = get_implementations(iface, arch)
-			# sort in reverse mode to use pop()
-			impls.sort(lambda a, b: compare(iface, b, a, iface_restrictions, arch))
+			if stats is not None:
+				start = time.time()
+			impls = self._get_implementations(iface, arch)
+			if iface_restrictions and not self.record_details:
+				# Candidates excluded by the restrictions could never be chosen;
+				# they only need ranking to report them in details
+				impls = self._get_version_index(iface, arch, impls).select(iface_restrictions)
+			impls = self._rank(iface, impls, iface_restrictions, arch)
+			if stats is not None:
+				stats.add_time(iface.uri, time.time() - start)
 
 			if self.record_details:
 				self.details[iface] = []
 			best = None
+			machine_group_before = self._machine_group
+			machine_group_change = None	# (candidate being tried, new group)
 
 			while impls and best is None:
 				self.requires[iface] = selected_requires = []
-				impl = impls.pop()
+				impl = heapq.heappop(impls)[-1]
+				if stats is not None:
+					stats.considered += 1
 
-				if dep.is_optional() and not get_cached(impl):
+				if dep.is_optional() and not self._get_cached(impl):
+					if stats is not None:
+						stats.reject(_("Optional and not cached"))
 					continue
 
-				unusable = get_unusable_reason(impl, iface_restrictions, arch)
+				unusable = self._get_unusable_reason(impl, iface_restrictions, arch)
 				if unusable:
-					info(_("Best implementation of %(interface)s is %(best)s, but unusable (%(unusable)s)"), {'interface': iface, 'best': impl, 'unusable': unusable})
+					if log_info:
+						info(_("Best implementation of %(interface)s is %(best)s, but unusable (%(unusable)s)"), {'interface': iface, 'best': impl, 'unusable': unusable})
+					if stats is not None:
+						stats.reject(unusable)
 					if self.record_details:
 						self.details[iface].append((impl, unusable))
 					continue
@@ -117,15 +293,18 @@ class DefaultSolver(Solver):
 				machine_group_set = False
 				if self._machine_group is None and best.machine and best.machine != 'src':
 					self._machine_group = machine_groups.get(best.machine, 0)
-					debug(_("Now restricted to architecture group %s"), self._machine_group)
+					if log_debug:
+						debug(_("Now restricted to architecture group %s"), self._machine_group)
 					machine_group_set = True
 				prev_selections = set(self.selections.keys())
 				try:
 					for d in impl.requires:
-						debug(_("Considering dependency %s"), d)
+						if log_debug:
+							debug(_("Considering dependency %s"), d)
 						use = d.metadata.get("use", None)
 						if use not in arch.use:
-							info("Skipping dependency; use='%s' not in %s", use, arch.use)
+							if log_info:
+								info("Skipping dependency; use='%s' not in %s", use, arch.use)
 							continue
 						if process(d, arch.child_arch):
 							selected_requires.append(d)
@@ -139,6 +318,14 @@ class DefaultSolver(Solver):
 						if machine_group_set:
 							self._machine_group = None
 
+				if best is None:
+					if stats is not None:
+						stats.backtracks += 1
+						stats.reject(_("Incompatible with dependency restrictions"))
+					if self._machine_group != machine_group_before and machine_group_change is None:
+						# A dependency chose the group and it wasn't undone
+						machine_group_change = (impl, self._machine_group)
+
 				if self.record_details:
 					if best is None:
 						self.details[iface].append((impl, _("Incompatible with dependency restrictions")))
@@ -146,177 +333,473 @@ class DefaultSolver(Solver):
 						self.details[iface].append((impl, None))
 
 			if self.record_details:
-				for impl in impls:
-					unusable = get_unusable_reason(impl, iface_restrictions, arch)
+				# Worst first, as if the whole list had been sorted
+				for key, impl in sorted(impls, reverse = True):
+					unusable = self._get_unusable_reason(impl, iface_restrictions, arch)
 					if unusable:
 						self.details[iface].append((impl, unusable))
 					else:
 						self.details[iface].append((impl, _('Not processed')))
+			else:
+				# Just enough to replay this later, if anyone asks
+				self._decisions[iface] = (iface_restrictions, arch, dep.is_optional(), best,
+						machine_group_before, machine_group_change, self._machine_group)
 
 			if best is not None:
-				debug(_("Will use implementation %(implementation)s (version %(version)s)"), {'implementation': best, 'version': best.get_version()})
+				if log_debug:
+					debug(_("Will use implementation %(implementation)s (version %(version)s)"), {'implementation': best, 'version': best.get_version()})
 				self.selections[iface] = best
 			elif dep.is_optional():
-				info(_("Skip optional but not ready %(interface)s dependency"), {'interface': iface})
+				if log_info:
+					info(_("Skip optional but not ready %(interface)s dependency"), {'interface': iface})
 				del self.selections[iface]
-			else:
+			elif log_debug:
 				debug(_("No implementation chould be chosen yet"));
 
 			return best is not None
 
-		def get_implementations(iface, arch):
+		self.ready = process(model.InterfaceDependency(root_interface), arch)
+		self._finish_solve()
+		return self._postponed
+
+	def _explain(self, iface):
+		"""Work out the details for iface, as record_details would have recorded them.
+		The last decision made for iface is replayed, using the same candidates,
+		restrictions and architecture group.
+		@rtype: [(L{model.Implementation}, str)]"""
+		(restrictions, arch, optional, best,
+			machine_group_before, machine_group_change, machine_group_after) = self._decisions[iface]
+
+		# Replaying mustn't affect the results or the statistics
+		saved = (self._machine_group, self.feeds_used, self._return_postponed, self.stats)
+		self.feeds_used = set()
+		self._return_postponed = False
+		self.stats = None
+		try:
+			self._machine_group = machine_group_before
+			impls = self._rank(iface, self._get_implementations(iface, arch), restrictions, arch)
+
+			details = []
+			while impls:
+				impl = heapq.heappop(impls)[-1]
+				if optional and not self._get_cached(impl):
+					continue
+				unusable = self._get_unusable_reason(impl, restrictions, arch)
+				if unusable:
+					details.append((impl, unusable))
+				elif impl is best:
+					details.append((impl, None))
+					break
+				else:
+					details.append((impl, _("Incompatible with dependency restrictions")))
+					if machine_group_change and machine_group_change[0] is impl:
+						self._machine_group = machine_group_change[1]
+
+			# Worst first, as if the whole list had been sorted
+			self._machine_group = machine_group_after
+			for key, impl in sorted(impls, reverse = True):
+				unusable = self._get_unusable_reason(impl, restrictions, arch)
+				if unusable:
+					details.append((impl, unusable))
+				else:
+					details.append((impl, _('Not processed')))
+			return details
+		finally:
+			self._machine_group, self.feeds_used, self._return_postponed, self.stats = saved
+
+	def _get_implementations(self, iface, arch):
+		cached = self._candidates.get((iface, arch), None)
+		if cached is not None:
+			feeds, impls = cached
+			for f, generation in feeds:
+				if self.iface_cache.get_generation(f) != generation:
+					break
+			else:
+				self.feeds_used.update([f for f, generation in feeds])
+				return impls
+
+		if self._log_debug:
 			debug(_("get_best_implementation(%(interface)s), with feeds: %(feeds)s"), {'interface': iface, 'feeds': iface.feeds})
 
-			impls = []
-			for f in usable_feeds(iface, arch):
-				self.feeds_used.add(f)
+		# Ranking keys may depend on the old feeds (e.g. stability ratings)
+		self._rank_keys.pop((iface, arch), None)
+
+		feeds = []
+		impls = []
+		# Distribution packages are added to their feeds later, in place,
+		# so we can only reuse this list if there aren't any pending
+		complete = True
+		for f in self._usable_feeds(iface, arch):
+			self.feeds_used.add(f)
+			if self._log_debug:
 				debug(_("Processing feed %s"), f)
-
-				try:
-					feed = self.iface_cache.get_interface(f)._main_feed
-					if not feed.last_modified: continue	# DummyFeed
-					if feed.name and iface.uri != feed.url and iface.uri not in feed.feed_for:
-						info(_("Missing <feed-for> for '%(uri)s' in '%(feed)s'"), {'uri': iface.uri, 'feed': f})
-
-					if feed.implementations:
-						impls.extend(feed.implementations.values())
-					elif return_postponed:
-						postponed.extend(feed.pop_postponed())
-				except Exception, ex:
-					warn(_("Failed to load feed %(feed)s for %(interface)s: %(exception)s"), {'feed': f, 'interface': iface, 'exception': str(ex)})
-
-			if not impls:
-				info(_("Interface %s has no implementations!"), iface)
-				return []
-
-			return impls
-		
-		def compare(interface, b, a, iface_restrictions, arch):
-			"""Compare a and b to see which would be chosen first.
-			@param interface: The interface we are trying to resolve, which may
-			not be the interface of a or b if they are from feeds.
-			@rtype: int"""
-			a_stab = a.get_stability()
-			b_stab = b.get_stability()
-
-			# Usable ones come first
-			r = cmp(is_unusable(b, iface_restrictions, arch), is_unusable(a, iface_restrictions, arch))
-			if r: return r
-
-			machine = machine_groups.get(os.uname()[-1], 0)
-			r = cmp(machine_groups.get(a.machine, 0) == machine, machine_groups.get(b.machine, 0) == machine)
-			if r: return r
-
-			# Preferred versions come first
-			r = cmp(a_stab == model.preferred, b_stab == model.preferred)
-			if r: return r
-
-			if self.network_use != model.network_full:
-				r = cmp(get_cached(a), get_cached(b))
-				if r: return r
-
-			# Stability
-			stab_policy = interface.stability_policy
-			if not stab_policy:
-				if self.help_with_testing: stab_policy = model.testing
-				else: stab_policy = model.stable
-
-			if a_stab >= stab_policy: a_stab = model.preferred
-			if b_stab >= stab_policy: b_stab = model.preferred
-
-			r = cmp(a_stab, b_stab)
-			if r: return r
-			
-			# Newer versions come before older ones
-			r = cmp(a.version, b.version)
-			if r: return r
-
-			# Get best OS
-			r = cmp(arch.os_ranks.get(b.os, None),
-				arch.os_ranks.get(a.os, None))
-			if r: return r
-
-			# Get best machine
-			r = cmp(arch.machine_ranks.get(b.machine, None),
-				arch.machine_ranks.get(a.machine, None))
-			if r: return r
-
-			# Slightly prefer cached versions
-			if self.network_use == model.network_full:
-				r = cmp(get_cached(a), get_cached(b))
-				if r: return r
-
-			return cmp(a.id, b.id)
-		
-		def usable_feeds(iface, arch):
-			"""Return all feeds for iface that support arch.
-			@rtype: generator(ZeroInstallFeed)"""
-			yield iface.uri
-
-			for f in iface.feeds:
-				# Note: when searching for src, None is not in machine_ranks
-				if f.os in arch.os_ranks and \
-				   (f.machine is None or f.machine in arch.machine_ranks):
-					yield f.uri
+			if self.stats is not None:
+				self.stats.feeds_loaded += 1
+
+			try:
+				feed_iface = self.iface_cache.get_interface(f)
+				feeds.append((f, self.iface_cache.get_generation(f)))
+				feed = feed_iface._main_feed
+				if not feed.last_modified: continue	# DummyFeed
+				if feed.name and iface.uri != feed.url and iface.uri not in feed.feed_for:
+					info(_("Missing <feed-for> for '%(uri)s' in '%(feed)s'"), {'uri': iface.uri, 'feed': f})
+
+				if feed.implementations:
+					impls.extend(feed.implementations.values())
 				else:
-					debug(_("Skipping '%(feed)s'; unsupported architecture %(os)s-%(machine)s"),
-						{'feed': f, 'os': f.os, 'machine': f.machine})
-		
-		def is_unusable(impl, restrictions, arch):
-			"""@return: whether this implementation is unusable.
-			@rtype: bool"""
-			return get_unusable_reason(impl, restrictions, arch) != None
-
-		def get_unusable_reason(impl, restrictions, arch):
-			"""
-			@param impl: Implementation to test.
-			@type restrictions: [L{model.Restriction}]
-			@return: The reason why this impl is unusable, or None if it's OK.
-			@rtype: str
-			@note: The restrictions are for the interface being requested, not the interface
-			of the implementation; they may be different when feeds are being used."""
-			machine = impl.machine
-			if machine and self._machine_group is not None:
-				if machine_groups.get(machine, 0) != self._machine_group:
-					return _("Incompatible with another selection from a different architecture group")
-
-			for r in restrictions:
-				if not r.meets_restriction(impl):
-					return _("Incompatible with another selected implementation")
-			stability = impl.get_stability()
-			if stability <= model.buggy:
-				return stability.name
-			if self.network_use == model.network_offline and not get_cached(impl):
-				return _("Not cached and we are off-line")
-			if impl.os not in arch.os_ranks:
-				return _("Unsupported OS")
-			# When looking for source code, we need to known if we're
-			# looking at an implementation of the root interface, even if
-			# it's from a feed, hence the sneaky restrictions identity check.
-			if machine not in arch.machine_ranks:
-				if machine == 'src':
-					return _("Source code")
-				return _("Unsupported machine type")
+					complete = False
+					if self._return_postponed:
+						self._postponed.extend(feed.pop_postponed())
+			except Exception, ex:
+				complete = False
+				warn(_("Failed to load feed %(feed)s for %(interface)s: %(exception)s"), {'feed': f, 'interface': iface, 'exception': str(ex)})
+
+		if not impls:
+			info(_("Interface %s has no implementations!"), iface)
+			self._complete = False
+			return []
+
+		if complete:
+			self._candidates[(iface, arch)] = (feeds, impls)
+		else:
+			self._complete = False
+		return impls
+	
+	def _get_version_index(self, iface, arch, impls):
+		"""Get an index of impls (as returned by L{_get_implementations}) by version.
+		@rtype: L{model.VersionIndex}"""
+		index = self._version_indexes.get((iface, arch), None)
+		if index is None or index.impls is not impls:
+			index = self._version_indexes[(iface, arch)] = model.VersionIndex(impls)
+		return index
+
+	def _rank(self, interface, impls, iface_restrictions, arch):
+		"""Order impls so that the best candidates can be popped off first.
+		Only the candidates actually tried get fully ordered; the rest stay in the heap.
+		@param interface: The interface we are trying to resolve, which may
+		not be the interface of the impls if they are from feeds.
+		@return: a heap of (key, impl) pairs (use L{heapq.heappop})
+		@rtype: [(tuple, L{model.Implementation})]"""
+		stab_policy = interface.stability_policy
+		if not stab_policy:
+			if self.help_with_testing: stab_policy = model.testing
+			else: stab_policy = model.stable
+
+		rank_keys = self._rank_keys.get((interface, arch), None)
+		if rank_keys is None:
+			rank_keys = self._rank_keys[(interface, arch)] = {}
+
+		heap = []
+		for index, impl in enumerate(impls):
+			static = rank_keys.get(impl, None)
+			if static is None:
+				static = self._get_static_key(impl, stab_policy, arch)
+				rank_keys[impl] = static
+			# Usable ones come first; this depends on the restrictions and
+			# on the architecture group selected so far, so can't be cached.
+			# Later duplicates win ties, as they did with pop() after a stable sort.
+			key = (self._is_unusable(impl, iface_restrictions, arch),) + static + (-index,)
+			heap.append((key, impl))
+		heapq.heapify(heap)
+		return heap
+
+	def _get_static_key(self, impl, stab_policy, arch):
+		"""The part of an implementation's ranking key which doesn't change during a solve.
+		Smaller keys are better. The order is the same as the old pairwise comparison:
+		matching machine group, preferred, (cached), stability, version, OS, machine,
+		(cached), ID.
+		@rtype: tuple"""
+		stability = impl.get_stability()
+		is_preferred = stability == model.preferred
+		if stability >= stab_policy: stability = model.preferred
+
+		if self.network_use != model.network_full:
+			cached_first = not self._get_cached(impl)
+			cached_last = False
+		else:
+			cached_first = False
+			cached_last = not self._get_cached(impl)
+
+		return (machine_groups.get(impl.machine, 0) != self._host_machine_group,
+			not is_preferred,
+			cached_first,
+			-stability.level,
+			_Descending(impl.version),	# Newer versions come before older ones
+			arch.os_ranks.get(impl.os, None),
+			arch.machine_ranks.get(impl.machine, None),
+			cached_last,		# Slightly prefer cached versions
+			_Descending(impl.id))
+	
+	def _usable_feeds(self, iface, arch):
+		"""Return all feeds for iface that support arch.
+		@rtype: generator(ZeroInstallFeed)"""
+		yield iface.uri
+
+		for f in iface.feeds:
+			# Note: when searching for src, None is not in machine_ranks
+			if f.os in arch.os_ranks and \
+			   (f.machine is None or f.machine in arch.machine_ranks):
+				yield f.uri
+			else:
+				debug(_("Skipping '%(feed)s'; unsupported architecture %(os)s-%(machine)s"),
+					{'feed': f, 'os': f.os, 'machine': f.machine})
+	
+	def _is_unusable(self, impl, restrictions, arch):
+		"""@return: whether this implementation is unusable.
+		@rtype: bool"""
+		return self._get_unusable_reason(impl, restrictions, arch) != None
+
+	def _get_unusable_reason(self, impl, restrictions, arch):
+		"""
+		@param impl: Implementation to test.
+		@type restrictions: [L{model.Restriction}]
+		@return: The reason why this impl is unusable, or None if it's OK.
+		@rtype: str
+		@note: The restrictions are for the interface being requested, not the interface
+		of the implementation; they may be different when feeds are being used."""
+		machine = impl.machine
+		if machine and self._machine_group is not None:
+			if machine_groups.get(machine, 0) != self._machine_group:
+				return _("Incompatible with another selection from a different architecture group")
+
+		for r in restrictions:
+			if not r.meets_restriction(impl):
+				return _("Incompatible with another selected implementation")
+		stability = impl.get_stability()
+		if stability <= model.buggy:
+			return stability.name
+		if self.network_use == model.network_offline and not self._get_cached(impl):
+			return _("Not cached and we are off-line")
+		if impl.os not in arch.os_ranks:
+			return _("Unsupported OS")
+		# When looking for source code, we need to known if we're
+		# looking at an implementation of the root interface, even if
+		# it's from a feed, hence the sneaky restrictions identity check.
+		if machine not in arch.machine_ranks:
+			if machine == 'src':
+				return _("Source code")
+			return _("Unsupported machine type")
+		return None
+
+	def _get_cached(self, impl):
+		"""Check whether an implementation is available locally.
+		@type impl: model.Implementation
+		@rtype: bool
+		"""
+		if self.stats is not None:
+			self.stats.store_lookups += 1
+		if isinstance(impl, model.DistributionImplementation):
+			return impl.installed
+		if impl.id.startswith('/'):
+			return os.path.exists(impl.id)
+		return impl.id in self._stored
+
+class SATSolver(DefaultSolver):
+	"""A solver which converts the problem to a set of clauses and uses a small SAT
+	solver (L{sat}) to find a solution. When a choice turns out to be impossible,
+	it learns why, so it never makes the same mistake twice. This makes it much
+	faster than L{DefaultSolver} when there are conflicts between dependencies,
+	where that can take time exponential in the number of interfaces.
+
+	Candidates are tried in the same order as L{DefaultSolver} tries them, so
+	whenever that solver finds a solution this one usually finds the same one.
+	The exception is when L{DefaultSolver} rejects a candidate after one of its
+	dependencies has chosen the architecture group (e.g. x86_64): it keeps that
+	group for the rest of the solve, which can rule out candidates this solver
+	is still able to use."""
+	name = 'sat'
+
+	def solve(self, root_interface, arch, return_postponed=False):
+		from zeroinstall.injector import sat
+
+		if self._start_solve(root_interface, arch, return_postponed):
+			return self._postponed
+
+		debug(_("Solve! root = %s (using SAT solver)"), root_interface)
+
+		stats = self.stats
+		problem = sat.SATProblem()
+
+		root_iface = self.iface_cache.get_interface(root_interface)
+
+		# Find every interface we might need, and the usable candidates for each.
+		# Each interface is solved for a single architecture (the root for arch,
+		# everything else for arch.child_arch).
+		arches = {root_iface: arch}		# Interface -> Architecture
+		ranked = {}				# Interface -> [(key, Implementation)], best first
+		candidates = {}				# Interface -> [(lit, Implementation)], best first
+		iface_feeds = {}			# Interface -> [feed URI]
+		to_visit = [root_iface]
+		while to_visit:
+			iface = to_visit.pop(0)
+			iface_arch = arches[iface]
+			iface_restrictions = self.extra_restrictions.get(iface, [])
+
+			if stats is not None:
+				start = time.time()
+			feeds_before = self.feeds_used
+			self.feeds_used = set()
+			impls = self._get_implementations(iface, iface_arch)
+			iface_feeds[iface] = self.feeds_used
+			self.feeds_used = feeds_before
+
+			ranked[iface] = heap = self._rank(iface, impls, iface_restrictions, iface_arch)
+			heap.sort()
+			if stats is not None:
+				stats.add_time(iface.uri, time.time() - start)
+			candidates[iface] = iface_candidates = []
+			for key, impl in heap:
+				if key[0]:
+					# Unusable ones are sorted last
+					if stats is not None:
+						for key, impl in heap[len(iface_candidates):]:
+							stats.reject(self._get_unusable_reason(impl, iface_restrictions, iface_arch))
+					break
+				iface_candidates.append((problem.add_variable(impl), impl))
+				for d in impl.requires:
+					if d.metadata.get("use", None) not in iface_arch.use:
+						continue
+					dep_iface = self.iface_cache.get_interface(d.interface)
+					if dep_iface not in arches:
+						arches[dep_iface] = iface_arch.child_arch
+						to_visit.append(dep_iface)
+
+		# Add the constraints
+		machine_group_lits = {}			# Group -> lit
+		for iface, iface_candidates in candidates.iteritems():
+			problem.at_most_one([lit for lit, impl in iface_candidates])
+			iface_arch = arches[iface]
+			for lit, impl in iface_candidates:
+				if impl.machine and impl.machine != 'src':
+					group = machine_groups.get(impl.machine, 0)
+					group_lit = machine_group_lits.get(group, None)
+					if group_lit is None:
+						group_lit = machine_group_lits[group] = problem.add_variable('group-%s' % group)
+					problem.add_clause([sat.neg(lit), group_lit])
+
+				for d in impl.requires:
+					if d.metadata.get("use", None) not in iface_arch.use:
+						continue
+					# Optional dependencies are handled in decide(), like
+					# DefaultSolver does.
+					if d.is_optional():
+						continue
+					dep_candidates = candidates[self.iface_cache.get_interface(d.interface)]
+					allowed = [sat.neg(lit)]
+					for dep_lit, dep_impl in dep_candidates:
+						if self._meets_restrictions(dep_impl, d.restrictions):
+							allowed.append(dep_lit)
+						else:
+							problem.add_clause([sat.neg(lit), sat.neg(dep_lit)])
+					problem.add_clause(allowed)
+		problem.at_most_one(machine_group_lits.values())
+
+		# We need some version of the root interface
+		problem.add_clause([lit for lit, impl in candidates[root_iface]])
+
+		def get_selected(iface):
+			for lit, impl in candidates[iface]:
+				if problem.get_value(lit) is True:
+					return impl
 			return None
 
-		def get_cached(impl):
-			"""Check whether an implementation is available locally.
-			@type impl: model.Implementation
-			@rtype: bool
-			"""
-			if isinstance(impl, model.DistributionImplementation):
-				return impl.installed
-			if impl.id.startswith('/'):
-				return os.path.exists(impl.id)
-			else:
-				try:
-					path = self.stores.lookup(impl.id)
-					assert path
-					return True
-				except BadDigest:
-					return False
-				except NotStored:
-					return False
+		def decide():
+			"""Walk the current selections from the root, depth first, in the same order
+			as DefaultSolver, and return the best candidate for the first interface we
+			still need but haven't chosen yet."""
+			seen = set()
+			stack = [(root_iface, None)]
+			while stack:
+				iface, dep = stack.pop()
+				impl = get_selected(iface)
+				if impl is None:
+					optional = dep is not None and dep.is_optional()
+					for lit, impl in candidates[iface]:
+						if problem.get_value(lit) is not None:
+							continue
+						if optional and not (self._get_cached(impl) and
+								self._meets_restrictions(impl, dep.restrictions)):
+							continue
+						return lit
+					continue
+				if iface in seen:
+					continue
+				seen.add(iface)
+				iface_arch = arches[iface]
+				deps = [d for d in impl.requires if d.metadata.get("use", None) in iface_arch.use]
+				for d in reversed(deps):
+					stack.append((self.iface_cache.get_interface(d.interface), d))
+			return None
 
-		self.ready = process(model.InterfaceDependency(root_interface), arch)
-		return postponed
+		self.ready = problem.run_solver(decide)
+		debug(_("SAT solver finished after %(decisions)d decisions and %(conflicts)d conflicts"),
+			{'decisions': problem.decisions, 'conflicts': problem.conflicts})
+		if stats is not None:
+			stats.considered += sum([len(c) for c in candidates.itervalues()])
+			stats.backtracks += problem.conflicts
+
+		if self.ready:
+			# Collect the selections reachable from the root
+			to_visit = [root_iface]
+			while to_visit:
+				iface = to_visit.pop(0)
+				impl = get_selected(iface)
+				self.selections[iface] = impl
+				self.feeds_used.update(iface_feeds[iface])
+				self.requires[iface] = selected_requires = []
+				for d in impl.requires:
+					if d.metadata.get("use", None) not in arches[iface].use:
+						continue
+					dep_iface = self.iface_cache.get_interface(d.interface)
+					dep_impl = get_selected(dep_iface)
+					if dep_impl is None or not self._meets_restrictions(dep_impl, d.restrictions):
+						assert d.is_optional(), d
+						continue
+					selected_requires.append(d)
+					if dep_iface not in self.selections:
+						self.selections[dep_iface] = dep_impl
+						to_visit.append(dep_iface)
+		else:
+			# Report the interfaces with nothing usable; we may need to
+			# download their feeds
+			self.selections[root_iface] = None
+			for iface, iface_candidates in candidates.iteritems():
+				self.feeds_used.update(iface_feeds[iface])
+				if not iface_candidates:
+					self.selections[iface] = None
+
+		def explain(iface):
+			iface_details = []
+			iface_candidates = dict((impl, lit) for lit, impl in candidates[iface])
+			for key, impl in ranked[iface]:
+				lit = iface_candidates.get(impl, None)
+				if lit is None:
+					reason = self._get_unusable_reason(impl, self.extra_restrictions.get(iface, []), arches[iface])
+				elif self.selections.get(iface, None) is impl:
+					reason = None
+				elif problem.get_value(lit) is False:
+					reason = _("Incompatible with dependency restrictions")
+				else:
+					reason = _('Not processed')
+				iface_details.append((impl, reason))
+			return iface_details
+
+		if self.record_details:
+			for iface in ranked:
+				self.details[iface] = explain(iface)
+		else:
+			self.details = _LazyDetails(explain, ranked)
+
+		self._finish_solve()
+		return self._postponed
+
+	def _meets_restrictions(self, impl, restrictions):
+		for r in restrictions:
+			if not r.meets_restriction(impl):
+				return False
+		return True
+
+solvers = {
+	DefaultSolver.name: DefaultSolver,
+	SATSolver.name: SATSolver,
+}
@@ -5,43 +5,29 @@ Save per-interface configuration information.
 # Copyright (C) 2009, Thomas Leonard
 # See the README file for details, or visit http://0install.net.
 
-from zeroinstall import _
-import os
-from xml.dom import minidom, XMLNS_NAMESPACE
-
-from zeroinstall.support import basedir
-
-from zeroinstall.injector.model import escape
-from zeroinstall.injector.namespaces import config_site, config_prog, XMLNS_IFACE
+from zeroinstall.injector.namespaces import XMLNS_IFACE
 from zeroinstall.injector.iface_cache import iface_cache
+from zeroinstall.injector.overrides import make_element, make_child
 
 def _add_impl(parent, impl):
 	if impl.user_stability:
-		doc = parent.ownerDocument
-		node = doc.createElementNS(XMLNS_IFACE, 'implementation')
-		parent.appendChild(node)
-		node.setAttribute('user-stability', str(impl.user_stability))
-		node.setAttribute('id', impl.id)
+		parent.childNodes.append(make_child(XMLNS_IFACE, 'implementation',
+			{'user-stability': str(impl.user_stability), 'id': impl.id}))
 
 def save_feed(feed):
 	# This is wrong. Feed and interface settings should be saved in separate files.
 	save_interface(iface_cache.get_interface(feed.url))
 
 def save_interface(interface):
-	user_overrides = basedir.save_config_path(config_site, config_prog, 'user_overrides')
-
-	impl = minidom.getDOMImplementation()
-	doc = impl.createDocument(XMLNS_IFACE, 'interface-preferences', None)
-
-	root = doc.documentElement
-	root.setAttributeNS(XMLNS_NAMESPACE, 'xmlns', XMLNS_IFACE)
-	root.setAttribute('uri', interface.uri)
+	"""Store the user's settings for interface. They are written to disk later
+	(see L{overrides.OverridesStore.flush})."""
+	root = make_element(interface.uri)
 
 	if interface.stability_policy:
-		root.setAttribute('stability-policy', str(interface.stability_policy))
+		root.attrs['stability-policy'] = str(interface.stability_policy)
 
 	if interface.last_checked:
-		root.setAttribute('last-checked', str(interface.last_checked))
+		root.attrs['last-checked'] = str(interface.last_checked)
 
 	impls = interface.implementations.values()
 	impls.sort()
@@ -50,21 +36,11 @@ def save_interface(interface):
 	
 	for feed in interface.extra_feeds:
 		if feed.user_override:
-			elem = doc.createElementNS(XMLNS_IFACE, 'feed')
-			root.appendChild(elem)
-			elem.setAttribute('src', feed.uri)
+			elem = make_child(XMLNS_IFACE, 'feed', {'src': feed.uri})
+			root.childNodes.append(elem)
 			if feed.arch:
-				elem.setAttribute('arch', feed.arch)
+				elem.attrs['arch'] = feed.arch
+
+	iface_cache.get_user_overrides().set(interface.uri, root)
 
-	import tempfile
-	tmp_fd, tmp_name = tempfile.mkstemp(dir = user_overrides)
-	try:
-		tmp_file = os.fdopen(tmp_fd, 'w')
-		doc.writexml(tmp_file, addindent = " ", newl = '\n')
-		tmp_file.close()
-		path = os.path.join(user_overrides, escape(interface.uri))
-		os.rename(tmp_name, path)
-		os.chmod(path, 0660)
-	except:
-		os.unlink(tmp_name)
-		raise
+	iface_cache.mark_changed(interface.uri)
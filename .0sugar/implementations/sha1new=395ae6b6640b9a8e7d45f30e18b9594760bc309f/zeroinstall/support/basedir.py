@@ -3,6 +3,13 @@ Support code for the freedesktop.org basedir spec.
 
 This module provides functions for locating configuration files.
 
+To find out whether a file exists, the load_* functions look it up in a cached
+listing of its directory, rather than checking each of the XDG directories with
+a system call. The listing is read again if the directory's modification time
+has changed, but this is only checked once every L{LISTING_MAX_AGE} seconds (or
+on every use for L{LISTING_MAX_AGE} seconds after the directory is returned by
+one of the save_* functions, since the caller is probably about to change it).
+
 @see: U{http://freedesktop.org/wiki/Standards/basedir-spec}
 
 @var home: The value of $HOME (or '/' if not set). If we're running as root and
@@ -14,7 +21,7 @@ instead.
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _
-import os
+import os, time
 
 home = os.environ.get('HOME', '/')
 
@@ -59,6 +66,82 @@ xdg_data_dirs = filter(lambda x: x, xdg_data_dirs)
 xdg_cache_dirs = filter(lambda x: x, xdg_cache_dirs)
 xdg_config_dirs = filter(lambda x: x, xdg_config_dirs)
 
+# Seconds to trust a directory listing before checking its mtime again
+LISTING_MAX_AGE = 2
+
+class _Listing(object):
+	__slots__ = ['mtime', 'names', 'checked', 'complete']
+
+	def __init__(self, mtime, names):
+		self.mtime = mtime		# None if the directory doesn't exist
+		self.names = names
+		self.checked = 0		# When we last made sure mtime was current
+		self.complete = True		# False if it may have changed since without mtime changing
+
+_listings = {}		# Directory -> _Listing
+_changed = {}		# Directory -> when it was last returned by a save_* function
+
+def _get_listing(path):
+	"""Get the names in a directory, from the cache if it's up-to-date.
+	@return: the names (empty if path isn't a directory)
+	@rtype: frozenset"""
+	now = time.time()
+	listing = _listings.get(path, None)
+	if listing is not None and 0 <= now - listing.checked < LISTING_MAX_AGE:
+		return listing.names
+
+	try:
+		mtime = os.stat(path).st_mtime
+	except OSError:
+		mtime = None
+	if listing is None or listing.mtime != mtime or not listing.complete:
+		names = frozenset()
+		if mtime is not None:
+			try:
+				names = frozenset(os.listdir(path))
+			except OSError:
+				pass		# Not a directory, or not readable
+		listing = _listings[path] = _Listing(mtime, names)
+		# A directory changed within the current second might change again
+		# without its (coarse) mtime changing, so don't trust it next time
+		if mtime is not None and mtime >= int(now) - 1:
+			listing.complete = False
+	if 0 <= now - _changed.get(path, 0) < LISTING_MAX_AGE:
+		listing.checked = 0	# The caller may not have finished changing it yet
+	else:
+		listing.checked = now
+	return listing.names
+
+def _exists(base, resource):
+	"""Like os.path.exists(os.path.join(base, resource)), but using the cached listings."""
+	parent, leaf = os.path.split(os.path.join(base, resource))
+	if not leaf:
+		return os.path.exists(parent)
+	return leaf in _get_listing(parent)
+
+def _changing(path):
+	"""path has been returned by a save_* function. It, and perhaps its parents,
+	may have just been created, and the caller is likely to change it, so check
+	these listings whenever they are used for the next L{LISTING_MAX_AGE} seconds.
+	Otherwise, a listing read before the caller had finished (e.g. while checking
+	for an existing file) would hide the change until it expired."""
+	now = time.time()
+	while True:
+		_changed[path] = now
+		listing = _listings.get(path, None)
+		if listing is not None:
+			listing.checked = 0
+		parent = os.path.dirname(path)
+		if parent == path:
+			break
+		path = parent
+
+def invalidate():
+	"""Forget all the cached directory listings. Call this after deleting or
+	creating files in the XDG directories if you need the load_* functions to
+	notice immediately."""
+	_listings.clear()
+
 def save_config_path(*resource):
 	"""Ensure $XDG_CONFIG_HOME/<resource>/ exists, and return its path.
 	'resource' should normally be the name of your application. Use this
@@ -69,6 +152,7 @@ def save_config_path(*resource):
 	path = os.path.join(xdg_config_home, resource)
 	if not os.path.isdir(path):
 		os.makedirs(path, 0770)
+	_changing(path)
 	return path
 
 def load_config_paths(*resource):
@@ -77,8 +161,8 @@ def load_config_paths(*resource):
 	take precedence over later ones (ie, the user's config dir comes first)."""
 	resource = os.path.join(*resource)
 	for config_dir in xdg_config_dirs:
-		path = os.path.join(config_dir, resource)
-		if os.path.exists(path): yield path
+		if _exists(config_dir, resource):
+			yield os.path.join(config_dir, resource)
 
 def load_first_config(*resource):
 	"""Returns the first result from load_config_paths, or None if there is nothing
@@ -95,6 +179,7 @@ def save_cache_path(*resource):
 	path = os.path.join(xdg_cache_home, resource)
 	if not os.path.isdir(path):
 		os.makedirs(path, 0770)
+	_changing(path)
 	return path
 
 def load_cache_paths(*resource):
@@ -103,8 +188,8 @@ def load_cache_paths(*resource):
 	take precedence over later ones (ie, the user's cache dir comes first)."""
 	resource = os.path.join(*resource)
 	for cache_dir in xdg_cache_dirs:
-		path = os.path.join(cache_dir, resource)
-		if os.path.exists(path): yield path
+		if _exists(cache_dir, resource):
+			yield os.path.join(cache_dir, resource)
 
 def load_first_cache(*resource):
 	"""Returns the first result from load_cache_paths, or None if there is nothing
@@ -120,8 +205,8 @@ def load_data_paths(*resource):
 	@since: 0.28"""
 	resource = os.path.join(*resource)
 	for data_dir in xdg_data_dirs:
-		path = os.path.join(data_dir, resource)
-		if os.path.exists(path): yield path
+		if _exists(data_dir, resource):
+			yield os.path.join(data_dir, resource)
 
 def load_first_data(*resource):
 	"""Returns the first result from load_data_paths, or None if there is nothing
@@ -6,7 +6,7 @@ Code for managing the implementation cache.
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _
-import os
+import os, time
 from logging import debug, info, warn
 
 from zeroinstall.support import basedir
@@ -41,6 +41,9 @@ def _copytree2(src, dst):
 		else:
 			shutil.copy2(srcname, dstname)
 
+# Seconds to trust a store's index before checking whether the directory has changed
+INDEX_MAX_AGE = 2
+
 class Store:
 	"""A directory for storing implementations."""
 
@@ -51,9 +54,57 @@ class Store:
 		@param public: deprecated
 		@type public: bool"""
 		self.dir = dir
+		self._digests = None		# The index, once loaded
+		self._digests_mtime = None	# Of dir, when it was listed (None if not trusted)
+		self._digests_checked = 0	# When we last checked the mtime
 	
 	def __str__(self):
 		return _("Store '%s'") % self.dir
+
+	def get_digests(self):
+		"""Get the digests of the implementations in this store.
+		The set is built from a single directory listing. The directory's
+		modification time is checked at most every L{INDEX_MAX_AGE} seconds,
+		and it is listed again if that has changed (changes made through this
+		object are noticed immediately).
+		@return: the digests of all implementations in the store
+		@rtype: frozenset(str)"""
+		now = time.time()
+		if self._digests is not None and 0 <= now - self._digests_checked < INDEX_MAX_AGE:
+			return self._digests
+		self._digests_checked = now
+
+		try:
+			mtime = os.stat(self.dir).st_mtime
+		except OSError:
+			mtime = None
+		if self._digests is not None and mtime == self._digests_mtime and mtime is not None:
+			return self._digests
+
+		digests = set()
+		if mtime is not None:
+			try:
+				items = os.listdir(self.dir)
+			except OSError, ex:
+				info(_("Can't list store '%(store)s': %(exception)s"), {'store': self.dir, 'exception': str(ex)})
+				items = []
+			for leaf in items:
+				if '=' in leaf and not leaf.startswith('.'):
+					digests.add(leaf)
+		self._digests = frozenset(digests)
+
+		# A directory changed within the current second might change again
+		# without its (coarse) mtime changing, so don't trust it next time
+		if mtime is not None and mtime < int(now) - 1:
+			self._digests_mtime = mtime
+		else:
+			self._digests_mtime = None
+		return self._digests
+
+	def invalidate(self):
+		"""Forget the index, so that the directory is listed again when it is next needed.
+		@see: L{get_digests}"""
+		self._digests = None
 	
 	def lookup(self, digest):
 		try:
@@ -169,7 +220,8 @@ class Store:
 	def check_manifest_and_rename(self, required_digest, tmp, extract = None, try_helper = False):
 		"""Check that tmp[/extract] has the required_digest.
 		On success, rename the checked directory to the digest, and
-		make the whole tree read-only.
+		make the whole tree read-only. Files identical to ones already stored
+		are then hard-linked to them (see L{dedup}).
 		@param try_helper: attempt to use privileged helper to import to system cache first (since 0.26)
 		@type try_helper: bool
 		@raise BadDigest: if the input directory doesn't match the given digest"""
@@ -208,20 +260,48 @@ class Store:
 		os.chmod(extracted, 0755)
 		os.rename(extracted, final_name)
 		os.chmod(final_name, 0555)
+		self.invalidate()
 
 		if extract:
 			os.rmdir(tmp)
 
+		import dedup
+		dedup.add_to_index(final_name)
+
 	def __repr__(self):
 		return "<store: %s>" % self.dir
 
+class LookupStats(object):
+	"""Counts how L{Stores.lookup} calls were answered.
+	@ivar hits: the number of digests found using the stores' indexes
+	@type hits: int
+	@ivar misses: the number of digests which weren't in any index, so the
+	store directories had to be checked directly
+	@type misses: int"""
+	__slots__ = ['hits', 'misses']
+
+	def __init__(self):
+		self.hits = 0
+		self.misses = 0
+
+	def as_dict(self):
+		"""@return: all the counters, as plain Python values
+		@rtype: dict"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__])
+
 class Stores(object):
 	"""A list of L{Store}s. All stores are searched when looking for an implementation.
 	When storing, we use the first of the system caches (if writable), or the user's
-	cache otherwise."""
-	__slots__ = ['stores']
+	cache otherwise.
+	@ivar stats: how lookups were answered
+	@type stats: L{LookupStats}"""
+	__slots__ = ['stores', 'stats', '_index', '_index_key']
 
 	def __init__(self):
+		self.stats = LookupStats()
+		self._index = None
+		self._index_key = None
+
 		user_store = os.path.join(basedir.xdg_cache_home, '0install.net', 'implementations')
 		self.stores = [Store(user_store)]
 
@@ -239,17 +319,49 @@ class Stores(object):
 				self.stores.append(Store(directory))
 
 	def lookup(self, digest):
-		"""Search for digest in all stores."""
+		"""Search for digest in all stores.
+		The stores' indexes are checked first (see L{Store.get_digests}), and a
+		match is only used if its directory still exists. If the digest isn't
+		found that way, each directory is checked directly, in case an index is
+		out-of-date."""
 		assert digest
 		if '/' in digest or '=' not in digest:
 			raise BadDigest(_('Syntax error in digest (use ALG=VALUE, not %s)') % digest)
+		for store in self.stores:
+			if digest in store.get_digests():
+				path = os.path.join(store.dir, digest)
+				if os.path.isdir(path):
+					self.stats.hits += 1
+					return path
+				# Removed (e.g. by another process) since the store was listed
+				store.invalidate()
+		self.stats.misses += 1
 		for store in self.stores:
 			path = store.lookup(digest)
 			if path:
+				store.invalidate()
 				return path
 		raise NotStored(_("Item with digest '%(digest)s' not found in stores. Searched:\n- %(stores)s") %
 			{'digest': digest, 'stores': '\n- '.join([s.dir for s in self.stores])})
 
+	def get_index(self):
+		"""Get the set of digests available in any of our stores.
+		This is the union of the stores' indexes (see L{Store.get_digests}),
+		and is reused until one of them changes (or a store is added or
+		removed). Use this instead of L{lookup} when checking many
+		implementations at once, e.g. while solving.
+		@return: the digests of all stored implementations
+		@rtype: frozenset(str)"""
+		key = [store.get_digests() for store in self.stores]
+		if self._index_key is None or len(key) != len(self._index_key) or \
+		   [a for a, b in zip(key, self._index_key) if a is not b]:
+			if len(key) == 1:
+				self._index = key[0]
+			else:
+				self._index = frozenset().union(*key)
+			self._index_key = key
+		return self._index
+
 	def add_dir_to_cache(self, required_digest, dir):
 		"""Add to the best writable cache.
 		@see: L{Store.add_dir_to_cache}"""
@@ -263,14 +375,19 @@ class Stores(object):
 	
 	def _write_store(self, fn):
 		"""Call fn(first_system_store). If it's read-only, try again with the user store."""
-		if len(self.stores) > 1:
-			try:
-				fn(self.get_first_system_store())
-				return
-			except NonwritableStore:
-				debug(_("%s not-writable. Trying helper instead."), self.get_first_system_store())
-				pass
-		fn(self.stores[0], try_helper = True)
+		try:
+			if len(self.stores) > 1:
+				try:
+					fn(self.get_first_system_store())
+					return
+				except NonwritableStore:
+					debug(_("%s not-writable. Trying helper instead."), self.get_first_system_store())
+					pass
+			fn(self.stores[0], try_helper = True)
+		finally:
+			# (the helper may have added it to a system store)
+			for store in self.stores:
+				store.invalidate()
 
 	def get_first_system_store(self):
 		"""The first system store is the one we try writing to first.
@@ -0,0 +1,125 @@
+"""
+Verifies many implementations at once, for C{0store audit}.
+
+Each implementation is checked with L{manifest.verify} (using the
+verification L{ledger}, if available). When there are several worker
+processes (see L{manifest.get_workers}), each one verifies a whole
+implementation at a time, which keeps them all busy even when most
+implementations are small.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+import os, stat, time
+
+from zeroinstall.zerostore import manifest, ledger, BadDigest
+
+class AuditResult(object):
+	"""The result of verifying one implementation.
+	@ivar path: the implementation's directory
+	@ivar digest: the required digest
+	@ivar error: why it failed to verify, or None if it is OK
+	@ivar detail: more information about the failure (see L{BadDigest.detail}), or None
+	@ivar seconds: how long it took to check
+	@ivar files_read: the number of files which had to be hashed
+	@ivar bytes_read: the total size of those files
+	@ivar files_reused: the number of files which were unchanged since they were last hashed
+	@ivar bytes_reused: the total size of those files"""
+	__slots__ = ['path', 'digest', 'error', 'detail', 'seconds',
+		     'files_read', 'bytes_read', 'files_reused', 'bytes_reused']
+
+	def __init__(self, path, digest):
+		self.path = path
+		self.digest = digest
+		self.error = self.detail = None
+		self.seconds = 0
+		self.files_read = self.bytes_read = 0
+		self.files_reused = self.bytes_reused = 0
+
+	def as_dict(self):
+		"""@return: all the fields, as plain Python values
+		@rtype: dict"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+_ledger = None		# This process's ledger (False if unavailable); not shared with workers
+
+def _get_ledger(full):
+	global _ledger
+	if _ledger is None:
+		_ledger = ledger.open_ledger() or False
+	if _ledger:
+		_ledger.reuse = not full
+	return _ledger or None
+
+def _count_files(root):
+	"""@return: the number and total size of the regular files under root"""
+	files = size = 0
+	for dirpath, dirnames, filenames in os.walk(root):
+		for name in filenames:
+			info = os.lstat(os.path.join(dirpath, name))
+			if stat.S_ISREG(info.st_mode):
+				files += 1
+				size += info.st_size
+	return files, size
+
+def audit_implementation(path, required_digest, full = False, workers = None):
+	"""Verify one implementation.
+	@param full: hash every file, even if it hasn't changed since it was last checked
+	@param workers: the number of processes to hash files with (see L{manifest.verify})
+	@return: the result (failing to verify is not an error)
+	@rtype: L{AuditResult}"""
+	result = AuditResult(path, required_digest)
+	verified_files = _get_ledger(full)
+	start = time.time()
+	try:
+		try:
+			if verified_files is not None:
+				verified_files.stats = ledger.LedgerStats()
+			manifest.verify(path, required_digest, verified_files, workers)
+		except BadDigest, ex:
+			result.error = str(ex)
+			result.detail = ex.detail
+	finally:
+		result.seconds = time.time() - start
+	if verified_files is not None:
+		stats = verified_files.stats
+		result.files_read, result.bytes_read = stats.hashed_files, stats.hashed_bytes
+		result.files_reused, result.bytes_reused = stats.reused_files, stats.reused_bytes
+	else:
+		result.files_read, result.bytes_read = _count_files(path)
+	return result
+
+def _audit_in_worker((path, required_digest, full)):
+	return audit_implementation(path, required_digest, full, workers = 1)
+
+def audit(items, full = False, workers = None):
+	"""Verify several implementations, using a pool of processes if there are
+	enough CPUs.
+	@param items: the implementations to check, as (path, required_digest) pairs
+	@param full: hash every file, even if it hasn't changed since it was last checked
+	@param workers: the number of processes to use (default: L{manifest.get_workers})
+	@return: the results, in the order in which they finish
+	@rtype: iter(L{AuditResult})"""
+	if workers is None:
+		workers = manifest.get_workers()
+	if workers < 2 or len(items) < 2 or manifest.multiprocessing is None:
+		return _audit_here(items, full)
+	return _audit_in_pool(items, full, min(workers, len(items)))
+
+def _audit_here(items, full):
+	for path, required_digest in items:
+		yield audit_implementation(path, required_digest, full)
+
+def _audit_in_pool(items, full, workers):
+	pool = manifest.multiprocessing.Pool(workers)
+	try:
+		jobs = [(path, required_digest, full) for path, required_digest in items]
+		for result in pool.imap_unordered(_audit_in_worker, jobs):
+			yield result
+	except:
+		pool.terminate()
+		pool.join()
+		raise
+	pool.close()
+	pool.join()
@@ -4,8 +4,9 @@
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _
-import sys, os
-from zeroinstall.zerostore.manifest import verify, get_algorithm, copy_tree_with_verify
+import sys, os, time
+from zeroinstall.zerostore import manifest
+from zeroinstall.zerostore.manifest import verify, get_algorithm, copy_tree_with_verify, generate_manifest_parallel
 from zeroinstall import zerostore, SafeException, support
 
 stores = None
@@ -15,6 +16,8 @@ def init_stores():
 	assert stores is None
 	if stores is None:
 		stores = zerostore.Stores()
+	# We don't run a GTK main loop (except for 'manage'), so it's safe to hash in worker processes
+	manifest.parallel_by_default = True
 
 class UsageError(SafeException): pass
 
@@ -31,7 +34,7 @@ def do_manifest(args):
 		else:
 			alg = get_algorithm('sha1new')
 	digest = alg.new_digest()
-	for line in alg.generate_manifest(args[0]):
+	for line in generate_manifest_parallel(alg, args[0]):
 		print line
 		digest.update(line + '\n')
 	print alg.getID(digest)
@@ -79,37 +82,74 @@ def do_add(args):
 		raise UsageError(_("No such file or directory '%s'") % args[1])
 
 def do_optimise(args):
-	"""optimise [ CACHE ]"""
-	if len(args) == 1:
-		cache_dir = args[0]
+	"""optimise [--dry-run] [ CACHE ... ]"""
+	dry_run = '--dry-run' in args
+	args = [arg for arg in args if arg != '--dry-run']
+	if args:
+		cache_dirs = args
 	else:
-		cache_dir = stores.stores[0].dir
-	
-	cache_dir = os.path.realpath(cache_dir)
+		cache_dirs = [stores.stores[0].dir]
 
 	import stat
-	info = os.stat(cache_dir)
-	if not stat.S_ISDIR(info.st_mode):
-		raise UsageError(_("Not a directory: '%s'") % cache_dir)
+	for i, cache_dir in enumerate(cache_dirs):
+		cache_dir = os.path.realpath(cache_dir)
+
+		info = os.stat(cache_dir)
+		if not stat.S_ISDIR(info.st_mode):
+			raise UsageError(_("Not a directory: '%s'") % cache_dir)
 
-	impl_name = os.path.basename(cache_dir)
-	if impl_name != 'implementations':
-		raise UsageError(_("Cache directory should be named 'implementations', not\n"
-				"'%(name)s' (in '%(cache_dir)s')") % {'name': impl_name, 'cache_dir': cache_dir})
+		impl_name = os.path.basename(cache_dir)
+		if impl_name != 'implementations':
+			raise UsageError(_("Cache directory should be named 'implementations', not\n"
+					"'%(name)s' (in '%(cache_dir)s')") % {'name': impl_name, 'cache_dir': cache_dir})
+		cache_dirs[i] = cache_dir
 
-	print _("Optimising"), cache_dir
+	for cache_dir in cache_dirs:
+		print _("Optimising"), cache_dir
 
 	import optimise
-	uniq_size, dup_size, already_linked, man_size = optimise.optimise(cache_dir)
-	print _("Original size  : %(size)s (excluding the %(manifest_size)s of manifests)") % {'size': support.pretty_size(uniq_size + dup_size), 'manifest_size': support.pretty_size(man_size)}
-	print _("Already saved  : %s") % support.pretty_size(already_linked)
+	stats = optimise.optimise(cache_dirs, dry_run = dry_run)
+	uniq_size, dup_size = stats.uniq_size, stats.dup_size
+	print _("Original size  : %(size)s (excluding the %(manifest_size)s of manifests)") % {'size': support.pretty_size(uniq_size + dup_size), 'manifest_size': support.pretty_size(stats.man_size)}
+	print _("Already saved  : %s") % support.pretty_size(stats.already_linked)
+	if stats.skipped_impls:
+		print _("Implementations optimised previously (not checked again): %d") % stats.skipped_impls
 	if dup_size == 0:
 		print _("No duplicates found; no changes made.")
 	else:
 		print _("Optimised size : %s") % support.pretty_size(uniq_size)
 		perc = (100 * float(dup_size)) / (uniq_size + dup_size)
-		print _("Space freed up : %(size)s (%(percentage).2f%%)") % {'size': support.pretty_size(dup_size), 'percentage': perc}
-	print _("Optimisation complete.")
+		if dry_run:
+			print _("Space to free  : %(size)s (%(percentage).2f%%)") % {'size': support.pretty_size(dup_size), 'percentage': perc}
+		else:
+			print _("Space freed up : %(size)s (%(percentage).2f%%)") % {'size': support.pretty_size(dup_size), 'percentage': perc}
+	if dry_run:
+		print _("Dry run; no changes made.")
+	else:
+		print _("Optimisation complete.")
+
+def do_dedup(args):
+	"""dedup [--rebuild]"""
+	# New implementations are linked to identical files as they are added;
+	# --rebuild recreates the index from all the stores' manifests
+	if args not in ([], ['--rebuild']):
+		raise UsageError(_("Usage: dedup [--rebuild]"))
+
+	from zeroinstall.zerostore import dedup
+	if dedup.sqlite3 is None:
+		raise SafeException(_("The deduplication index requires Python's sqlite3 module"))
+	index = dedup.DedupIndex()
+	try:
+		if args:
+			print _("Rebuilding"), index.path
+			n = index.rebuild([store.dir for store in stores.stores])
+			print _("Indexed implementations: %d") % n
+		files, size = index.get_savings()
+		print _("Indexed files  : %d") % index.count_files()
+		print _("Linked files   : %d") % files
+		print _("Space saved    : %s") % support.pretty_size(size)
+	finally:
+		index.close()
 
 def do_verify(args):
 	"""verify (DIGEST | (DIRECTORY [DIGEST])"""
@@ -133,8 +173,26 @@ def do_verify(args):
 			print ex.detail
 			sys.exit(1)
 
+def _format_time(seconds):
+	seconds = int(seconds)
+	return '%d:%02d:%02d' % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
 def do_audit(args):
-	"""audit [DIRECTORY]"""
+	"""audit [--full] [--json=FILE] [DIRECTORY]"""
+	# Files which haven't changed since the last audit aren't read again,
+	# unless --full is given
+	full = '--full' in args
+	json_file = None
+	for arg in args:
+		if arg.startswith('--json='):
+			json_file = arg[7:]
+	args = [arg for arg in args if arg != '--full' and not arg.startswith('--json=')]
+	if json_file is not None:
+		try:
+			import json
+		except ImportError:
+			raise SafeException(_("--json requires Python 2.6 or later"))
+
 	if len(args) == 0:
 		audit_stores = stores.stores
 	else:
@@ -150,9 +208,8 @@ def do_audit(args):
 		elif len(args):
 			raise SafeException(_("No such directory '%s'") % a.dir)
 
-	verified = 0
-	failures = []
 	i = 0
+	to_check = []
 	for root, impls in audit_ls:
 		print _("Scanning %s") % root
 		for required_digest in impls:
@@ -161,20 +218,42 @@ def do_audit(args):
 			if '=' not in required_digest:
 				print _("Skipping non-implementation directory %s") % path
 				continue
-			try:
-				msg = _("[%(done)d / %(total)d] Verifying %(digest)s") % {'done': i, 'total': total, 'digest': required_digest}
-				print msg,
-				sys.stdout.flush()
-				verify(path, required_digest)
-				print "\r" + (" " * len(msg)) + "\r",
-				verified += 1
-			except zerostore.BadDigest, ex:
+			to_check.append((path, required_digest))
+
+	from zeroinstall.zerostore import audit
+	verified = 0
+	failures = []
+	results = []
+	bytes_read = 0
+	start = time.time()
+	msg = ''
+	for result in audit.audit(to_check, full):
+		results.append(result)
+		bytes_read += result.bytes_read
+		elapsed = time.time() - start
+		done = len(results)
+		if result.error is None:
+			verified += 1
+			print "\r" + (" " * len(msg)) + "\r",
+			msg = _("[%(done)d / %(total)d] Verified %(digest)s in %(time).1fs; %(rate)s/s; ETA %(eta)s") % {
+				'done': done, 'total': len(to_check), 'digest': result.digest, 'time': result.seconds,
+				'rate': support.pretty_size(bytes_read / max(elapsed, 0.001)),
+				'eta': _format_time(elapsed * (len(to_check) - done) / done)}
+			print msg,
+			sys.stdout.flush()
+		else:
+			print "\r" + (" " * len(msg)) + "\r",
+			msg = ''
+			failures.append(result.path)
+			print _("[%(done)d / %(total)d] %(digest)s") % {'done': done, 'total': len(to_check), 'digest': result.digest}
+			print result.error
+			if result.detail:
 				print
-				failures.append(path)
-				print str(ex)
-				if ex.detail:
-					print
-					print ex.detail
+				print result.detail
+	if msg:
+		print "\r" + (" " * len(msg)) + "\r",
+	elapsed = time.time() - start
+
 	if failures:
 		print '\n' + _("List of corrupted or modified implementations:")
 		for x in failures:
@@ -183,6 +262,32 @@ def do_audit(args):
 	print _("Checked %d items") % i
 	print _("Successfully verified implementations: %d") % verified
 	print _("Corrupted or modified implementations: %d") % len(failures)
+	print _("Files read: %(files)d (%(size)s); unchanged since the last audit: %(reused_files)d (%(reused_size)s)") % {
+		'files': sum([result.files_read for result in results]), 'size': support.pretty_size(bytes_read),
+		'reused_files': sum([result.files_reused for result in results]),
+		'reused_size': support.pretty_size(sum([result.bytes_reused for result in results]))}
+	print _("Time taken: %(time)s (%(rate)s/s)") % {'time': _format_time(elapsed),
+		'rate': support.pretty_size(bytes_read / max(elapsed, 0.001))}
+
+	from zeroinstall.zerostore import ledger
+	verified_files = ledger.open_ledger()
+	if verified_files is not None:
+		verified_files.forget_missing()
+		verified_files.close()
+
+	if json_file is not None:
+		report = {
+			'checked': i,
+			'verified': verified,
+			'failures': failures,
+			'seconds': elapsed,
+			'bytes_read': bytes_read,
+			'implementations': [result.as_dict() for result in sorted(results, key = lambda r: r.path)],
+		}
+		stream = file(json_file, 'w')
+		json.dump(report, stream, indent = 1, sort_keys = True)
+		stream.close()
+
 	if failures:
 		sys.exit(1)
 
@@ -237,6 +342,7 @@ def do_manage(args):
 	if args:
 		raise UsageError(_("manage command takes no arguments"))
 
+	manifest.parallel_by_default = False	# (can't fork with GTK running)
 	import pygtk
 	pygtk.require('2.0')
 	import gtk
@@ -247,4 +353,4 @@ def do_manage(args):
 	cache_explorer.show()
 	gtk.main()
 
-commands = [do_add, do_audit, do_copy, do_find, do_list, do_manifest, do_optimise, do_verify, do_manage]
+commands = [do_add, do_audit, do_copy, do_dedup, do_find, do_list, do_manifest, do_optimise, do_verify, do_manage]
@@ -0,0 +1,306 @@
+"""
+Hard-links identical files together as implementations are added to a store.
+
+The index records every stored file, keyed by the file's type, digest,
+modification time and size (as given in its implementation's manifest) and
+the device it is on. When a new implementation is stored (see
+L{Store.check_manifest_and_rename}), each of its files which matches an
+indexed file is replaced by a hard-link to it, and all of its files are then
+added to the index. This saves the space that C{0store optimise} would
+otherwise free up later.
+
+An indexed copy is checked before linking to it (it must still exist, with the
+same size, modification time and permissions, and be byte-for-byte identical to
+the new file), so removing or modifying implementations doesn't make the index
+unsafe; stale entries are just dropped. C{0store dedup --rebuild} recreates the
+whole index from the stores' manifests.
+
+The index is an SQLite database in the user's cache.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+from zeroinstall import _
+import os, stat
+from logging import debug, info, warn
+
+try:
+	import sqlite3
+except ImportError:
+	sqlite3 = None
+
+from zeroinstall.support import basedir
+
+# Change this whenever the tables change
+_INDEX_FORMAT = 2
+
+_SCHEMA = """
+CREATE TABLE files (
+	type TEXT, digest TEXT, mtime INTEGER, size INTEGER, dev INTEGER,
+	path TEXT PRIMARY KEY);
+CREATE INDEX files_by_contents ON files (digest, size, mtime, type, dev);
+CREATE TABLE implementations (
+	root TEXT PRIMARY KEY,
+	optimised INTEGER, total_bytes INTEGER,
+	linked_files INTEGER, linked_bytes INTEGER);
+"""
+
+def read_manifest(impl_dir):
+	"""Get the regular files listed in an implementation's manifest.
+	@return: (type, digest, mtime, size, path) for each file, with paths relative to impl_dir,
+	or None if the implementation uses the old 'sha1' algorithm
+	@rtype: [tuple]"""
+	from zeroinstall.zerostore import manifest
+	if os.path.basename(impl_dir).startswith('sha1='):
+		return None		# Old manifest format
+	stream = file(os.path.join(impl_dir, '.manifest'))
+	try:
+		wanted = manifest._parse_manifest(stream.read())
+	finally:
+		stream.close()
+	files = []
+	for path, data in wanted.iteritems():
+		if data[0] in 'FX':
+			itype, digest, mtime, size = data
+			files.append((itype, digest, int(mtime), long(size), path))
+	files.sort(key = lambda f: f[-1])
+	return files
+
+def _usable_copy(info, itype, mtime, size):
+	"""Check that a previously-indexed file hasn't been changed or replaced."""
+	return stat.S_ISREG(info.st_mode) and info.st_size == size and \
+	       int(info.st_mtime) == mtime and bool(info.st_mode & 0111) == (itype == 'X')
+
+class DedupIndex(object):
+	"""The files already stored, and the space saved by linking to them.
+	The methods raise C{sqlite3.Error} if the database can't be used.
+	@ivar path: the database file"""
+
+	def __init__(self, path = None):
+		"""@param path: the database to use (default: C{dedup-index.sqlite} in the injector's cache directory)"""
+		if path is None:
+			path = os.path.join(basedir.save_cache_path('0install.net', 'injector'), 'dedup-index.sqlite')
+		self.path = path
+		self._db = sqlite3.connect(path, timeout = 60)
+		self._db.text_factory = str
+		if self._db.execute('PRAGMA user_version').fetchone()[0] != _INDEX_FORMAT:
+			self._create()
+
+	def _create(self):
+		db = self._db
+		tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+		for (table,) in tables:
+			db.execute('DROP TABLE %s' % table)
+		db.executescript(_SCHEMA)
+		db.execute('PRAGMA user_version = %d' % _INDEX_FORMAT)
+		db.commit()
+
+	def add(self, impl_dir, link = True):
+		"""Add a stored implementation's files to the index. If link is True,
+		files which match indexed files are first replaced by hard-links to
+		them.
+		@param impl_dir: the implementation's directory in a store
+		@param link: whether to link duplicate files
+		@return: the number and total size of this implementation's files which share their
+		inode with another copy (whether just linked or already linked)
+		@rtype: (int, int)"""
+		from zeroinstall.zerostore import optimise
+		impl_dir = os.path.abspath(impl_dir)
+		files = read_manifest(impl_dir)
+		if files is None:
+			return (0, 0)
+		dev = os.lstat(impl_dir).st_dev
+
+		linked_files = linked_bytes = 0
+		first_copies = {}	# Key -> (path, lstat details) of the copy to link to, or None
+		stale = []		# Indexed paths which can't be used any longer
+		to_link = {}		# Directory -> [(first copy, file, size)]
+		for itype, digest, mtime, size, path in files:
+			full = os.path.join(impl_dir, path)
+			key = (itype, digest, mtime, size, dev)
+			if key not in first_copies:
+				first_copies[key] = self.find_copy(key, impl_dir, stale)
+			this = os.lstat(full)
+			if first_copies[key] is None:
+				first_copies[key] = (full, this)
+				continue
+			first_path, first = first_copies[key]
+			if (first.st_dev, first.st_ino) == (this.st_dev, this.st_ino):
+				linked_files += 1
+				linked_bytes += size
+			elif link:
+				if not optimise._byte_identical(first_path, full):
+					warn(_("Files should be identical, but they're not!\n%(file_a)s\n%(file_b)s"), {'file_a': first_path, 'file_b': full})
+					if not first_path.startswith(impl_dir + '/'):
+						stale.append(first_path)	# Link later copies to this one instead
+						first_copies[key] = (full, this)
+					continue
+				to_link.setdefault(os.path.dirname(full), []).append((first_path, full, size))
+
+		for dir, links in to_link.iteritems():
+			n_files, n_bytes = _link_all(os.path.dirname(impl_dir), dir, links)
+			linked_files += n_files
+			linked_bytes += n_bytes
+
+		self.record(impl_dir, dev, files, stale, linked_files, linked_bytes, optimised = link)
+		if linked_files:
+			info(_("%(impl)s shares %(files)d files (%(size)d bytes) with other implementations"),
+				{'impl': impl_dir, 'files': linked_files, 'size': linked_bytes})
+		return (linked_files, linked_bytes)
+
+	def record(self, impl_dir, dev, files, stale, linked_files, linked_bytes, optimised):
+		"""Index an implementation's files, replacing any previous record of it.
+		@param impl_dir: the implementation's directory (an absolute path)
+		@param dev: the device impl_dir is on
+		@param files: the files in its manifest (see L{read_manifest})
+		@param stale: indexed paths to forget (see L{find_copy})
+		@param linked_files: the number of its files which share their inode with another copy
+		@param linked_bytes: the total size of those files
+		@param optimised: whether its duplicate files have been linked"""
+		db = self._db
+		try:
+			db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in stale])
+			db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+				[(itype, digest, mtime, size, dev, os.path.join(impl_dir, path))
+				 for itype, digest, mtime, size, path in files])
+			db.execute('INSERT OR REPLACE INTO implementations VALUES (?, ?, ?, ?, ?)',
+				(impl_dir, int(optimised), sum([f[3] for f in files]), linked_files, linked_bytes))
+			db.commit()
+		except:
+			db.rollback()
+			raise
+
+	def find_copy(self, key, impl_dir, stale):
+		"""Find an indexed copy of a file, outside impl_dir, which is still usable.
+		Unusable copies are added to stale.
+		@param key: the file's (type, digest, mtime, size, device)
+		@param impl_dir: the implementation being added, or None to allow copies anywhere
+		@return: the copy's path and lstat details, or None
+		@rtype: (str, posix.stat_result)"""
+		itype, digest, mtime, size, dev = key
+		for (path,) in self._db.execute('SELECT path FROM files WHERE type = ? AND digest = ? AND mtime = ? AND size = ? AND dev = ?', key):
+			if impl_dir is not None and path.startswith(impl_dir + '/'):
+				continue
+			try:
+				details = os.lstat(path)
+			except OSError:
+				details = None
+			if details is not None and _usable_copy(details, itype, mtime, size):
+				return (path, details)
+			debug(_("Forgetting stale index entry %s"), path)
+			stale.append(path)
+		return None
+
+	def get_implementations(self):
+		"""Get the implementations which have been indexed.
+		@return: root -> (optimised, total_bytes, linked_bytes)
+		@rtype: {str: (bool, int, int)}"""
+		impls = {}
+		for row in self._db.execute('SELECT root, optimised, total_bytes, linked_bytes FROM implementations'):
+			impls[row[0]] = (bool(row[1]), row[2], row[3])
+		return impls
+
+	def get_savings(self):
+		"""Get the total space saved in implementations which are still stored.
+		@return: the number and total size of files which share their inode with another stored copy
+		@rtype: (int, int)"""
+		files = size = 0
+		for root, linked_files, linked_bytes in self._db.execute('SELECT root, linked_files, linked_bytes FROM implementations'):
+			if os.path.isdir(root):
+				files += linked_files
+				size += linked_bytes
+		return (files, size)
+
+	def count_files(self):
+		"""@return: the number of files in the index
+		@rtype: int"""
+		return self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+	def rebuild(self, store_dirs):
+		"""Recreate the index from the manifests of every implementation in
+		the given stores. Nothing is linked; the savings are recounted from the
+		files which are already linked. The implementations aren't marked as
+		optimised, so C{0store optimise} will check them again.
+		@param store_dirs: the stores' directories
+		@type store_dirs: [str]
+		@return: the number of implementations indexed
+		@rtype: int"""
+		self._create()
+		n = 0
+		for store_dir in store_dirs:
+			if not os.path.isdir(store_dir):
+				continue
+			for leaf in sorted(os.listdir(store_dir)):
+				if leaf.startswith('.') or '=' not in leaf:
+					continue
+				impl_dir = os.path.join(store_dir, leaf)
+				try:
+					self.add(impl_dir, link = False)
+				except (OSError, IOError), ex:
+					warn(_("Skipping '%(impl)s': %(exception)s"), {'impl': impl_dir, 'exception': ex})
+					continue
+				n += 1
+		return n
+
+	def close(self):
+		self._db.close()
+
+def _link_all(store_dir, dir, links):
+	"""Replace files in dir with hard-links to identical copies.
+	The directory is made writable only while this is done.
+	@return: the number and total size of the files replaced
+	@rtype: (int, int)"""
+	tmpfile = os.path.join(store_dir, 'tmp-dedup-%d' % os.getpid())
+	linked_files = linked_bytes = 0
+	old_mode = os.lstat(dir).st_mode
+	os.chmod(dir, old_mode | 0200)	# Need write access briefly
+	try:
+		for first, full, size in links:
+			try:
+				if os.path.lexists(tmpfile):
+					os.unlink(tmpfile)
+				os.link(first, tmpfile)
+				try:
+					os.rename(tmpfile, full)
+				except:
+					os.unlink(tmpfile)
+					raise
+			except OSError, ex:
+				# E.g. too many links to the indexed copy
+				info(_("Can't link '%(file)s' to '%(first)s': %(exception)s"), {'file': full, 'first': first, 'exception': ex})
+				continue
+			linked_files += 1
+			linked_bytes += size
+	finally:
+		os.chmod(dir, old_mode)
+	return (linked_files, linked_bytes)
+
+def open_index():
+	"""Open the default index.
+	@return: the index, or None if it can't be used (e.g. if Python has no sqlite3 module)
+	@rtype: L{DedupIndex}"""
+	if sqlite3 is None:
+		info(_("No sqlite3 module; duplicate files won't be linked"))
+		return None
+	try:
+		return DedupIndex()
+	except sqlite3.Error, ex:
+		warn(_("Can't open the deduplication index: %s"), ex)
+		return None
+
+def add_to_index(impl_dir):
+	"""Link a newly-stored implementation's files to any identical ones already
+	stored, and index the rest. Failures are only logged, since the
+	implementation itself has already been stored successfully.
+	@param impl_dir: the implementation's directory in a store"""
+	index = open_index()
+	if index is None:
+		return
+	try:
+		try:
+			index.add(impl_dir)
+		except (sqlite3.Error, OSError, IOError), ex:
+			warn(_("Failed to link duplicate files in '%(impl)s': %(exception)s"), {'impl': impl_dir, 'exception': ex})
+	finally:
+		index.close()
@@ -0,0 +1,154 @@
+"""
+Records the digests of files which have already been hashed, so that
+auditing a store doesn't need to read every file again.
+
+For each regular file in an implementation, the ledger stores its inode,
+size, modification time and change time along with its digest. When the
+implementation is next verified (see L{manifest.verify}), a file whose
+details are all unchanged isn't read again; its recorded digest is used
+instead. Rewriting a file in place changes its change time, which can't be
+set back, so a modified file is always hashed again. Files changed within
+the last second aren't recorded, since their times might not change again.
+
+The ledger is an SQLite database in the user's cache. Several processes may
+use it at once; each implementation's files are replaced in a single
+transaction.
+"""
+
+# Copyright (C) 2010, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+from zeroinstall import _
+import os
+from logging import debug, info, warn
+
+try:
+	import sqlite3
+except ImportError:
+	sqlite3 = None
+
+from zeroinstall.support import basedir
+
+# Change this whenever the tables change
+_LEDGER_FORMAT = 1
+
+_SCHEMA = """
+CREATE TABLE files (
+	root TEXT, path TEXT, alg TEXT,
+	inode INTEGER, size INTEGER, mtime REAL, ctime REAL,
+	digest TEXT,
+	PRIMARY KEY (root, path));
+"""
+
+class LedgerStats(object):
+	"""Counts the files whose digests were reused or calculated.
+	@ivar reused_files: files whose recorded digests were used
+	@ivar reused_bytes: the total size of those files
+	@ivar hashed_files: files which had to be read
+	@ivar hashed_bytes: the total size of those files"""
+	__slots__ = ['reused_files', 'reused_bytes', 'hashed_files', 'hashed_bytes']
+
+	def __init__(self):
+		self.reused_files = self.reused_bytes = 0
+		self.hashed_files = self.hashed_bytes = 0
+
+	def add(self, reused_files, reused_bytes, hashed_files, hashed_bytes):
+		self.reused_files += reused_files
+		self.reused_bytes += reused_bytes
+		self.hashed_files += hashed_files
+		self.hashed_bytes += hashed_bytes
+
+	def as_dict(self):
+		"""@return: all the counters, as plain Python values
+		@rtype: dict"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+class Ledger(object):
+	"""The digests of previously-hashed files.
+	The methods raise C{sqlite3.Error} if the database can't be used, except
+	for L{record}, which just warns (the digests can always be calculated again).
+	@ivar path: the database file
+	@ivar reuse: whether to use the recorded digests; if False, every file is
+	hashed again, but the ledger is still updated (e.g. for C{0store audit --full})
+	@ivar stats: how many files were reused or hashed
+	@type stats: L{LedgerStats}"""
+
+	def __init__(self, path = None):
+		"""@param path: the database to use (default: C{verified-files.sqlite} in the injector's cache directory)"""
+		if path is None:
+			path = os.path.join(basedir.save_cache_path('0install.net', 'injector'), 'verified-files.sqlite')
+		self.path = path
+		self.reuse = True
+		self.stats = LedgerStats()
+		self._db = sqlite3.connect(path, timeout = 60)
+		self._db.text_factory = str
+		if self._db.execute('PRAGMA user_version').fetchone()[0] != _LEDGER_FORMAT:
+			self._create()
+
+	def _create(self):
+		db = self._db
+		tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+		for (table,) in tables:
+			db.execute('DROP TABLE %s' % table)
+		db.executescript(_SCHEMA)
+		db.execute('PRAGMA user_version = %d' % _LEDGER_FORMAT)
+		db.commit()
+
+	def get_files(self, root, alg_name):
+		"""Get the recorded files in an implementation.
+		@param root: the implementation's directory
+		@param alg_name: the name of the algorithm that will be used
+		@return: path (relative to root) -> (inode, size, mtime, ctime, digest); empty if L{reuse} is False
+		@rtype: {str: tuple}"""
+		if not self.reuse:
+			return {}
+		files = {}
+		for row in self._db.execute('SELECT path, inode, size, mtime, ctime, digest FROM files WHERE root = ? AND alg = ?',
+					    (os.path.abspath(root), alg_name)):
+			files[row[0]] = row[1:]
+		return files
+
+	def record(self, root, alg_name, files):
+		"""Replace the recorded files for an implementation.
+		@param root: the implementation's directory
+		@param alg_name: the name of the algorithm used
+		@param files: (path, inode, size, mtime, ctime, digest) for each file, with paths relative to root"""
+		root = os.path.abspath(root)
+		db = self._db
+		try:
+			db.execute('DELETE FROM files WHERE root = ?', (root,))
+			db.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+				[(root, path, alg_name, inode, size, mtime, ctime, digest)
+				 for path, inode, size, mtime, ctime, digest in files])
+			db.commit()
+		except sqlite3.Error, ex:
+			db.rollback()
+			warn(_("Failed to update ledger %(path)s: %(exception)s"), {'path': self.path, 'exception': ex})
+
+	def forget_missing(self):
+		"""Remove the records for implementations which no longer exist.
+		@return: the number of implementations forgotten
+		@rtype: int"""
+		db = self._db
+		missing = [root for (root,) in db.execute('SELECT DISTINCT root FROM files') if not os.path.isdir(root)]
+		for root in missing:
+			debug(_("Forgetting missing implementation %s"), root)
+			db.execute('DELETE FROM files WHERE root = ?', (root,))
+		db.commit()
+		return len(missing)
+
+	def close(self):
+		self._db.close()
+
+def open_ledger():
+	"""Open the default ledger.
+	@return: the ledger, or None if it can't be used (e.g. if Python has no sqlite3 module)
+	@rtype: L{Ledger}"""
+	if sqlite3 is None:
+		info(_("No sqlite3 module; the verification ledger is not available"))
+		return None
+	try:
+		return Ledger()
+	except sqlite3.Error, ex:
+		warn(_("Can't open the verification ledger: %s"), ex)
+		return None
@@ -25,10 +25,17 @@ A top-level ".manifest" file is ignored.
 # See the README file for details, or visit http://0install.net.
 
 from __future__ import generators
-import os, stat
+import os, stat, time
+from logging import debug, warn
 from zeroinstall import SafeException, _
+from zeroinstall.support import basedir
 from zeroinstall.zerostore import BadDigest
 
+try:
+	import multiprocessing
+except ImportError:
+	multiprocessing = None	# Python < 2.6
+
 try:
 	import hashlib
 	sha1_new = hashlib.sha1
@@ -37,6 +44,78 @@ except:
 	sha1_new = sha.new
 	hashlib = None
 
+# Files are hashed this many bytes at a time, so that large files don't need
+# to fit in memory
+BLOCK_SIZE = 64 * 1024
+
+def _hash_file(new_digest, path):
+	"""@return: the digest of the contents of the file at path
+	@param new_digest: the constructor for digest objects"""
+	digest = new_digest()
+	stream = file(path, 'rb')
+	try:
+		read = stream.read
+		update = digest.update
+		while True:
+			data = read(BLOCK_SIZE)
+			if not data: break
+			update(data)
+	finally:
+		stream.close()
+	return digest
+
+def _hash_files(alg, entries):
+	"""Turn the entries from an algorithm's _walk into manifest lines, hashing
+	each file in this process."""
+	for entry in entries:
+		if isinstance(entry, tuple):
+			prefix, path, info, suffix = entry
+			yield prefix + _hash_file(alg.new_digest, path).hexdigest() + suffix
+		else:
+			yield entry
+
+def _hash_in_worker((alg_name, path)):
+	return _hash_file(algorithms[alg_name].new_digest, path).hexdigest()
+
+# Set this to override the number of processes used to hash files (see L{get_workers})
+workers = None
+
+# Whether to use one process per CPU if the number isn't configured. Forking a
+# process with a GTK main loop (or other threads) running isn't safe, so only
+# programs which know they don't have one set this (e.g. 0store; see
+# L{cli.init_stores})
+parallel_by_default = False
+
+# Trees smaller than this are hashed in this process; starting the workers would take longer
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+def get_workers():
+	"""Get the number of processes to use when hashing files for a manifest.
+	This is L{workers}, if set. Otherwise, it is read from the
+	C{0install.net/injector/manifest-workers} configuration file (use 0 there
+	for one process per CPU). If that doesn't exist, files are hashed in this
+	process, unless L{parallel_by_default} is set.
+	@rtype: int"""
+	global workers
+	if workers is None:
+		configured = None
+		path = basedir.load_first_config('0install.net', 'injector', 'manifest-workers')
+		if path:
+			try:
+				configured = int(file(path).read().strip() or 0)
+			except Exception, ex:
+				warn(_("Error reading '%(path)s': %(exception)s"), {'path': path, 'exception': ex})
+		if configured is None and not parallel_by_default:
+			workers = 1
+		elif configured >= 1:
+			workers = configured
+		else:
+			try:
+				workers = multiprocessing.cpu_count()
+			except (AttributeError, NotImplementedError):
+				workers = 1
+	return workers
+
 class Algorithm:
 	"""Abstract base class for algorithms.
 	An algorithm knows how to generate a manifest from a directory tree.
@@ -57,7 +136,14 @@ class Algorithm:
 
 class OldSHA1(Algorithm):
 	"""@deprecated: Injector versions before 0.20 only supported this algorithm."""
+	name = 'sha1'
+
 	def generate_manifest(self, root):
+		return _hash_files(self, self._walk(root))
+
+	def _walk(self, root):
+		"""Like L{generate_manifest}, but regular files are yielded as
+		(prefix, path, lstat_result, suffix) tuples, to be hashed by the caller."""
 		def recurse(sub):
 			# To ensure that a line-by-line comparison of the manifests
 			# is possible, we require that filenames don't contain newlines.
@@ -85,11 +171,11 @@ class OldSHA1(Algorithm):
 			assert sub[1:]
 			leaf = os.path.basename(sub[1:])
 			if stat.S_ISREG(m):
-				d = sha1_new(file(full).read()).hexdigest()
 				if m & 0111:
-					yield "X %s %s %s %s" % (d, int(info.st_mtime) ,info.st_size, leaf)
+					type = "X "
 				else:
-					yield "F %s %s %s %s" % (d, int(info.st_mtime) ,info.st_size, leaf)
+					type = "F "
+				yield (type, full, info, " %s %s %s" % (int(info.st_mtime) ,info.st_size, leaf))
 			elif stat.S_ISLNK(m):
 				target = os.readlink(full)
 				d = sha1_new(target).hexdigest()
@@ -107,6 +193,92 @@ class OldSHA1(Algorithm):
 	def getID(self, digest):
 		return 'sha1=' + digest.hexdigest()
 
+def generate_manifest_parallel(alg, root, workers = None, ledger = None):
+	"""Like C{alg.generate_manifest(root)}, but with the files hashed by a
+	pool of worker processes. The tree is scanned first; the lines are then
+	yielded in the usual order as the digests arrive, giving exactly the
+	same manifest.
+	@param alg: the algorithm to use
+	@type alg: L{Algorithm}
+	@param workers: the number of processes to use (default: L{get_workers}); 1
+	means hash everything in this process, as C{generate_manifest} does
+	@param ledger: if given, files which haven't changed since their digests
+	were recorded in it aren't hashed again, and the ledger is updated once
+	the whole manifest has been generated
+	@type ledger: L{ledger.Ledger}"""
+	if workers is None:
+		workers = get_workers()
+	if multiprocessing is None:
+		workers = 1
+	if not hasattr(alg, '_walk') or (workers < 2 and ledger is None):
+		return alg.generate_manifest(root)
+	return _generate_manifest(alg, root, workers, ledger)
+
+def _file_details(info):
+	"""The details of a file which must be unchanged for its recorded digest to be reused."""
+	return (info.st_ino, info.st_size, info.st_mtime, info.st_ctime)
+
+def _generate_manifest(alg, root, workers, ledger):
+	entries = list(alg._walk(root))
+	files = [entry for entry in entries if isinstance(entry, tuple)]
+
+	# (the ledger records paths relative to root)
+	skip = len(os.path.join(root, ''))
+
+	digests = {}		# Path -> digest, for files we don't need to hash
+	if ledger is not None:
+		recorded = ledger.get_files(root, alg.name)
+		if recorded:
+			for prefix, path, info, suffix in files:
+				old = recorded.get(path[skip:], None)
+				if old is not None and old[:4] == _file_details(info):
+					digests[path] = old[4]
+	todo = [entry for entry in files if entry[1] not in digests]
+
+	size = sum([entry[2].st_size for entry in todo])
+	if ledger is not None:
+		ledger.stats.add(len(files) - len(todo), sum([entry[2].st_size for entry in files]) - size, len(todo), size)
+	if workers >= 2 and len(todo) >= 2 and size >= PARALLEL_MIN_BYTES:
+		new_digests = _hash_in_pool(alg, [entry[1] for entry in todo], min(workers, len(todo)))
+	else:
+		new_digests = _hash_here(alg, [entry[1] for entry in todo])
+
+	for entry in entries:
+		if isinstance(entry, tuple):
+			prefix, path, info, suffix = entry
+			digest = digests.get(path, None)
+			if digest is None:
+				digest = digests[path] = new_digests.next()
+			yield prefix + digest + suffix
+		else:
+			yield entry
+
+	if ledger is not None:
+		# A file changed within the current second might change again without
+		# its (coarse) times changing, so don't record it
+		limit = int(time.time()) - 1
+		ledger.record(root, alg.name, [(path[skip:],) + _file_details(info) + (digests[path],)
+				for prefix, path, info, suffix in files
+				if info.st_mtime < limit and info.st_ctime < limit])
+
+def _hash_here(alg, paths):
+	for path in paths:
+		yield _hash_file(alg.new_digest, path).hexdigest()
+
+def _hash_in_pool(alg, paths, workers):
+	debug(_("Hashing %(files)d files with %(workers)d processes"), {'files': len(paths), 'workers': workers})
+	pool = multiprocessing.Pool(workers)
+	try:
+		jobs = [(alg.name, path) for path in paths]
+		for digest in pool.imap(_hash_in_worker, jobs, max(1, len(jobs) // (workers * 8))):
+			yield digest
+	except:
+		pool.terminate()
+		pool.join()
+		raise
+	pool.close()
+	pool.join()
+
 def get_algorithm(name):
 	"""Look-up an L{Algorithm} by name.
 	@raise BadDigest: if the name is unknown."""
@@ -123,28 +295,38 @@ def add_manifest_file(dir, digest_or_alg):
 	"""Writes a .manifest file into 'dir', and returns the digest.
 	You should call fixup_permissions before this to ensure that the permissions are correct.
 	On exit, dir itself has mode 555. Subdirectories are not changed.
+	Each line is written (and digested) as soon as it is generated, so the
+	whole manifest is never held in memory.
 	@param dir: root of the implementation
 	@param digest_or_alg: should be an instance of Algorithm. Passing a digest
 	here is deprecated."""
 	mfile = os.path.join(dir, '.manifest')
 	if os.path.islink(mfile) or os.path.exists(mfile):
 		raise SafeException(_("Directory '%s' already contains a .manifest file!") % dir)
-	manifest = ''
 	if isinstance(digest_or_alg, Algorithm):
 		alg = digest_or_alg
 		digest = alg.new_digest()
 	else:
 		digest = digest_or_alg
 		alg = get_algorithm('sha1')
-	for line in alg.generate_manifest(dir):
-		manifest += line + '\n'
-	digest.update(manifest)
 
+	# (the algorithms all ignore the top-level .manifest while we write it)
+	old_mode = stat.S_IMODE(os.stat(dir).st_mode)
 	os.chmod(dir, 0755)
 	stream = file(mfile, 'w')
 	os.chmod(dir, 0555)
-	stream.write(manifest)
-	stream.close()
+	try:
+		for line in generate_manifest_parallel(alg, dir):
+			line += '\n'
+			digest.update(line)
+			stream.write(line)
+		stream.close()
+	except:
+		stream.close()
+		os.chmod(dir, 0755)
+		os.unlink(mfile)
+		os.chmod(dir, old_mode)
+		raise
 	os.chmod(mfile, 0444)
 	return digest
 
@@ -176,7 +358,7 @@ def copy_with_verify(src, dest, mode, alg, required_digest):
 	try:
 		digest = alg.new_digest()
 		while True:
-			data = src_obj.read(256)
+			data = src_obj.read(BLOCK_SIZE)
 			if not data: break
 			digest.update(data)
 			while data:
@@ -193,30 +375,28 @@ def copy_with_verify(src, dest, mode, alg, required_digest):
 			 "Expected: %(required_digest)s\n"
 			 "Actual:   %(actual_digest)s") % {'src': src, 'required_digest': required_digest, 'actual_digest': actual})
 
-def verify(root, required_digest = None):
+def verify(root, required_digest = None, ledger = None, workers = None):
 	"""Ensure that directory 'dir' generates the given digest.
 	For a non-error return:
 	 - Dir's name must be a digest (in the form "alg=value")
 	 - The calculated digest of the contents must match this name.
 	 - If there is a .manifest file, then its digest must also match.
+	@param ledger: digests of files checked previously (see L{generate_manifest_parallel})
+	@type ledger: L{ledger.Ledger}
+	@param workers: the number of processes to hash files with (see L{generate_manifest_parallel})
 	@raise BadDigest: if verification fails."""
 	if required_digest is None:
 		required_digest = os.path.basename(root)
 	alg = splitID(required_digest)[0]
 
 	digest = alg.new_digest()
-	lines = []
-	for line in alg.generate_manifest(root):
-		line += '\n'
-		digest.update(line)
-		lines.append(line)
+	for line in generate_manifest_parallel(alg, root, workers, ledger):
+		digest.update(line + '\n')
 	actual_digest = alg.getID(digest)
 
 	manifest_file = os.path.join(root, '.manifest')
 	if os.path.isfile(manifest_file):
-		digest = alg.new_digest()
-		digest.update(file(manifest_file).read())
-		manifest_digest = alg.getID(digest)
+		manifest_digest = alg.getID(_hash_file(alg.new_digest, manifest_file))
 	else:
 		manifest_digest = None
 
@@ -236,6 +416,8 @@ def verify(root, required_digest = None):
 		error.detail += _("The .manifest file matches the actual contents. Very strange!")
 	elif manifest_digest == required_digest:
 		import difflib
+		# (only needed for this report, so generated again rather than kept)
+		lines = [line + '\n' for line in alg.generate_manifest(root)]
 		diff = difflib.unified_diff(file(manifest_file).readlines(), lines,
 					    'Recorded', 'Actual')
 		error.detail += _("The .manifest file matches the directory name.\n" \
@@ -423,6 +605,11 @@ class HashLibAlgorithm(Algorithm):
 			self.name = name
 
 	def generate_manifest(self, root):
+		return _hash_files(self, self._walk(root))
+
+	def _walk(self, root):
+		"""Like L{generate_manifest}, but regular files are yielded as
+		(prefix, path, lstat_result, suffix) tuples, to be hashed by the caller."""
 		def recurse(sub):
 			# To ensure that a line-by-line comparison of the manifests
 			# is possible, we require that filenames don't contain newlines.
@@ -450,11 +637,11 @@ class HashLibAlgorithm(Algorithm):
 				if stat.S_ISREG(m):
 					if leaf == '.manifest': continue
 
-					d = new_digest(file(path).read()).hexdigest()
 					if m & 0111:
-						yield "X %s %s %s %s" % (d, int(info.st_mtime), info.st_size, leaf)
+						type = "X "
 					else:
-						yield "F %s %s %s %s" % (d, int(info.st_mtime), info.st_size, leaf)
+						type = "F "
+					yield (type, path, info, " %s %s %s" % (int(info.st_mtime), info.st_size, leaf))
 				elif stat.S_ISLNK(m):
 					target = os.readlink(path)
 					d = new_digest(target).hexdigest()
@@ -1,4 +1,15 @@
-"""Optimise the cache."""
+"""Optimise the cache.
+
+Duplicate files are replaced by hard-links to a single copy. Candidates are
+found from the implementations' manifests: they are grouped by size, and then
+by type, digest and modification time (only files on the same filesystem can
+be linked). Each duplicate is compared byte-for-byte with the copy it will be
+linked to before it is replaced.
+
+Implementations which have been optimised before are recorded in the
+L{dedup} index, along with where their files are, so later runs only need to
+read the manifests of new implementations.
+"""
 
 # Copyright (C) 2009, Thomas Leonard
 # See the README file for details, or visit http://0install.net.
@@ -7,26 +18,53 @@ from zeroinstall import _
 import os
 from logging import warn
 
-def _already_linked(a, b):
-	ai = os.stat(a)
-	bi = os.stat(b)
-	return (ai.st_dev, ai.st_ino) == (bi.st_dev, bi.st_ino)
+from zeroinstall.zerostore import dedup
+
+# Bytes to read from each file at a time when comparing them
+BUFFER_SIZE = 1024 * 1024
+
+class OptimiseStats(object):
+	"""What L{optimise} found.
+	@ivar uniq_size: the total size of the unique files
+	@ivar dup_size: the total size of the duplicates which were linked (or would be, for a dry run)
+	@ivar already_linked: the total size of the duplicates which were already linked
+	@ivar man_size: the total size of the manifests read
+	@ivar new_impls: the number of implementations checked
+	@ivar skipped_impls: the number of implementations which had already been optimised"""
+	__slots__ = ['uniq_size', 'dup_size', 'already_linked', 'man_size', 'new_impls', 'skipped_impls']
+
+	def __init__(self):
+		self.uniq_size = self.dup_size = self.already_linked = self.man_size = 0
+		self.new_impls = self.skipped_impls = 0
+
+	def as_dict(self):
+		"""@return: all the counters, as plain Python values
+		@rtype: dict"""
+		return dict([(name, getattr(self, name)) for name in self.__slots__])
 
 def _byte_identical(a, b):
 	af = file(a, 'rb')
-	bf = file(b, 'rb')
-	while True:
-		adata = af.read(100)
-		bdata = bf.read(100)
-		if adata != bdata:
-			return False
-		if not adata:
-			return True
+	try:
+		bf = file(b, 'rb')
+		try:
+			while True:
+				adata = af.read(BUFFER_SIZE)
+				bdata = bf.read(BUFFER_SIZE)
+				if adata != bdata:
+					return False
+				if not adata:
+					return True
+		finally:
+			bf.close()
+	finally:
+		af.close()
 
 def _link(a, b, tmpfile):
-	"""Keep 'a', delete 'b' and hard-link to 'a'"""
+	"""Keep 'a', delete 'b' and hard-link to 'a'
+	@return: False if they weren't identical after all (nothing is changed)"""
 	if not _byte_identical(a, b):
 		warn(_("Files should be identical, but they're not!\n%(file_a)s\n%(file_b)s"), {'file_a': a, 'file_b': b})
+		return False
 
 	b_dir = os.path.dirname(b)
 	old_mode = os.lstat(b_dir).st_mode
@@ -40,75 +78,120 @@ def _link(a, b, tmpfile):
 			raise
 	finally:
 		os.chmod(b_dir, old_mode)
+	return True
 
-def optimise(impl_dir):
-	"""Scan an implementation cache directory for duplicate files, and
-	hard-link any duplicates together to save space.
-	@param impl_dir: a $cache/0install.net/implementations directory
-	@type impl_dir: str
-	@return: (unique bytes, duplicated bytes, already linked, manifest size)
-	@rtype: (int, int, int, int)"""
-
-	first_copy = {}		# TypeDigest -> Path
-	dup_size = uniq_size = already_linked = man_size = 0
-
+def _make_tmpfile_name(store_dir):
 	import random
 
 	for x in range(10):
-		tmpfile = os.path.join(impl_dir, 'optimise-%d' % random.randint(0, 1000000))
+		tmpfile = os.path.join(store_dir, 'optimise-%d' % random.randint(0, 1000000))
 		if not os.path.exists(tmpfile):
-			break
+			return tmpfile
+	raise Exception(_("Can't generate unused tempfile name!"))
+
+def optimise(impl_dirs, dry_run = False):
+	"""Scan implementation cache directories for duplicate files, and
+	hard-link any duplicates together to save space.
+	@param impl_dirs: $cache/0install.net/implementations directories (or a single one)
+	@type impl_dirs: [str]
+	@param dry_run: just report the space that would be saved, without changing anything
+	@type dry_run: bool
+	@return: the sizes of the files found
+	@rtype: L{OptimiseStats}"""
+	if isinstance(impl_dirs, basestring):
+		impl_dirs = [impl_dirs]
+	stats = OptimiseStats()
+
+	index = dedup.open_index()
+	if index is None:
+		known = {}
 	else:
-		raise Exception(_("Can't generate unused tempfile name!"))
+		known = index.get_implementations()
 
-	for impl in os.listdir(impl_dir):
-		if impl.startswith('.') or '=' not in impl:
-			warn(_("Skipping non-implementation '%s'"), impl)
-			continue
-		manifest_path = os.path.join(impl_dir, impl, '.manifest')
-		try:
-			ms = file(manifest_path)
-		except OSError, ex:
-			warn(_("Failed to read manifest file '%(manifest_path)s': %(exception)s"), {'manifest': manifest_path, 'exception': str(ex)})
-			continue
-
-		alg = impl.split('=', 1)[0]
-		if alg == 'sha1': continue
-
-		man_size += os.path.getsize(manifest_path)
-
-		dir = ""
-		for line in ms:
-			if line[0] == 'D':
-				itype, path = line.split(' ', 1)
-				assert path.startswith('/')
-				dir = path[1:-1]	# Strip slash and newline
-				continue
-
-			if line[0] == "S":
-				itype, digest, size, rest = line.split(' ', 3)
-				uniq_size += long(size)
-				continue
-
-			assert line[0] in "FX"
-
-			itype, digest, mtime, size, path = line.split(' ', 4)
-			path = path[:-1]	# Strip newline
-			size = long(size)
-
-			key = (itype, digest, mtime, size)
-			loc_path = (impl, dir, path)
-
-			first_loc = first_copy.get(key, None)
-			if first_loc:
-				first_full = os.path.join(impl_dir, *first_loc)
-				new_full = os.path.join(impl_dir, *loc_path)
-				if _already_linked(first_full, new_full):
-					already_linked += size
-				else:
-					_link(first_full, new_full, tmpfile)
-					dup_size += size
-			else:
-				first_copy[key] = loc_path
-				uniq_size += size
-	return (uniq_size, dup_size, already_linked, man_size)
+	try:
+		new_impls = []		# (root, dev, files)
+		for impl_dir in impl_dirs:
+			impl_dir = os.path.abspath(impl_dir)
+			for impl in sorted(os.listdir(impl_dir)):
+				if impl.startswith('.') or '=' not in impl:
+					warn(_("Skipping non-implementation '%s'"), impl)
+					continue
+				root = os.path.join(impl_dir, impl)
+				optimised, total_bytes, linked_bytes = known.get(root, (False, 0, 0))
+				if optimised:
+					stats.skipped_impls += 1
+					stats.uniq_size += total_bytes - linked_bytes
+					stats.already_linked += linked_bytes
+					continue
+
+				manifest_path = os.path.join(root, '.manifest')
+				try:
+					files = dedup.read_manifest(root)
+				except (OSError, IOError), ex:
+					warn(_("Failed to read manifest file '%(manifest_path)s': %(exception)s"), {'manifest_path': manifest_path, 'exception': str(ex)})
+					continue
+				if files is None:
+					continue		# Old 'sha1' algorithm
+
+				stats.man_size += os.path.getsize(manifest_path)
+				stats.new_impls += 1
+				new_impls.append((root, os.lstat(root).st_dev, files))
+
+		# Group the candidates by size, then by contents
+		by_size = {}		# size -> {(type, digest, mtime, size, dev): [(root, full path)]}
+		for root, dev, files in new_impls:
+			for itype, digest, mtime, size, path in files:
+				by_size.setdefault(size, {}).setdefault((itype, digest, mtime, size, dev), []).append(
+					(root, os.path.join(root, path)))
+
+		linked = {}		# root -> [files, bytes] sharing an inode with another copy
+		stale = []		# Indexed paths which can't be used any longer
+		tmpfiles = {}		# Store directory -> temporary name for linking
+		for size, groups in by_size.iteritems():
+			for key, copies in groups.iteritems():
+				first = None
+				if index is not None:
+					first = index.find_copy(key, None, stale)
+				if first is None:
+					first = (copies[0][1], os.lstat(copies[0][1]))
+					stats.uniq_size += size
+				elif first[0] in [full for root, full in copies]:
+					stats.uniq_size += size		# (indexed, but not optimised before)
+				first_path, first_info = first
+
+				for root, full in copies:
+					if full == first_path:
+						continue
+					this = os.lstat(full)
+					if (first_info.st_dev, first_info.st_ino) == (this.st_dev, this.st_ino):
+						stats.already_linked += size
+					elif dry_run:
+						stats.dup_size += size
+						continue
+					else:
+						store_dir = os.path.dirname(root)
+						if store_dir not in tmpfiles:
+							tmpfiles[store_dir] = _make_tmpfile_name(store_dir)
+						try:
+							if not _link(first_path, full, tmpfiles[store_dir]):
+								stats.uniq_size += size
+								continue
+						except OSError, ex:
+							warn(_("Can't link '%(file)s' to '%(first)s': %(exception)s"), {'file': full, 'first': first_path, 'exception': ex})
+							stats.uniq_size += size
+							continue
+						stats.dup_size += size
+					counts = linked.setdefault(root, [0, 0])
+					counts[0] += 1
+					counts[1] += size
+
+		if index is not None and not dry_run:
+			for root, dev, files in new_impls:
+				linked_files, linked_bytes = linked.get(root, (0, 0))
+				index.record(root, dev, files, stale, linked_files, linked_bytes, optimised = True)
+				stale = []		# (only needs forgetting once)
+	finally:
+		if index is not None:
+			index.close()
+
+	return stats
@@ -15,10 +15,16 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import logging
 import subprocess
 import tempfile
 from gettext import gettext as _
 
+try:
+    import json
+except ImportError:
+    json = None     # Python < 2.6; the statistics record isn't logged
+
 import gobject
 
 from zeroinstall.injector import model
@@ -26,6 +32,7 @@ from zeroinstall.injector import download
 from zeroinstall.injector.iface_cache import iface_cache
 from zeroinstall.injector.iface_cache import PendingFeed
 from zeroinstall.injector.policy import Policy
+from zeroinstall.injector.solver import SolverStats
 from zeroinstall.injector.handler import Handler
 from zeroinstall.support import tasks
 from zeroinstall import version
@@ -66,6 +73,8 @@ class Flask(gobject.GObject):
         self._stat_all = 0
         self._stat_processed = 0
         self._cancelled_by_intention = False
+        self._solver_stats = None
+        self._solved_policies = []
 
     def get_cancelled_by_intention(self):
         return self._cancelled_by_intention
@@ -90,6 +99,7 @@ class Flask(gobject.GObject):
                 root.policy.network_use = network_use
             root.policy.handler = self._handler
             root.force = force
+            self._collect_stats(root.policy)
 
             links = []
             if root.policy.need_download():
@@ -104,6 +114,7 @@ class Flask(gobject.GObject):
         def link_new(feed):
             root = _RefreshLink(feed)
             root.policy.handler = self._handler
+            self._collect_stats(root.policy)
             if freshness:
                 root.policy.freshness = freshness
             return (root, [root])
@@ -116,6 +127,7 @@ class Flask(gobject.GObject):
 
         if self.policy.solver.feeds_used is None:
             # solve it at forst
+            self._collect_stats(self.policy)
             self.policy.need_download()
 
         for url in self.policy.solver.feeds_used:
@@ -229,8 +241,29 @@ class Flask(gobject.GObject):
         msg = _('Processed: %s; skipped: %s.') % (self.processed, self.skipped)
         self.emit('verbose', msg)
 
+        if self._solver_stats is not None:
+            solver = self._solver_stats.as_dict()
+            solver['solves'] = sum([i.solves for i in self._solved_policies])
+            record = {'solver': solver,
+                      'iface_cache': iface_cache.stats.as_dict(),
+                      'stores': iface_cache.stores.stats.as_dict()}
+            # One JSON line, so it can be picked out of the log and parsed
+            logger.info('solver-stats %s', json.dumps(record, sort_keys=True))
+            self._solver_stats = None
+            self._solved_policies = []
+
         self._state = 0
 
+    def _collect_stats(self, policy):
+        # Only pay for the counters if the record will be logged
+        if self._solver_stats is None:
+            if json is None or not logger.isEnabledFor(logging.INFO):
+                return
+            self._solver_stats = SolverStats()
+        if policy not in self._solved_policies:
+            policy.solver.stats = self._solver_stats
+            self._solved_policies.append(policy)
+
     @tasks.async
     def _wait(self):
         blockers = [self._stopped, self._cancelled]
@@ -277,6 +310,9 @@ class Flask(gobject.GObject):
 
         logger.debug('Switch to %r.', self._link)
 
+        if self._link.policy is not None:
+            self._collect_stats(self._link.policy)
+
         self._link.connect('verbose',
                 lambda sender, message: self.emit('verbose', message))
 
@@ -351,7 +387,6 @@ class _SolveLink(_Link):
 
         iface_uri = model.canonical_iface_uri(feed)
         self.policy = Policy(iface_uri)
-        self.policy.solver.record_details = True
 
         if seed is not None:
             self.policy.network_use = seed.policy.network_use
@@ -572,12 +607,11 @@ class _BuildLink(_Link):
             msg = _('* done;')
             self.emit('verbose', msg)
 
-        # XXX remove outdated cache values
-        # pylint: disable-msg=W0212
+        # The build has added new implementations to these feeds
         root_iface = iface_cache.get_interface(self._src_uri)
         for feed in root_iface.feeds:
-            del iface_cache._interfaces[feed.uri]
-        del iface_cache._interfaces[root_iface.uri]
+            iface_cache.invalidate(feed.uri)
+        iface_cache.invalidate(root_iface.uri)
 
         return []
 